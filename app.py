@@ -1,53 +1,87 @@
 
 import streamlit as st
+st.set_page_config(page_title="Smart Delivery", layout="wide")
+
 from datetime import date, timedelta
 import time
-import pandas as pd
-from db import fetch_all
-
-from db import (
-    list_customers, list_drivers,
-    add_customer, add_driver,
-    db_healthcheck,
-    list_assignments_for_date, upsert_delivery, delivery_kpis_for_date,
-    create_driver_user,
-    delete_customer, delete_driver, delete_assignment
-)
-from db import authenticate_user
-from db import auto_create_assignments_for_today
-from db import update_customer, renew_subscription, pause_delivery_for_customer
-for key in ["logged_in", "role", "user_id", "driver_id", "last_error"]:
-    if key not in st.session_state:
+
+import profiler
+from profiler import section
+profiler.start_run(profiler.is_requested())
+
+# pandas is only imported by the screens that use it
+pd = profiler.LazyModule("pandas")
+
+with section("import db"):
+    profiler.timed_import("db")
+    from db import fetch_df
+
+    from db import (
+        list_customers, list_drivers,
+        add_customer, add_driver,
+        db_healthcheck,
+        list_assignments_for_date, upsert_delivery, delivery_kpis_for_date,
+        create_driver_user,
+        delete_customer, delete_driver, delete_assignment, closed_days_of,
+        driver_leaderboard, reconcile_owed, bulk_import_customers,
+        reassign_driver_assignments, list_location_drivers, set_location_driver,
+        suggest_location_merges, merge_locations,
+        list_customer_refs, get_customer, list_expired_customers, list_driver_customers,
+        update_driver_capacities, set_location_service_minutes,
+        forecast_deliveries, renewal_rate, list_driver_stops, driver_throughput,
+        list_expiring_customers, delivery_report, close_days, reopen_day, list_closed_days
+    )
+    from db import authenticate_user
+    from db import auto_create_assignments_for_today
+    from db import update_customer, renew_subscription, pause_delivery_for_customer
+    from db import bootstrap_schema, warm_up, DatabaseUnavailable
+    from changes import feed as change_feed, VIEW_REFRESH_SECONDS
+
+if "logged_in" not in st.session_state:
+    for key in ["role", "user_id", "driver_id", "last_error", "admin_mode"]:
         st.session_state[key] = None
-if "admin_mode" not in st.session_state:
-    st.session_state["admin_mode"] = None
-st.session_state["logged_in"] = st.session_state["logged_in"] or False
+    st.session_state["logged_in"] = False
+
+# Wakes a suspended database in the background while the first screen renders.
+warm_up()
 
 # ---------------- LOGIN SCREEN ----------------
 if not st.session_state["logged_in"]:
-    st.title("Smart Delivery Login")
- 
-    username = st.text_input("username")
-    password = st.text_input("password", type="password")
-
-    if st.button("Login"):
-        user = authenticate_user(username, password)
-        if user:
-             st.session_state["logged_in"] = True
-             st.session_state["role"] = user["role"]
-             st.session_state["user_id"] = user["user_id"]
-             st.session_state["driver_id"] = user.get("driver_id")  # driver only
-             # if user["role"] == "admin":
-             #     auto_create_assignments_for_today()
-             st.success(f"Welcome {user['username']} ({user['role']})!")
-             time.sleep(1)
-             st.rerun()
-        else:
-         st.error("Invalid credentials")
-    st.stop()   
-            
+    with section("login"):
+        st.title("Smart Delivery Login")
+
+        username = st.text_input("username")
+        password = st.text_input("password", type="password")
+
+        if st.button("Login"):
+            try:
+                user = authenticate_user(username, password)
+            except DatabaseUnavailable as e:
+                st.error(f"Database is not reachable right now, please try again shortly. ({e})")
+                st.stop()
+            if user:
+                 st.session_state["logged_in"] = True
+                 st.session_state["role"] = user["role"]
+                 st.session_state["user_id"] = user["user_id"]
+                 st.session_state["driver_id"] = user.get("driver_id")  # driver only
+                 # if user["role"] == "admin":
+                 #     auto_create_assignments_for_today()
+                 st.success(f"Welcome {user['username']} ({user['role']})!")
+                 time.sleep(1)
+                 st.rerun()
+            else:
+             st.error("Invalid credentials")
+        st.stop()
+
+# Creates upcoming delivery partitions / new tables once a day per process
+# (after login, so the login screen never waits on a waking database).
+try:
+    with section("bootstrap schema"):
+        bootstrap_schema()
+except Exception as e:
+    st.session_state["last_error"] = str(e)
+
 # ---------------- LOGOUT SECTION ----------------
-st.set_page_config(page_title="Smart Delivery", layout="wide")
 col1, col2 = st.columns([8, 1])
 with col1:
     st.title("Smart Delivery System")
@@ -61,7 +95,8 @@ with col2:
 # ---------------- ROLE-BASED UI LOADING ----------------
 if st.session_state.get("role") == "admin":
     # Removed automatic auto_create_assignments_for_today on UI load
-    tabs = st.tabs(["Admin", "Driver", "Dashboard"])
+    # Rerun on tab switches so tabs[i].open says which tab is showing.
+    tabs = st.tabs(["Admin", "Driver", "Dashboard"], key="admin_tabs", on_change="rerun")
 elif st.session_state.get("role") == "driver":
     tabs = st.tabs(["Driver"])
 else:
@@ -71,7 +106,12 @@ else:
 # ---------------- DIAGNOSTICS (DEBUGGING INFO) ----------------
 st.sidebar.title("Diagnostics")
 if st.sidebar.button("DB Ping"):
-    st.sidebar.write("DB reachable:", db_healthcheck())
+    health = db_healthcheck()
+    if health["ok"]:
+        st.sidebar.success(f"DB reachable in {health['latency_ms']:.0f} ms")
+    else:
+        st.sidebar.error(f"DB unreachable after {health['latency_ms']:.0f} ms: {health['error']}")
+    st.sidebar.caption(f"Circuit breaker: {health['breaker']}")
 
 last_err = st.session_state.get("last_error")
 if last_err:
@@ -80,7 +120,7 @@ if last_err:
 #-------------------- ADMIN TAB - CUSTOMER & DRIVER MANAGEMENT -------------
 
 if st.session_state.get("role") == "admin":
-    with tabs[0]:
+    with tabs[0], section(f"admin: {st.session_state.get('admin_mode') or 'home'}"):
         
         # ---------------- CARD STYLE CUSTOMER MANAGEMENT ----------------
         mode = st.session_state.get("admin_mode")
@@ -112,7 +152,7 @@ if st.session_state.get("role") == "admin":
         if mode == "customer_section":
             st.markdown("### 👤 Customer Management")
 
-            ccols = st.columns(3)
+            ccols = st.columns(4)
             with ccols[0]:
                 if st.button("➕ New Customer", key="cust_add_btn"):
                     st.session_state["admin_mode"] = "add"
@@ -128,6 +168,11 @@ if st.session_state.get("role") == "admin":
                     st.session_state["admin_mode"] = "delete_customer"
                     st.rerun()
 
+            with ccols[3]:
+                if st.button("📥 Bulk Import", key="cust_import_btn"):
+                    st.session_state["admin_mode"] = "bulk_import"
+                    st.rerun()
+
             if st.button("⬅ Back", key="cust_back"):
                 st.session_state["admin_mode"] = None
                 st.rerun()
@@ -155,7 +200,7 @@ if st.session_state.get("role") == "admin":
         elif mode == "driver_section":
             st.markdown("### 🚗 Driver Management")
 
-            dcols = st.columns(2)
+            dcols = st.columns(3)
             with dcols[0]:
                 if st.button("➕ New Driver", key="driver_add_btn"):
                     st.session_state["admin_mode"] = "add_driver"
@@ -166,6 +211,11 @@ if st.session_state.get("role") == "admin":
                     st.session_state["admin_mode"] = "delete_driver"
                     st.rerun()
 
+            with dcols[2]:
+                if st.button("⚙️ Capacity & Shifts", key="driver_capacity_btn"):
+                    st.session_state["admin_mode"] = "driver_capacity"
+                    st.rerun()
+
             if st.button("⬅ Back", key="driver_back"):
                 st.session_state["admin_mode"] = None
                 st.rerun()
@@ -202,48 +252,102 @@ if st.session_state.get("role") == "admin":
                 st.session_state["admin_mode"] = None
                 st.rerun()
 
+        elif mode == "bulk_import":
+            st.markdown('<div class="card"><span class="card-title">Bulk Import Customers</span></div>', unsafe_allow_html=True)
+            st.caption(
+                "CSV columns: full_name, phone_number, address, location, "
+                "subscription_start, subscription_days, plan_name. "
+                "Existing customers are matched by phone number and updated; blank cells "
+                "keep their current values. New customers without a plan get Monthly."
+            )
+
+            upload = st.file_uploader("Customer CSV", type=["csv"], key="bulk_import_file")
+            if upload is not None:
+                try:
+                    df_upload = pd.read_csv(upload, dtype=str, keep_default_na=False, na_values=[""])
+                except Exception as e:
+                    st.error(f"Could not read CSV: {e}")
+                    df_upload = None
+
+                if df_upload is not None:
+                    st.write(f"{len(df_upload)} rows found.")
+                    st.dataframe(df_upload.head(20), use_container_width=True)
+
+                    if st.button("Import Customers", key="bulk_import_btn"):
+                        try:
+                            result = bulk_import_customers(df_upload)
+                            m1, m2, m3, m4 = st.columns(4)
+                            m1.metric("Inserted", result["inserted"])
+                            m2.metric("Updated", result["updated"])
+                            m3.metric("Rejected", result["rejected"])
+                            m4.metric("Rows / sec", f"{result['rows_per_sec']:,.0f}")
+
+                            if not result["errors"].empty:
+                                st.warning("Some rows were rejected:")
+                                st.dataframe(result["errors"], use_container_width=True)
+                                st.download_button(
+                                    label="⬇ Download Error Report (CSV)",
+                                    data=result["errors"].to_csv(index=False),
+                                    file_name="customer_import_errors.csv",
+                                    mime="text/csv",
+                                    key="download_import_errors"
+                                )
+                            else:
+                                st.success("All rows imported successfully.")
+                        except Exception as e:
+                            st.error(f"Bulk import failed: {e}")
+
+            if st.button("⬅ Back", key="bulk_import_back"):
+                st.session_state["admin_mode"] = None
+                st.rerun()
+
         elif mode == "edit":
             st.markdown('<div class="card"><span class="card-title">Edit Existing Customer</span></div>', unsafe_allow_html=True)
-            customers = list_customers()
-            cust_map = {c["full_name"]: c for c in customers}
-            sel = st.selectbox("Select customer", ["-- Select --"] + list(cust_map.keys()), key="edit_card_sel")
-
-            if sel != "-- Select --":
-                c = cust_map[sel]
-                name = st.text_input("Full Name", value=c["full_name"])
-                phone = st.text_input("Phone Number", value=c["phone_number"])
-                addr = st.text_area("Address", value=c["address"])
-                plan = st.text_input("Plan Name", value=c["plan_name"])
-                loc = st.text_input("Location", value=c["location"])
+            cust_names = {c.customer_id: c.full_name for c in list_customer_refs()}
+            sel = st.selectbox("Select customer", [None] + list(cust_names),
+                               format_func=lambda cid: "-- Select --" if cid is None else cust_names[cid],
+                               key="edit_card_sel")
+
+            c = get_customer(sel) if sel is not None else None
+            if c:
+                name = st.text_input("Full Name", value=c.full_name)
+                phone = st.text_input("Phone Number", value=c.phone_number)
+                addr = st.text_area("Address", value=c.address)
+                plan = st.text_input("Plan Name", value=c.plan_name)
+                loc = st.text_input("Location", value=c.location)
                 start = st.date_input(
                     "Subscription Start",
-                    value=c["subscription_start"],
+                    value=c.subscription_start,
                     min_value=date(2000, 1, 1)
                 )
-                days = st.number_input("Subscription Days", min_value=1, value=int(c["subscription_days"]))
+                days = st.number_input("Subscription Days", min_value=1, value=int(c.subscription_days))
 
                 if st.button("Save Changes"):
-                    update_customer(c["customer_id"], name, phone, addr, plan, loc, start, days)
-                    st.success("Customer updated successfully.")
-                    st.rerun()
+                    try:
+                        update_customer(c.customer_id, name, phone, addr, plan, loc, start, days)
+                        st.success("Customer updated successfully.")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Failed to update customer: {e}")
             if st.button("⬅ Back"):
                 st.session_state["admin_mode"] = None
                 st.rerun()
 
         elif mode == "renew":
             st.markdown('<div class="card"><span class="card-title">Renew Subscription</span></div>', unsafe_allow_html=True)
-            customers = list_customers()
-
             # --------- AUTO‑FILTER EXPIRED ONLY ----------
-            expired_customers = []
-            for c in customers:
-                sub_start = pd.to_datetime(c["subscription_start"])
-                sub_days = int(c["subscription_days"])
-                owed = int(c.get("owed", 0))
-                sub_end = sub_start + timedelta(days=sub_days + owed)
-
-                if sub_end < pd.to_datetime(date.today()):
-                    expired_customers.append(c)
+            expired_customers = {c.customer_id: c for c in list_expired_customers(date.today())}
+
+            # --------- ENDING SOON (flagged by the scheduler) ----------
+            expiring = list_expiring_customers()
+            if expiring:
+                with st.expander(f"⏳ Ending soon ({len(expiring)})"):
+                    st.caption("Flagged the day before their last delivery. They can be renewed once expired.")
+                    st.dataframe(
+                        [{"Customer": r["full_name"], "Phone": r["phone_number"],
+                          "Location": r["location"], "Last Day": r["subscription_end"]} for r in expiring],
+                        use_container_width=True, hide_index=True,
+                    )
 
             if not expired_customers:
                 st.info("No expired customers available for renewal.")
@@ -251,11 +355,10 @@ if st.session_state.get("role") == "admin":
                 # --------- BULK RENEW OPTION ----------
                 st.markdown("### 🔄 Renew All Expired Customers (Bulk Action)")
 
-                expired_names = [c["full_name"] for c in expired_customers]
-
                 bulk_selected = st.multiselect(
                     "Select expired customers to renew in bulk",
-                    expired_names,
+                    list(expired_customers),
+                    format_func=lambda cid: expired_customers[cid].full_name,
                     key="bulk_renew_select"
                 )
 
@@ -271,12 +374,11 @@ if st.session_state.get("role") == "admin":
                         st.warning("No customers selected.")
                     else:
                         try:
-                            for name in bulk_selected:
-                                c = next(c for c in expired_customers if c["full_name"] == name)
-                                if c.get("owed", 0) > 0:
-                                    st.error(f"{name} cannot be renewed because they have pending owed deliveries.")
+                            for cid in bulk_selected:
+                                c = expired_customers[cid]
+                                if c.owed > 0:
+                                    st.error(f"{c.full_name} cannot be renewed because they have pending owed deliveries.")
                                     continue
-                                cid = c["customer_id"]
                                 renew_subscription(cid, bulk_days)
                             st.success(f"Renewed {len(bulk_selected)} customers successfully.")
                             time.sleep(1.5)
@@ -289,31 +391,45 @@ if st.session_state.get("role") == "admin":
 
         elif mode == "pause":
             st.markdown('<div class="card"><span class="card-title">Pause Delivery</span></div>', unsafe_allow_html=True)
-            customers = list_customers()
-            cust_map = {c["full_name"]: c for c in customers}
-            sel = st.selectbox("Select customer to pause", ["-- Select --"] + list(cust_map.keys()), key="pause_card_sel")
+            cust_names = {c.customer_id: c.full_name for c in list_customer_refs()}
+            sel = st.selectbox("Select customer to pause", [None] + list(cust_names),
+                               format_func=lambda cid: "-- Select --" if cid is None else cust_names[cid],
+                               key="pause_card_sel")
             pause_date = st.date_input("Pause Date", value=date.today())
 
-            if sel != "-- Select --" and st.button("Pause Now"):
-                pause_delivery_for_customer(cust_map[sel]["customer_id"], pause_date, st.session_state.get("user_id"))
-                st.success(f"Paused delivery for {sel} on {pause_date}.")
-                st.rerun()
+            if sel is not None and st.button("Pause Now"):
+                try:
+                    pause_delivery_for_customer(sel, pause_date, st.session_state.get("user_id"))
+                    st.success(f"Paused delivery for {cust_names[sel]} on {pause_date}.")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to pause delivery: {e}")
             if st.button("⬅ Back"):
                 st.session_state["admin_mode"] = None
                 st.rerun()
 
         elif mode == "delete_customer":
             st.markdown('<div class="card"><span class="card-title">Delete Customer</span></div>', unsafe_allow_html=True)
-            customers = list_customers()
-            cust_map = {c["full_name"]: c for c in customers}
-            sel = st.selectbox("Select customer to delete", ["-- Select --"] + list(cust_map.keys()), key="del_cust_card_sel")
-
-            if sel != "-- Select --":
-                confirm = st.checkbox(f"Are you sure you want to delete {sel}?")
-                if confirm and st.button("Delete Customer Now"):
-                    delete_customer(cust_map[sel]["customer_id"])
-                    st.success(f"Deleted customer: {sel}")
-                    st.rerun()
+            cust_names = {c.customer_id: c.full_name for c in list_customer_refs()}
+            sel = st.selectbox("Select customer to delete", [None] + list(cust_names),
+                               format_func=lambda cid: "-- Select --" if cid is None else cust_names[cid],
+                               key="del_cust_card_sel")
+
+            if sel is not None:
+                closed = closed_days_of("customer_id", sel)
+                reopen = False
+                if closed:
+                    st.warning(f"{cust_names[sel]} appears on {len(closed)} closed days "
+                               f"({closed[0]} to {closed[-1]}). Deleting reopens them and changes their reports.")
+                    reopen = st.checkbox("Reopen those days", key="del_cust_reopen")
+                confirm = st.checkbox(f"Are you sure you want to delete {cust_names[sel]}?")
+                if confirm and (reopen or not closed) and st.button("Delete Customer Now"):
+                    try:
+                        delete_customer(sel, reopen_closed_days=reopen)
+                        st.success(f"Deleted customer: {cust_names[sel]}")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Failed to delete customer: {e}")
             if st.button("⬅ Back"):
                 st.session_state["admin_mode"] = None
                 st.rerun()
@@ -353,18 +469,79 @@ if st.session_state.get("role") == "admin":
                 st.session_state["admin_mode"] = None
                 st.rerun()
 
+        elif mode == "driver_capacity":
+            st.markdown('<div class="card"><span class="card-title">Capacity & Shifts</span></div>', unsafe_allow_html=True)
+            st.caption("Auto-assignment keeps each driver within their bowls per run and shift "
+                       "length; each stop takes its location's service time. Leave a value "
+                       "blank for no limit.")
+
+            cap_df = pd.DataFrame(list_drivers())
+            if cap_df.empty:
+                st.info("No drivers yet.")
+            else:
+                edited_caps = st.data_editor(
+                    cap_df[["driver_id", "full_name", "capacity", "shift_minutes"]],
+                    disabled=["driver_id", "full_name"], hide_index=True,
+                    use_container_width=True, key="capacity_editor",
+                    column_config={
+                        "capacity": st.column_config.NumberColumn("Bowls per run", min_value=0, step=1),
+                        "shift_minutes": st.column_config.NumberColumn("Shift (min)", min_value=0, step=15),
+                    },
+                )
+
+            svc_df = pd.DataFrame(list_location_drivers())
+            if not svc_df.empty:
+                edited_svc = st.data_editor(
+                    svc_df[["location_id", "location", "driver_name", "customers", "service_minutes"]],
+                    disabled=["location_id", "location", "driver_name", "customers"], hide_index=True,
+                    use_container_width=True, key="service_time_editor",
+                    column_config={
+                        "location_id": None,
+                        "service_minutes": st.column_config.NumberColumn(
+                            "Minutes per stop", min_value=0.0, step=0.5),
+                    },
+                )
+
+            if st.button("Save Capacity Settings", key="save_capacity_btn"):
+                try:
+                    if not cap_df.empty:
+                        update_driver_capacities(
+                            edited_caps["driver_id"].tolist(),
+                            [None if pd.isna(v) else int(v) for v in edited_caps["capacity"]],
+                            [None if pd.isna(v) else int(v) for v in edited_caps["shift_minutes"]])
+                    if not svc_df.empty:
+                        set_location_service_minutes(
+                            edited_svc["location_id"].tolist(),
+                            [None if pd.isna(v) else float(v) for v in edited_svc["service_minutes"]])
+                    st.success("Capacity settings saved.")
+                except Exception as e:
+                    st.error(f"Failed to save capacity settings: {e}")
+            if st.button("⬅ Back"):
+                st.session_state["admin_mode"] = None
+                st.rerun()
+
         elif mode == "delete_driver":
             st.markdown('<div class="card"><span class="card-title">Delete Driver</span></div>', unsafe_allow_html=True)
-            drivers = list_drivers()
-            d_map = {d["full_name"]: d for d in drivers}
-            sel = st.selectbox("Select driver to delete", ["-- Select --"] + list(d_map.keys()), key="del_driver_card_sel")
-
-            if sel != "-- Select --":
-                confirm = st.checkbox(f"Are you sure you want to delete driver {sel}?")
-                if confirm and st.button("Delete Driver Now"):
-                    delete_driver(d_map[sel]["driver_id"])
-                    st.success(f"Deleted driver: {sel}")
-                    st.rerun()
+            driver_names = {d.driver_id: d.full_name for d in list_drivers()}
+            sel = st.selectbox("Select driver to delete", [None] + list(driver_names),
+                               format_func=lambda did: "-- Select --" if did is None else driver_names[did],
+                               key="del_driver_card_sel")
+
+            if sel is not None:
+                closed = closed_days_of("driver_id", sel)
+                reopen = False
+                if closed:
+                    st.warning(f"{driver_names[sel]} appears on {len(closed)} closed days "
+                               f"({closed[0]} to {closed[-1]}). Deleting reopens them and changes their reports.")
+                    reopen = st.checkbox("Reopen those days", key="del_driver_reopen")
+                confirm = st.checkbox(f"Are you sure you want to delete driver {driver_names[sel]}?")
+                if confirm and (reopen or not closed) and st.button("Delete Driver Now"):
+                    try:
+                        delete_driver(sel, reopen_closed_days=reopen)
+                        st.success(f"Deleted driver: {driver_names[sel]}")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Failed to delete driver: {e}")
             if st.button("⬅ Back"):
                 st.session_state["admin_mode"] = None
                 st.rerun()
@@ -377,51 +554,112 @@ if st.session_state.get("role") == "admin":
             st.markdown("### ⚡ Auto-Generate Assignments for Today")
             if st.button("Generate Today's Assignments Automatically"):
                 try:
-                    auto_create_assignments_for_today()
-                    st.success("Today's auto-assignments were created successfully!")
-                    time.sleep(1)
+                    st.session_state["assignment_report"] = auto_create_assignments_for_today()
                     st.rerun()
                 except Exception as e:
                     st.error(f"Auto-assignment failed: {e}")
+
+            report = st.session_state.get("assignment_report")
+            if report:
+                st.success(f"Today's auto-assignments were created successfully! ({report['added']} new)")
+                overflow = sum(len(o["customer_ids"]) for o in report["overflow"])
+                if overflow:
+                    st.warning(
+                        f"{overflow} customers could not be assigned: every driver is at capacity or "
+                        f"out of shift time. Raise capacities under Driver Management → Capacity & Shifts."
+                    )
+                    st.dataframe(
+                        pd.DataFrame([{"location": o["location"], "unassigned": len(o["customer_ids"])}
+                                      for o in report["overflow"]]),
+                        use_container_width=True, hide_index=True
+                    )
+                if report["split"]:
+                    st.info("Split across drivers to fit capacity: " + ", ".join(report["split"]))
+                if report["drivers"]:
+                    util = pd.DataFrame(report["drivers"])
+                    st.dataframe(
+                        util[["driver_name", "stops", "capacity", "capacity_used",
+                              "minutes", "shift_minutes", "shift_used"]],
+                        use_container_width=True, hide_index=True,
+                        column_config={
+                            "capacity_used": st.column_config.ProgressColumn(
+                                "Bowls used", min_value=0, max_value=1, format="percent"),
+                            "shift_used": st.column_config.ProgressColumn(
+                                "Shift used", min_value=0, max_value=1, format="percent"),
+                        },
+                    )
+                if st.button("Dismiss Report", key="dismiss_assignment_report"):
+                    st.session_state["assignment_report"] = None
+                    st.rerun()
+
+            # ----------- LOCATION ROUTES (PERSISTED LOCATION → DRIVER) -----------
+            with st.expander("📍 Location Routes"):
+                st.caption("New and renewed customers are placed on their location's driver "
+                           "for today and any already planned days.")
+                routes = list_location_drivers()
+                if routes:
+                    st.dataframe(pd.DataFrame(routes)[["location", "driver_name", "customers"]],
+                                 use_container_width=True, hide_index=True)
+                    route_drivers = {d.driver_id: d.full_name for d in list_drivers()}
+                    route_names = {r["location_id"]: r["location"] for r in routes}
+                    rc1, rc2 = st.columns(2)
+                    with rc1:
+                        route_loc = st.selectbox("Location", list(route_names),
+                                                 format_func=route_names.get, key="route_location")
+                    with rc2:
+                        route_driver = st.selectbox("Driver", list(route_drivers.keys()),
+                                                    format_func=route_drivers.get, key="route_driver")
+                    if st.button("Update Route", key="route_update_btn"):
+                        set_location_driver(route_loc, route_driver)
+                        st.success(f"{route_names[route_loc]} now goes to {route_drivers[route_driver]}.")
+                        st.rerun()
+
+                    # Spelling variants ("Kondapur" / "Kondapoor") split a route.
+                    merges = suggest_location_merges()
+                    if merges:
+                        st.markdown("**Possible duplicate locations**")
+                        st.dataframe(
+                            pd.DataFrame(merges)[["location", "into", "score", "customers"]],
+                            use_container_width=True, hide_index=True,
+                        )
+                        if st.button("Merge Suggested Locations", key="merge_locations_btn"):
+                            merged = merge_locations([(m["location_id"], m["into_id"]) for m in merges])
+                            st.success(f"Merged {merged} locations.")
+                            st.rerun()
+                else:
+                    st.info("No routes yet; they are created when assignments are generated.")
             st.markdown("---")
             # Manual assignment UI removed as per instructions.
             st.divider()
 
             # ----------- NEW: REMOVE ASSIGNMENTS SECTION -----------
             st.markdown("## Remove Existing Assignments")
-            drivers = list_drivers()
+            driver_names = {d.driver_id: d.full_name for d in list_drivers()}
 
             remove_date = st.date_input("Select Date to View Assignments", value=date.today(), key="remove_assign_date")
 
             # Select driver for removal
-            drv_names = [d["full_name"] for d in drivers]
-            chosen_driver = st.selectbox("Select Driver", drv_names, key="remove_assign_driver")
-            chosen_driver_id = {d["full_name"]: d["driver_id"] for d in drivers}[chosen_driver]
+            chosen_driver_id = st.selectbox("Select Driver", list(driver_names),
+                                            format_func=driver_names.get, key="remove_assign_driver")
 
             # Load assignments for chosen date + driver
-            rows = fetch_all(
-                "SELECT a.assignment_id, a.customer_id, c.full_name "
-                "FROM assignments a "
-                "JOIN customers c ON a.customer_id = c.customer_id "
-                "WHERE a.assign_date = %s AND a.driver_id = %s;",
-                (remove_date, chosen_driver_id)
-            )
+            rows = list_assignments_for_date(remove_date, driver_id=chosen_driver_id)
 
             if not rows:
                 st.info("No assignments found for this driver on this date.")
             else:
-                cust_map = {r["full_name"]: r["assignment_id"] for r in rows}
+                assigned_names = {r.assignment_id: r.customer_name for r in rows}
 
                 to_remove = st.multiselect(
                     "Select customers to unassign",
-                    list(cust_map.keys()),
+                    list(assigned_names),
+                    format_func=assigned_names.get,
                     key="remove_assign_multiselect"
                 )
 
                 if to_remove and st.button("Unassign Selected Customers", key="remove_assign_btn"):
                     try:
-                        for name in to_remove:
-                            aid = cust_map[name]
+                        for aid in to_remove:
                             delete_assignment(aid)
                         st.success(f"Removed {len(to_remove)} assignments.")
                         time.sleep(1.5)
@@ -431,101 +669,154 @@ if st.session_state.get("role") == "admin":
 
             st.divider()
 
-            # Customer Subscription Overview block
-            st.markdown("## Customer Subscription Overview")
+            # ----------- BULK REASSIGN (DRIVER ABSENT) -----------
+            st.markdown("## Reassign a Driver's Stops")
+            st.caption("Move an absent driver's assignments to other drivers in one step.")
+
+            absent_driver_id = st.selectbox("Absent Driver", list(driver_names),
+                                            format_func=driver_names.get, key="reassign_from_driver")
+
+            r1, r2 = st.columns(2)
+            reassign_from = r1.date_input("From Date", value=date.today(), key="reassign_from_date")
+            reassign_to = r2.date_input("To Date", value=date.today(), key="reassign_to_date")
+
+            absent_names = {c.customer_id: c.full_name
+                            for c in list_driver_customers(absent_driver_id, reassign_from, reassign_to)}
+
+            if not absent_names:
+                st.info("No assignments found for this driver in this date range.")
+            else:
+                only_customers = st.multiselect(
+                    f"Only move these customers (leave empty to move all {len(absent_names)})",
+                    list(absent_names),
+                    format_func=absent_names.get,
+                    key="reassign_customers"
+                )
+                targets = st.multiselect(
+                    "Move To Driver(s)",
+                    [d for d in driver_names if d != absent_driver_id],
+                    format_func=driver_names.get,
+                    key="reassign_targets"
+                )
+                spread_by_load = st.checkbox(
+                    "Spread stops by current load (fewest stops first)",
+                    value=True,
+                    key="reassign_balance"
+                )
+
+                if targets and st.button("Reassign Stops", key="reassign_btn"):
+                    try:
+                        moved = reassign_driver_assignments(
+                            absent_driver_id,
+                            targets,
+                            reassign_from,
+                            reassign_to,
+                            customer_ids=only_customers or None,
+                            balance_by_load=spread_by_load
+                        )
+                        summary = ", ".join(f"{driver_names[d]}: {n}" for d, n in moved.items())
+                        st.success(f"Moved {sum(moved.values())} stops ({summary}).")
+                        time.sleep(1.5)
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Failed to reassign stops: {e}")
 
-            customers = list_customers()
-            df = pd.DataFrame(customers)
+            st.divider()
 
-            if "owed" not in df.columns:
-                df["owed"] = 0
+            # Customer Subscription Overview block
+            st.markdown("## Customer Subscription Overview")
 
-            if "subscription_days" not in df.columns:
-                df["subscription_days"] = 30
+            df = fetch_df("""
+                SELECT customer_id, full_name, phone_number, address, plan_name,
+                       location, owed, subscription_start, subscription_days
+                FROM customers
+                ORDER BY customer_id;
+            """)
 
-            df["subscription_start"] = pd.to_datetime(df["subscription_start"], errors="coerce")
             df["subscription_end"] = df["subscription_start"] + pd.to_timedelta(
                 df["subscription_days"].fillna(0) + df["owed"].fillna(0),
                 unit="D"
             )
 
-            if not df.empty and "subscription_end" in df.columns:
-                today = pd.Timestamp.today()
-                df["subscription_status"] = df["subscription_end"].apply(
-                    lambda d: ("Active" if d >= today else "Expired") if pd.notnull(d) else "Unknown"
-                )
-            else:
-                df["subscription_status"] = "Unknown"
+            today = pd.Timestamp.today()
+            df["subscription_status"] = "Unknown"
+            df.loc[df["subscription_end"] >= today, "subscription_status"] = "Active"
+            df.loc[df["subscription_end"] < today, "subscription_status"] = "Expired"
 
             st.dataframe(df, use_container_width=True)
 
 #----------------- ADMIN VIEW OF DRIVER ASSIGNMENTS + DELIVERY STATUS -------------
 if st.session_state.get("role") == "admin":
-    with tabs[1]:
+    with tabs[1], section("driver tracking"):
         st.subheader("Driver Delivery Tracking – Admin Panel")
 
         work_date = st.date_input("Date", value=date.today(), key="admin_driver_work_date")
 
         try:
-            drivers = list_drivers()
-            driver_map = {d["full_name"]: d["driver_id"] for d in drivers}
-            sel_driver_label = st.selectbox("Select Driver", list(driver_map.keys()), key="admin_driver_select")
-            sel_driver_id = driver_map[sel_driver_label]
+            live = change_feed()
+            driver_names = {d.driver_id: d.full_name
+                            for d in live.cached("drivers", [("drivers",)], list_drivers)}
+            sel_driver_id = st.selectbox("Select Driver", list(driver_names),
+                                         format_func=driver_names.get, key="admin_driver_select")
+            sel_driver_label = driver_names.get(sel_driver_id)
+        except Exception as e:
+            st.session_state["last_error"] = str(e)
+            st.error("Couldn't load driver data.")
+            sel_driver_id = None
 
-            todays_assign = list_assignments_for_date(work_date)
-            todays_assign = [r for r in todays_assign if r["driver_id"] == sel_driver_id]
+        # Redraws from the in-process change feed: a driver's mark is patched
+        # into the cached stops, so the table is live without re-querying.
+        # Only polls while this tab is the one showing.
+        @st.fragment(run_every=VIEW_REFRESH_SECONDS if tabs[1].open else None)
+        def live_driver_stops():
+            try:
+                todays_assign = live.driver_stops(work_date, sel_driver_id)
+            except Exception as e:
+                st.session_state["last_error"] = str(e)
+                st.error("Couldn't load driver data.")
+                return
 
-            if not todays_assign:
-                st.info("No assignments for this driver on the selected date.")
+            if live.connected:
+                st.caption("🟢 Live: updates appear as drivers mark their stops.")
             else:
-                enriched_rows = []
-                for r in todays_assign:
-                    # Fetch delivery status, marked time, and marked_by
-                    status_row = fetch_all(
-                        "SELECT status, marked_by FROM deliveries WHERE assignment_id = %s AND delivery_date = %s;",
-                        (r["assignment_id"], work_date)
-                    )
-                    delivery_status = status_row[0]["status"] if status_row else "Not Marked"
-                    marked_by = status_row[0].get("marked_by") if status_row else None
+                st.caption("Live updates paused while reconnecting; change the date or driver to reload.")
 
-                    # Fetch customer location
-                    cust_info = fetch_all(
-                        "SELECT location FROM customers WHERE customer_id = %s;",
-                        (r["customer_id"],)
-                    )
-                    location = cust_info[0]["location"] if cust_info else ""
-
-                    enriched_rows.append({
-                        "Customer": r["customer_name"],
-                        "Assignment ID": r["assignment_id"],
-                        "Customer ID": r["customer_id"],
-                        "Driver Name": r.get("driver_name", ""),
-                        "Area / Location": location,
-                        "Delivered / Missed": delivery_status,
-                        "Time Marked": marked_by if marked_by else "",
-                        "Date": work_date,
-                    })
-
-                st.dataframe(enriched_rows, use_container_width=True)
-
-                # --- DOWNLOAD ADMIN DRIVER REPORT ---
-                df_admin_driver = pd.DataFrame(enriched_rows)
+            if not todays_assign:
+                st.info("No assignments for this driver on the selected date.")
+                return
+
+            # marked_at arrives in the database session's zone; show it in local
+            # time, the zone date.today() and the rest of the app use.
+            enriched_rows = [{
+                "Customer": r.customer_name,
+                "Assignment ID": r.assignment_id,
+                "Customer ID": r.customer_id,
+                "Driver Name": r.driver_name,
+                "Area / Location": r.location or "",
+                "Delivered / Missed": r.status or "Not Marked",
+                "Time Marked": r.marked_at.astimezone().strftime("%H:%M:%S") if r.marked_at else "",
+                "Date": work_date,
+            } for r in todays_assign]
+
+            st.dataframe(enriched_rows, use_container_width=True)
+
+            # --- DOWNLOAD ADMIN DRIVER REPORT ---
+            df_admin_driver = pd.DataFrame(enriched_rows)
 
-                st.download_button(
-                    label="⬇ Download This Report (CSV)",
-                    data=df_admin_driver.to_csv(index=False),
-                    file_name=f"driver_report_{sel_driver_label}_{work_date}.csv",
-                    mime="text/csv",
-                    key="download_admin_driver_report"
-                )
+            st.download_button(
+                label="⬇ Download This Report (CSV)",
+                data=df_admin_driver.to_csv(index=False),
+                file_name=f"driver_report_{sel_driver_label}_{work_date}.csv",
+                mime="text/csv",
+                key="download_admin_driver_report"
+            )
 
-        except Exception as e:
-            st.session_state["last_error"] = str(e)
-            st.error("Couldn't load driver data.")
+        if sel_driver_id is not None:
+            live_driver_stops()
 
 #--------------------- DRIVER TAB - MARK DELIVERED / MISSED ----------------
 elif st.session_state["role"] == "driver":
-    with tabs[0]:
+    with tabs[0], section("driver"):
         st.subheader("Delivery Status Submission - Driver View")  
         
         work_date = st.date_input("Date", value=date.today(), key="driver_work_date")
@@ -535,8 +826,7 @@ elif st.session_state["role"] == "driver":
             st.error("Driver ID not found in session. Please log in again.")
             st.stop()
         try:
-            todays_assign = list_assignments_for_date(work_date)
-            todays_assign =[r for r in todays_assign if r["driver_id"] == driver_id]
+            todays_assign = list_driver_stops(work_date, driver_id)
         except Exception as e:
             st.session_state['last_error'] = str(e)
             st.error("Couldn't load assignmnets.")
@@ -546,34 +836,16 @@ elif st.session_state["role"] == "driver":
             st.info("No assignments for you on this date.")
         else:
             # --- DRIVER DOWNLOAD REPORT (Enhanced) ---
-            driver_report_data = []
-            for r in todays_assign:
-
-                # Fetch delivery status & marked time (if exists)
-                status_row = fetch_all(
-                    "SELECT status, marked_by FROM deliveries WHERE assignment_id = %s AND delivery_date = %s;",
-                    (r['assignment_id'], work_date)
-                )
-                delivery_status = status_row[0]["status"] if status_row else "Not Marked"
-                marked_by = status_row[0].get("marked_by") if status_row else None
-
-                # Fetch customer location
-                cust_info = fetch_all(
-                    "SELECT location FROM customers WHERE customer_id = %s;",
-                    (r['customer_id'],)
-                )
-                location = cust_info[0]["location"] if cust_info else ""
-
-                driver_report_data.append({
-                    "Customer": r["customer_name"],
-                    "Assignment ID": r["assignment_id"],
-                    "Customer ID": r["customer_id"],
-                    "Driver Name": st.session_state.get("role") == "driver" and st.session_state.get("user_id"),
-                    "Area / Location": location,
-                    "Delivered / Missed": delivery_status,
-                    "Time Marked": marked_by if marked_by else "",
-                    "Date": work_date,
-                })
+            driver_report_data = [{
+                "Customer": r.customer_name,
+                "Assignment ID": r.assignment_id,
+                "Customer ID": r.customer_id,
+                "Driver Name": r.driver_name,
+                "Area / Location": r.location or "",
+                "Delivered / Missed": r.status or "Not Marked",
+                "Time Marked": r.marked_at.astimezone().strftime("%H:%M:%S") if r.marked_at else "",
+                "Date": work_date,
+            } for r in todays_assign]
 
             df_driver_report = pd.DataFrame(driver_report_data)
 
@@ -585,12 +857,7 @@ elif st.session_state["role"] == "driver":
                 key="download_driver_assignments"
             )
             for row in todays_assign:
-                #------- Get existing status for this assignment & date backend checks -------
-                status_rows = fetch_all(
-                    "SELECT status FROM deliveries WHERE assignment_id = %s AND delivery_date = %s;",
-                    (row["assignment_id"], work_date)
-                )
-                existing_status = status_rows[0]["status"] if status_rows else None
+                existing_status = row.status
 
                 if existing_status == "delivered":
                     default_status = "Delivered"
@@ -599,42 +866,43 @@ elif st.session_state["role"] == "driver":
                 else:
                     default_status = None
 
-                st.write(f"### {row['customer_name']}")
+                st.write(f"### {row.customer_name}")
                 options = ["Delivered", "Missed"]
 
                 # If an existing status is available, preselect it; otherwise no default index
                 if default_status in options:
                     idx = options.index(default_status)
                     selected_status = st.radio(
-                        f"Status for {row['customer_name']}",
+                        f"Status for {row.customer_name}",
                         options,
                         index=idx,
-                        key=f"radio_{row['assignment_id']}"
+                        key=f"radio_{row.assignment_id}"
                     )
                 else:
                     selected_status = st.radio(
-                        f"Status for {row['customer_name']}",
+                        f"Status for {row.customer_name}",
                         options,
-                        key=f"radio_{row['assignment_id']}"
+                        key=f"radio_{row.assignment_id}"
                     )
 
                 # --- Status saved indicator  ---
+                saved_at = f" at {row.marked_at.astimezone():%H:%M}" if row.marked_at else ""
                 if existing_status == "delivered":
-                    st.write("✔ Saved as Delivered")
+                    st.write(f"✔ Saved as Delivered{saved_at}")
                 elif existing_status == "missed":
-                    st.write("✔ Saved as Missed")
+                    st.write(f"✔ Saved as Missed{saved_at}")
 
-                if st.button("Save Status", key=f"save_{row['assignment_id']}"):
+                if st.button("Save Status", key=f"save_{row.assignment_id}"):
                     try:
                         final_status = selected_status.lower()
 
                         upsert_delivery(
-                            assignment_id=row["assignment_id"],
+                            assignment_id=row.assignment_id,
                             delivery_date=work_date,
                             status=final_status,
                             marked_by=st.session_state.get("user_id")
                         )
-                        st.success(f"Updated {row['customer_name']} as {selected_status}.")
+                        st.success(f"Updated {row.customer_name} as {selected_status}.")
                         st.rerun()
                     except Exception as e:
                         st.session_state["last_error"] = str(e)
@@ -642,7 +910,7 @@ elif st.session_state["role"] == "driver":
 
 # -------------------- Dashboard Tab -----------------
 if st.session_state.get("role") == "admin":
-    with tabs[2]:
+    with tabs[2], section("dashboard"):
         st.subheader("KPI Date Range")
         st.write("")
 
@@ -655,13 +923,9 @@ if st.session_state.get("role") == "admin":
             if from_date > to_date:
                 st.error("From Date cannot be after To Date.")
             else:
-                rows = fetch_all("""
-                    SELECT status FROM deliveries
-                    WHERE delivery_date BETWEEN %s AND %s;
-                """, (from_date, to_date))
+                df_report = delivery_report(from_date, to_date)
 
                 # --- DOWNLOAD DELIVERY REPORT ---
-                df_report = pd.DataFrame(rows)
                 if not df_report.empty:
                     st.download_button(
                         label="⬇ Download Delivery Report (CSV)",
@@ -673,9 +937,10 @@ if st.session_state.get("role") == "admin":
                 else:
                     st.info("No deliveries found for this date range. Nothing to download.")
 
-                delivered = sum(1 for r in rows if r["status"] == "delivered")
-                missed = sum(1 for r in rows if r["status"] == "missed")
-                total = len(rows)
+                status_counts = df_report["status"].value_counts()
+                delivered = int(status_counts.get("delivered", 0))
+                missed = int(status_counts.get("missed", 0))
+                total = len(df_report)
 
                 k1, k2, k3 = st.columns(3)
                 k1.metric("Delivered", delivered)
@@ -684,26 +949,22 @@ if st.session_state.get("role") == "admin":
 
         st.divider()
 
-        # TWO COLUMN LAYOUT
-        left, right = st.columns(2)
-
-        #--------- LEFT: CARRY-FORWARD --------------
-        with left:
+        #--------- CARRY-FORWARD --------------
+        with st.container():
             st.subheader("Carry-Forward Deliveries")
             st.write("")
             try:
-                owed_data = fetch_all("""
+                df = fetch_df("""
                     SELECT customer_id, full_name, owed
                     FROM customers
                     WHERE owed > 0
                     ORDER BY owed DESC;
                 """)
 
-                if owed_data:
-                    df = pd.DataFrame(owed_data)
+                if not df.empty:
                     df.rename(columns={"owed": "Carry Forward"}, inplace=True)
                     st.dataframe(df, use_container_width=True)
-                    total_owed = df["Carry Forward"].sum()
+                    total_owed = int(df["Carry Forward"].sum())
                     st.metric("Total Carry Forward Deliveries", total_owed)
                     if not df.empty:
                         st.download_button(
@@ -718,65 +979,207 @@ if st.session_state.get("role") == "admin":
             except Exception as e:
                 st.error(f"Error loading carry-forward: {e}")
 
-        #-------------- RIGHT: DRIVER MISSED --------------
-        with right:
-            st.subheader("Driver-wise Missed Deliveries")
-            st.write("")
+            if st.button("Check Carry-Forward Against Deliveries", key="reconcile_owed_btn"):
+                try:
+                    mismatches = reconcile_owed()
+                    if mismatches:
+                        st.warning(f"{len(mismatches)} customers have a carry-forward that does not match their deliveries.")
+                        st.dataframe(pd.DataFrame(mismatches), use_container_width=True)
+                    else:
+                        st.success("Carry-forward matches deliveries for every customer.")
+                except Exception as e:
+                    st.error(f"Reconciliation failed: {e}")
+
+        #-------------- DRIVER LEADERBOARD --------------
+        st.divider()
+        st.subheader("Driver Leaderboard")
+        st.write("")
 
-            drivers = list_drivers()
+        l1, l2, l3 = st.columns(3)
+        lb_from = l1.date_input("From Date (Leaderboard)", value=date.today() - timedelta(days=27))
+        lb_to = l2.date_input("To Date (Leaderboard)", value=date.today())
+        sort_labels = {
+            "Missed Rate": "missed_rate",
+            "Missed": "missed",
+            "Delivered": "delivered",
+            "Assigned": "assigned",
+            "Paused": "paused",
+            "Driver Name": "driver_name",
+        }
+        lb_sort = l3.selectbox("Sort By", list(sort_labels.keys()), key="leaderboard_sort")
+
+        if lb_from > lb_to:
+            st.error("From Date cannot be after To Date.")
+        else:
+            try:
+                rows = driver_leaderboard(lb_from, lb_to, sort_by=sort_labels[lb_sort])
 
-            if not drivers:
-                st.info("No drivers available.")
-                st.stop()
+                if not rows:
+                    st.info("No drivers available.")
+                else:
+                    df_lb = pd.DataFrame(rows)
+                    df_lb["missed_rate"] = df_lb["missed_rate"].astype(float)
+                    st.dataframe(
+                        df_lb.drop(columns=["weekly_trend"]),
+                        use_container_width=True,
+                        hide_index=True
+                    )
 
-            driver_names = [d["full_name"] for d in drivers]
-            selected_driver = st.selectbox("Select Driver", driver_names)
+                    # Weekly missed trend, one line per driver
+                    trend = pd.DataFrame([
+                        {"driver_name": r["driver_name"], **w}
+                        for r in rows for w in r["weekly_trend"]
+                    ])
+                    if not trend.empty:
+                        st.markdown("#### Weekly Missed Trend")
+                        st.line_chart(trend.pivot_table(
+                            index="week", columns="driver_name", values="missed", aggfunc="sum"
+                        ))
+                        df_lb = df_lb.merge(
+                            trend.pivot_table(
+                                index="driver_name", columns="week", values="missed", aggfunc="sum"
+                            ).add_prefix("missed_week_"),
+                            left_on="driver_name", right_index=True, how="left"
+                        )
 
-            driver_map = {d["full_name"]: d["driver_id"] for d in drivers}
-            driver_id = driver_map.get(selected_driver)
+                    st.download_button(
+                        label="⬇ Download Driver Leaderboard (CSV)",
+                        data=df_lb.drop(columns=["weekly_trend"]).to_csv(index=False),
+                        file_name=f"driver_leaderboard_{lb_from}_to_{lb_to}.csv",
+                        mime="text/csv",
+                        key="download_driver_leaderboard"
+                    )
+            except Exception as e:
+                st.error(f"Error loading driver leaderboard: {e}")
 
-            if driver_id is None:
-                st.warning("Invalid driver selection.")
-                st.stop()
+        #-------------- DRIVER THROUGHPUT --------------
+        st.divider()
+        st.subheader("Driver Throughput")
+        st.caption("From the time each stop was marked. Slowest routes first; "
+                   "'in order' is the share of stops marked in the planned sequence.")
 
-            d1, d2 = st.columns(2)
-            d_from = d1.date_input("From Date (Driver)", value=date.today())
-            d_to = d2.date_input("To Date (Driver)", value=date.today())
+        t1, t2, t3 = st.columns(3)
+        tp_from = t1.date_input("From Date (Throughput)", value=date.today() - timedelta(days=6))
+        tp_to = t2.date_input("To Date (Throughput)", value=date.today())
+        tp_idle = t3.number_input("Idle Gap (minutes)", min_value=1, value=15, key="throughput_idle")
 
-            if d_from > d_to:
-                st.error("From Date cannot be after To Date.")
-            else:
-                try:
-                    query = """
-                        SELECT d.full_name AS driver_name,
-                               COUNT(*) AS missed_count
-                        FROM deliveries del
-                        JOIN assignments a ON del.assignment_id = a.assignment_id
-                        JOIN drivers d ON a.driver_id = d.driver_id
-                        WHERE del.status = 'missed'
-                        AND d.driver_id = %s
-                        AND del.delivery_date BETWEEN %s AND %s
-                        GROUP BY d.full_name;
-                    """
-                    rows = fetch_all(query, (driver_id, d_from, d_to))
-
-                    if rows:
-                        df_d = pd.DataFrame(rows)
-                        st.dataframe(df_d, use_container_width=True)
-                        if not df_d.empty:
-                            st.download_button(
-                                label="⬇ Download Driver Missed Report (CSV)",
-                                data=df_d.to_csv(index=False),
-                                file_name=f"driver_missed_{selected_driver}.csv",
-                                mime='text/csv',
-                                key='download_driver_missed_report'
-                            )
-                    else:
-                        st.info(f"No missed deliveries for {selected_driver} in this range.")
-                except Exception as e:
-                    st.error(f"Error loading driver missed: {e}")
+        if tp_from > tp_to:
+            st.error("From Date cannot be after To Date.")
+        else:
+            try:
+                tp_rows = driver_throughput(tp_from, tp_to, idle_minutes=tp_idle)
+                if not tp_rows:
+                    st.info("No timed stops in this range yet.")
+                else:
+                    tp_cols = {
+                        "in_order": st.column_config.ProgressColumn(
+                            "in order", min_value=0, max_value=1, format="percent"),
+                    }
+                    st.dataframe(pd.DataFrame(tp_rows).drop(columns=["driver_id"]),
+                                 use_container_width=True, hide_index=True, column_config=tp_cols)
+
+                    with st.expander("Per Route-Day"):
+                        tp_days = pd.DataFrame(driver_throughput(tp_from, tp_to, idle_minutes=tp_idle,
+                                                                 by_day=True))
+                        for col in ("first_stop", "last_stop"):
+                            tp_days[col] = tp_days[col].map(lambda t: f"{t:%H:%M}")
+                        st.dataframe(tp_days.drop(columns=["driver_id"]), use_container_width=True,
+                                     hide_index=True, column_config=tp_cols)
+                        st.download_button(
+                            label="⬇ Download Route Throughput (CSV)",
+                            data=tp_days.to_csv(index=False),
+                            file_name=f"driver_throughput_{tp_from}_to_{tp_to}.csv",
+                            mime="text/csv",
+                            key="download_driver_throughput"
+                        )
+            except Exception as e:
+                st.error(f"Error loading driver throughput: {e}")
 
+        #-------------- DELIVERY FORECAST --------------
+        st.divider()
+        st.subheader("Delivery Forecast")
+        st.write("")
 
+        f1, f2 = st.columns(2)
+        fc_days = f1.slider("Days Ahead", min_value=1, max_value=60, value=14, key="forecast_days")
+        try:
+            hist_rate = renewal_rate()
+            fc_rate = f2.slider(
+                "Renewal Rate", min_value=0.0, max_value=1.0,
+                value=round(hist_rate or 0.0, 2), step=0.01, key="forecast_rate",
+                help="Chance that a subscription ending in the window renews the next day. "
+                     "Defaults to the share of the last 90 days' expiries that renewed."
+            )
+            fc = forecast_deliveries(days=fc_days, rate=fc_rate)
 
+            if fc.empty:
+                st.info("No active or upcoming subscriptions to forecast.")
+            else:
+                daily = fc.groupby("date")[["committed", "expected"]].sum()
+                m1, m2, m3 = st.columns(3)
+                m1.metric("Tomorrow (expected)", f"{daily['expected'].iloc[min(1, len(daily) - 1)]:.0f}")
+                m2.metric("Peak Day", f"{daily['expected'].max():.0f}",
+                          daily["expected"].idxmax().strftime("%d %b"), delta_color="off")
+                m3.metric("Historical Renewal Rate", "—" if hist_rate is None else f"{hist_rate:.0%}")
+                st.line_chart(daily)
+
+                by_driver = fc.pivot_table(index="driver_name", columns="date", values="expected",
+                                           aggfunc="sum", observed=True)
+                by_driver.columns = [c.strftime("%d %b") for c in by_driver.columns]
+                capacity = {d.full_name: d.capacity for d in list_drivers()}
+                by_driver.insert(0, "capacity", by_driver.index.map(capacity))
+                st.markdown("#### Expected Bowls per Driver")
+                st.dataframe(by_driver.round(0), use_container_width=True)
+
+                with st.expander("Expected Bowls per Location"):
+                    by_loc = fc.pivot_table(index="location", columns="date", values="expected",
+                                            aggfunc="sum")
+                    by_loc.columns = [c.strftime("%d %b") for c in by_loc.columns]
+                    st.dataframe(by_loc.round(1), use_container_width=True)
 
+                st.download_button(
+                    label="⬇ Download Delivery Forecast (CSV)",
+                    data=fc.to_csv(index=False),
+                    file_name=f"delivery_forecast_{date.today()}_{fc_days}d.csv",
+                    mime="text/csv",
+                    key="download_delivery_forecast"
+                )
+        except Exception as e:
+            st.error(f"Error loading delivery forecast: {e}")
+
+        #-------------- CLOSED DAYS --------------
+        st.divider()
+        st.subheader("Closed Days")
+        st.caption("A closed day's assignments and deliveries can no longer be changed, and reports "
+                   "over it are read from local files instead of the database. Only past days with "
+                   "every stop marked can be closed.")
+
+        c1, c2 = st.columns(2)
+        close_through = c1.date_input("Close Through", value=date.today() - timedelta(days=1),
+                                      max_value=date.today() - timedelta(days=1), key="close_through")
+        if c2.button("Close Days", key="close_days_btn"):
+            try:
+                result = close_days(through=close_through, closed_by=st.session_state.get("user_id"))
+                st.success(f"Closed {len(result['closed'])} days.")
+                if result["unmarked"]:
+                    st.warning("Left open, stops still unmarked: " + ", ".join(
+                        f"{r['day']} ({r['unmarked'] or 'some'})" for r in result["unmarked"]))
+            except Exception as e:
+                st.error(f"Failed to close days: {e}")
 
+        try:
+            closed = list_closed_days()
+            if not closed:
+                st.info("No closed days yet.")
+            else:
+                st.dataframe(pd.DataFrame(closed), use_container_width=True, hide_index=True)
+                r1, r2 = st.columns(2)
+                reopen = r1.selectbox("Reopen Day", [r["day"] for r in closed], key="reopen_day",
+                                      help="Reopen a day to correct its deliveries; close it again afterwards.")
+                if r2.button("Reopen", key="reopen_day_btn"):
+                    reopen_day(reopen)
+                    st.success(f"Reopened {reopen}.")
+                    time.sleep(1.5)
+                    st.rerun()
+        except Exception as e:
+            st.error(f"Error loading closed days: {e}")
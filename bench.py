@@ -0,0 +1,248 @@
+"""
+Micro-benchmarks for Smart Delivery's data paths.
+
+Uses the same .streamlit/secrets.toml as the app. Example:
+
+    python bench.py fetch --rows 100000
+    python bench.py solve --customers 5000 --drivers 50
+    python bench.py rows --rows 100000
+    python bench.py forecast --subscriptions 20000 --days 30
+    python bench.py import --rows 20000
+
+Results from local runs are kept in bench_results.md.
+"""
+import argparse
+import time
+import tracemalloc
+
+import db
+
+# Synthetic rows shaped like the subscription overview, generated server side
+# so the benchmark does not depend on how much data the database holds.
+SYNTHETIC_CUSTOMERS_SQL = """
+    SELECT g AS customer_id,
+           'Customer ' || g AS full_name,
+           lpad((9000000000 + g)::text, 10, '0') AS phone_number,
+           'House ' || g || ', Main Road' AS address,
+           'Monthly' AS plan_name,
+           'Location ' || (g %% 40) AS location,
+           (g %% 3) AS owed,
+           DATE '2025-01-01' + (g %% 300) AS subscription_start,
+           30 AS subscription_days
+    FROM generate_series(1, %s) AS g;
+"""
+
+
+def _measure(fn, repeat):
+    """Best wall time over `repeat` runs, then one traced run for peak memory."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def cmd_fetch(args):
+    import pandas as pd
+
+    params = (args.rows,)
+    paths = {
+        "fetch_all + DataFrame": lambda: pd.DataFrame(db.fetch_all(SYNTHETIC_CUSTOMERS_SQL, params)),
+        "fetch_df (tuples)": lambda: db.fetch_df(SYNTHETIC_CUSTOMERS_SQL, params, method="tuples"),
+        "fetch_df (copy)": lambda: db.fetch_df(SYNTHETIC_CUSTOMERS_SQL, params, method="copy"),
+    }
+
+    print(f"{args.rows:,} rows, best of {args.repeat}")
+    print(f"{'path':<24} {'seconds':>8} {'peak MB':>8} {'frame MB':>9}")
+    for name, fn in paths.items():
+        df, elapsed, peak = _measure(fn, args.repeat)
+        frame_mb = df.memory_usage(deep=True).sum() / 2**20
+        print(f"{name:<24} {elapsed:>8.3f} {peak / 2**20:>8.1f} {frame_mb:>9.1f}")
+
+
+def _fetch_tuples(sql, params):
+    with db.get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+
+def cmd_rows(args):
+    from models import Customer
+
+    params = (args.rows,)
+    paths = {
+        "fetch_all (RealDictRow)": lambda: db.fetch_all(SYNTHETIC_CUSTOMERS_SQL, params),
+        "plain tuples": lambda: _fetch_tuples(SYNTHETIC_CUSTOMERS_SQL, params),
+        "fetch_records (Customer)": lambda: db.fetch_records(Customer, SYNTHETIC_CUSTOMERS_SQL, params),
+    }
+
+    print(f"{args.rows:,} customer rows, best of {args.repeat}")
+    print(f"{'path':<26} {'seconds':>8} {'held MB':>8} {'bytes/row':>10}")
+    for name, fn in paths.items():
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - started)
+        # Memory still held by the result list once the fetch is done.
+        tracemalloc.start()
+        rows = fn()
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:<26} {best:>8.3f} {held / 2**20:>8.1f} {held / len(rows):>10.0f}")
+        del rows
+
+
+def cmd_solve(args):
+    import random
+    from solver import solve
+
+    rng = random.Random(args.seed)
+    # Skewed location sizes: a few big neighbourhoods, many small ones.
+    weights = [1 / (i + 1) for i in range(args.locations)]
+    members = {}
+    for cid, loc in enumerate(rng.choices(range(args.locations), weights, k=args.customers)):
+        members.setdefault(loc, []).append(cid)
+    locations = [
+        {"location": f"Location {loc}", "customer_ids": ids,
+         "service_minutes": rng.choice([2, 3, 3, 4, 6]),
+         "preferred_driver_id": rng.randrange(args.drivers) if rng.random() < 0.8 else None}
+        for loc, ids in members.items()
+    ]
+    # Total capacity ~= demand * args.slack, spread unevenly across drivers.
+    per_driver = args.customers * args.slack / args.drivers
+    drivers = [
+        {"driver_id": i, "full_name": f"Driver {i}",
+         "capacity": int(per_driver * rng.uniform(0.6, 1.4)),
+         "shift_minutes": int(per_driver * 3.5 * rng.uniform(0.7, 1.3)),
+         "stops": 0, "minutes": 0}
+        for i in range(args.drivers)
+    ]
+
+    result, elapsed, peak = _measure(lambda: solve(locations, drivers), args.repeat)
+    overflow = sum(len(o["customer_ids"]) for o in result["overflow"])
+    print(f"{args.customers:,} customers in {len(locations)} locations x {args.drivers} drivers, "
+          f"best of {args.repeat}")
+    print(f"solve: {elapsed:.3f} s, peak {peak / 2**20:.1f} MB")
+    print(f"assigned {len(result['assignments']):,}, overflow {overflow:,}, "
+          f"split locations {len(result['split'])}, "
+          f"kept on preferred driver {sum(1 for loc in locations if result['mapping'].get(loc['location']) == loc['preferred_driver_id'])}")
+    for label, key in (("bowls used", "capacity_used"), ("shift used", "shift_used")):
+        used = [d[key] for d in result["drivers"] if d[key] is not None]
+        print(f"{label}: min {min(used):.0%}  mean {sum(used) / len(used):.0%}  max {max(used):.0%}")
+
+
+def cmd_forecast(args):
+    import numpy as np
+    import pandas as pd
+    from datetime import date
+
+    rng = np.random.default_rng(args.seed)
+    start = date(2026, 1, 1)
+    n = args.subscriptions
+    plan = rng.choice([7, 30, 30, 90], n)
+    subs = pd.DataFrame({
+        "location_id": rng.integers(1, args.locations + 1, n),
+        "subscription_start": pd.Timestamp(start) + pd.to_timedelta(rng.integers(-90, args.days, n), unit="D"),
+        "length": plan + rng.integers(0, 4, n),
+        "subscription_days": plan,
+    })
+    routes = pd.DataFrame({
+        "location_id": range(args.locations + 1),
+        "location": ["No location"] + [f"Location {i}" for i in range(1, args.locations + 1)],
+        "driver_id": [None] + [i % 50 for i in range(1, args.locations + 1)],
+        "driver_name": [None] + [f"Driver {i % 50}" for i in range(1, args.locations + 1)],
+    })
+    paused = pd.DataFrame({"location_id": pd.Series(dtype="int64"),
+                           "delivery_date": pd.Series(dtype="datetime64[ns]"),
+                           "paused": pd.Series(dtype="int64")})
+
+    out, elapsed, peak = _measure(
+        lambda: db._forecast(subs, routes, paused, start, args.days, args.rate), args.repeat)
+    print(f"{n:,} subscriptions in {args.locations} locations x {args.days} days, "
+          f"rate {args.rate}, best of {args.repeat}")
+    print(f"forecast arithmetic: {elapsed * 1000:.1f} ms, peak {peak / 2**20:.1f} MB, "
+          f"{len(out):,} output rows")
+
+
+def cmd_import(args):
+    import pandas as pd
+
+    # Phones from 5550000000 up are reserved for this benchmark: it refuses
+    # to run if any are taken and deletes its rows again afterwards. No
+    # location and an old start date, so the import creates no locations,
+    # assignments or subscription events.
+    first = 5550000000
+    taken = db.fetch_one("SELECT COUNT(*) AS n FROM customers WHERE phone_number BETWEEN %s AND %s;",
+                         (str(first), str(first + args.rows - 1)))["n"]
+    if taken:
+        raise SystemExit(f"{taken} customers already have phones in the benchmark range")
+    df = pd.DataFrame({
+        "full_name": [f"Bench Customer {i}" for i in range(args.rows)],
+        "phone_number": [str(first + i) for i in range(args.rows)],
+        "address": [f"House {i}, Main Road" for i in range(args.rows)],
+        "plan_name": "Monthly",
+        "location": None,
+        "subscription_start": "2000-01-01",
+        "subscription_days": 30,
+    })
+    phones = tuple(df["phone_number"])
+    try:
+        result = db.bulk_import_customers(df)
+    finally:
+        db.execute("DELETE FROM customers WHERE phone_number IN %s;", (phones,))
+    print(f"{args.rows:,} rows: inserted {result['inserted']:,}, updated {result['updated']:,}, "
+          f"rejected {result['rejected']:,}")
+    print(f"import: {result['seconds']:.2f} s, {result['rows_per_sec']:,.0f} rows/sec")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Smart Delivery benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fetch", help="compare dict rows vs fetch_df for large reads")
+    p.add_argument("--rows", type=int, default=100_000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=cmd_fetch)
+
+    p = sub.add_parser("rows", help="per-row memory of dict rows vs typed records")
+    p.add_argument("--rows", type=int, default=100_000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=cmd_rows)
+
+    p = sub.add_parser("solve", help="time the capacity-aware assignment solver (no database)")
+    p.add_argument("--customers", type=int, default=5000)
+    p.add_argument("--drivers", type=int, default=50)
+    p.add_argument("--locations", type=int, default=400)
+    p.add_argument("--slack", type=float, default=1.1,
+                   help="total driver capacity as a multiple of demand")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=cmd_solve)
+
+    p = sub.add_parser("forecast", help="time the delivery forecast arithmetic (no database)")
+    p.add_argument("--subscriptions", type=int, default=20_000)
+    p.add_argument("--days", type=int, default=30)
+    p.add_argument("--locations", type=int, default=400)
+    p.add_argument("--rate", type=float, default=0.7)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=cmd_forecast)
+
+    p = sub.add_parser("import", help="bulk import synthetic customers (deleted afterwards)")
+    p.add_argument("--rows", type=int, default=20_000)
+    p.set_defaults(func=cmd_import)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
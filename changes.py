@@ -0,0 +1,215 @@
+"""
+Cross-process change feed over Postgres LISTEN/NOTIFY.
+
+Statement triggers on customers, drivers, locations, assignments and
+deliveries (see db.SCHEMA_DDL) send one NOTIFY per committed write on CHANNEL,
+so changes made by any Streamlit process, the scheduler or a job reach every
+process. The payload is JSON:
+
+    {"table": "deliveries", "op": "UPDATE", "date": "2026-10-19", "driver_id": 3,
+     "rows": [{"assignment_id": 41, "status": "delivered", "marked_at": 1792401302.5}]}
+    {"table": "assignments", "op": "INSERT", "date": "2026-10-19", "driver_id": 3}
+    {"table": "customers", "op": "UPDATE", "ids": [12, 40], "minor": false}
+
+Route events are grouped per (date, driver); marked_at is seconds since the
+epoch. "rows" / "ids" are left out when the payload would be too large;
+readers then reload. "minor" marks customer updates that only touched owed
+(already covered by the delivery event).
+
+feed() starts one listener thread per process. It numbers incoming events,
+keeps the latest LOG_SIZE of them and the last event number per topic, so
+callers can check whether anything they depend on changed without asking the
+database. A reconnect may have missed events, so it invalidates everything.
+"""
+import json
+import select
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+import streamlit as st
+
+import db
+
+CHANNEL = "smart_delivery_changes"
+LOG_SIZE = 1000
+CACHE_SIZE = 64
+VIEW_REFRESH_SECONDS = 3    # live views re-read the in-memory feed this often
+RECONNECT_MAX_DELAY = 30.0
+
+
+def topics(event):
+    """Topics an event touches, from broad to narrow."""
+    table = event.get("table")
+    found = [(table,)]
+    if event.get("date"):
+        found.append((table, event["date"]))
+        found.append((table, event["date"], event.get("driver_id")))
+    for i in event.get("ids") or ():
+        found.append((table, i))
+    return found
+
+
+class ChangeFeed:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seq = 0                # number of the latest event
+        self.reset_seq = 0          # events up to here may have been missed
+        self.connected = False
+        self._log = deque(maxlen=LOG_SIZE)
+        self._versions = {}
+        self._cache = OrderedDict()
+        self._thread = threading.Thread(target=self._run, name="db-change-feed", daemon=True)
+        self._thread.start()
+
+    # ---- listener thread ----
+    def _run(self):
+        delay = 1.0
+        while True:
+            try:
+                conn = db._connect()
+            except Exception:
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL};")
+                with self._lock:
+                    self.seq += 1
+                    self.reset_seq = self.seq
+                    self._cache.clear()
+                    self.connected = True
+                delay = 1.0
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        # Idle: make sure the connection is still alive.
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT 1;")
+                    conn.poll()
+                    while conn.notifies:
+                        self._publish(conn.notifies.pop(0).payload)
+            except Exception:
+                pass
+            finally:
+                self.connected = False
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            time.sleep(delay)
+
+    def _publish(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        with self._lock:
+            self.seq += 1
+            self._log.append((self.seq, event))
+            for topic in topics(event):
+                self._versions[topic] = self.seq
+
+    # ---- readers ----
+    def version(self, *watched):
+        """Latest event number touching any of the topics (0 if none yet)."""
+        with self._lock:
+            return max([self.reset_seq] + [self._versions.get(t, 0) for t in watched])
+
+    def since(self, seq):
+        """
+        (latest, events after `seq`); events is None if some of them are no
+        longer known and the caller has to reload.
+        """
+        with self._lock:
+            if seq < self.reset_seq or (self._log and seq < self._log[0][0] - 1):
+                return self.seq, None
+            return self.seq, [event for n, event in self._log if n > seq]
+
+    def cached(self, key, watched, loader):
+        """
+        loader() result, reused until an event touches one of the `watched`
+        topics. Only the entries depending on a changed topic are reloaded.
+        """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and self.connected and entry[0] >= max(
+                    [self.reset_seq] + [self._versions.get(t, 0) for t in watched]):
+                self._cache.move_to_end(key)
+                return entry[1]
+            loaded_at = self.seq
+        value = loader()
+        self._store(key, loaded_at, value)
+        return value
+
+    def _store(self, key, seq, value):
+        with self._lock:
+            self._cache[key] = (seq, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def driver_stops(self, work_date, driver_id):
+        """
+        db.list_driver_stops(), kept current from the feed: delivery marks are
+        patched into the cached rows; other changes to the route, its
+        customers, driver or any location reload it.
+        """
+        key = ("stops", work_date, driver_id)
+        day = work_date.isoformat()
+        with self._lock:
+            entry = self._cache.get(key) if self.connected else None
+        if entry:
+            latest, events = self.since(entry[0])
+            if events is not None:
+                rows = _patch_stops(entry[1], events, day, driver_id) if events else entry[1]
+                if rows is not None:
+                    self._store(key, latest, rows)
+                    return rows
+        with self._lock:
+            loaded_at = self.seq
+        rows = db.list_driver_stops(work_date, driver_id)
+        self._store(key, loaded_at, rows)
+        return rows
+
+
+def _patch_stops(rows, events, day, driver_id):
+    """Apply events to a driver's stops; None when they need a reload."""
+    by_assignment = {r.assignment_id: i for i, r in enumerate(rows)}
+    customer_ids = {r.customer_id for r in rows}
+    rows = list(rows)
+    for event in events:
+        table = event.get("table")
+        if table in ("assignments", "deliveries"):
+            if event.get("date") != day or event.get("driver_id") not in (driver_id, None):
+                continue
+            if table == "assignments" or event.get("rows") is None:
+                return None
+            for change in event["rows"]:
+                i = by_assignment.get(change["assignment_id"])
+                if i is None:
+                    continue
+                marked_at = change.get("marked_at")
+                rows[i] = rows[i]._replace(
+                    status=change.get("status"),
+                    marked_at=datetime.fromtimestamp(float(marked_at), timezone.utc) if marked_at else None,
+                )
+        elif table == "locations":
+            # Rows carry the location's name, not its id.
+            return None
+        elif table in ("customers", "drivers"):
+            if table == "customers" and event.get("minor"):
+                continue
+            ids = event.get("ids")
+            watched = customer_ids if table == "customers" else {driver_id}
+            if ids is None or watched.intersection(ids):
+                return None
+    return rows
+
+
+@st.cache_resource
+def feed():
+    """The process-wide ChangeFeed; starts its listener on first use."""
+    return ChangeFeed()
@@ -1,82 +1,428 @@
+import functools
+import random
+import sys
+import threading
+import time
+
 import streamlit as st
 import psycopg2
+import psycopg2.errors
 from psycopg2.extras import RealDictCursor
 
+from models import Assignment, Customer, CustomerRef, Delivery, Driver
+from profiler import section
+
 # -------------------------------
 # DATABASE CONNECTION
 # -------------------------------
-def get_conn():
+# Optional keys in .streamlit/secrets.toml; the serverless DB can take a few
+# seconds to wake, so connects are retried with jittered backoff.
+CONNECT_DEFAULTS = {
+    "DB_CONNECT_TIMEOUT": 10,           # seconds per connect attempt
+    "DB_STATEMENT_TIMEOUT_MS": 30000,   # 0 disables
+    "DB_CONNECT_RETRIES": 3,            # extra attempts after the first
+    "DB_RETRY_BASE_DELAY": 0.5,         # seconds, doubled per attempt
+    "DB_RETRY_MAX_DELAY": 5.0,
+    "DB_BREAKER_THRESHOLD": 3,          # failed connects before failing fast
+    "DB_BREAKER_RESET_SECONDS": 30,
+}
+
+
+def _setting(key):
+    return type(CONNECT_DEFAULTS[key])(st.secrets.get(key, CONNECT_DEFAULTS[key]))
+
+
+class DatabaseUnavailable(Exception):
+    """The database could not be reached, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    closed    -> connects go through; consecutive failures are counted.
+    open      -> connects fail immediately until reset_seconds have passed.
+    half_open -> one trial connect is let through; success closes the
+                 breaker, failure opens it again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.last_error = None
+
+    def state(self):
+        with self.lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < _setting("DB_BREAKER_RESET_SECONDS"):
+            return "open"
+        return "half_open"
+
+    def before_connect(self):
+        with self.lock:
+            state = self._state()
+            if state == "open" or (state == "half_open" and self.trial_running):
+                wait = _setting("DB_BREAKER_RESET_SECONDS") - (time.monotonic() - self.opened_at)
+                raise DatabaseUnavailable(
+                    f"Database unavailable (circuit open, retrying in {max(wait, 0):.0f}s): "
+                    f"{self.last_error}"
+                )
+            self.trial_running = state == "half_open"
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self, error):
+        with self.lock:
+            self.failures += 1
+            self.last_error = error
+            if self.trial_running or self.failures >= _setting("DB_BREAKER_THRESHOLD"):
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+BREAKER = CircuitBreaker()
+
+# Overrides DB_STATEMENT_TIMEOUT_MS for the whole process when set; jobs.py
+# sets it so long maintenance statements are not held to the app's limit.
+_statement_timeout_ms = None
+
+
+def set_statement_timeout(ms):
+    """Use `ms` instead of DB_STATEMENT_TIMEOUT_MS for new connections; 0 disables it."""
+    global _statement_timeout_ms
+    _statement_timeout_ms = ms
+
+
+def _connect():
+    timeout = _setting("DB_STATEMENT_TIMEOUT_MS") if _statement_timeout_ms is None else _statement_timeout_ms
+    options = f"-c statement_timeout={timeout}" if timeout else ""
     return psycopg2.connect(
         host=st.secrets["DB_HOST"],
         dbname=st.secrets["DB_NAME"],
         user=st.secrets["DB_USER"],
         password=st.secrets["DB_PASSWORD"],
         sslmode=st.secrets["DB_SSLMODE"],
-        cursor_factory=RealDictCursor
+        connect_timeout=_setting("DB_CONNECT_TIMEOUT"),
+        options=options,
     )
 
+
+def _backoff(attempt):
+    delay = min(_setting("DB_RETRY_MAX_DELAY"), _setting("DB_RETRY_BASE_DELAY") * 2 ** attempt)
+    time.sleep(random.uniform(0, delay))
+
+
+def get_conn():
+    """
+    Open a connection, retrying OperationalError (refused, timed out, compute
+    still waking) with full-jitter exponential backoff. Raises
+    DatabaseUnavailable once retries run out or while the breaker is open.
+    Only connects count towards the breaker; errors from statements on an
+    open connection never do (see retry_transient for those).
+    """
+    BREAKER.before_connect()
+    retries = _setting("DB_CONNECT_RETRIES")
+    with section("db connect"):
+        for attempt in range(retries + 1):
+            try:
+                conn = _connect()
+            except psycopg2.OperationalError as e:
+                error = str(e).strip()
+                if attempt == retries:
+                    BREAKER.record_failure(error)
+                    raise DatabaseUnavailable(
+                        f"Could not connect after {retries + 1} attempts: {error}"
+                    ) from e
+                _backoff(attempt)
+            except Exception as e:
+                BREAKER.record_failure(str(e))
+                raise
+            else:
+                BREAKER.record_success()
+                return conn
+
+
+# Errors after which the server has rolled the transaction back, so the work
+# can simply be run again on a new connection.
+TRANSIENT_ERRORS = (
+    psycopg2.errors.SerializationFailure,   # 40001
+    psycopg2.errors.DeadlockDetected,       # 40P01
+    psycopg2.errors.AdminShutdown,          # 57P01
+    psycopg2.errors.CrashShutdown,          # 57P02
+    psycopg2.errors.CannotConnectNow,       # 57P03
+)
+
+
+def _is_transient(error, read_only):
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    # A connection that drops without a SQLSTATE may have taken a COMMIT
+    # with it, so only reads are rerun then.
+    return read_only and error.pgcode is None and isinstance(
+        error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+def retry_transient(read_only=False):
+    """
+    Rerun the decorated function when it fails with a transient error
+    (serialization failure, deadlock, server shutdown or restart), up to
+    DB_CONNECT_RETRIES times with the same backoff as connects. Only for
+    functions whose work is a single transaction, committed at the end.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            retries = _setting("DB_CONNECT_RETRIES")
+            for attempt in range(retries + 1):
+                try:
+                    return fn(*args, **kwargs)
+                except psycopg2.Error as e:
+                    if attempt == retries or not _is_transient(e, read_only):
+                        raise
+                    _backoff(attempt)
+        return run
+    return decorate
+
+
+@st.cache_resource
+def warm_up():
+    """
+    Wake the database in the background once per process, so the login
+    screen renders while a suspended compute resumes.
+    """
+    def run():
+        try:
+            get_conn().close()
+        except DatabaseUnavailable:
+            pass
+
+    thread = threading.Thread(target=run, name="db-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def _db_section(helper):
+    """Profiler section named after the db.py function that ran the query."""
+    # Frames: this function, the helper, retry_transient's wrapper, caller.
+    caller = sys._getframe(3).f_code.co_name
+    return section(f"db {helper}" if caller == "<module>" else f"db {caller}")
+
+@retry_transient(read_only=True)
 def fetch_all(sql, params=None):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
+    with _db_section("fetch_all"), get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(sql, params or ())
             return cur.fetchall()
 
+@retry_transient(read_only=True)
 def fetch_one(sql, params=None):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
+    with _db_section("fetch_one"), get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(sql, params or ())
             return cur.fetchone()
 
+@retry_transient(read_only=True)
+def fetch_records(model, sql, params=None):
+    """
+    Like fetch_all, but each row is a `model` NamedTuple (see models.py)
+    built from a plain tuple. The SELECT list must match model._fields.
+    """
+    with _db_section("fetch_records"), get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params or ())
+            columns = tuple(c.name for c in cur.description)
+            if columns != model._fields:
+                raise ValueError(f"{model.__name__} expects columns {model._fields}, query returned {columns}")
+            return list(map(model._make, cur.fetchall()))
+
+@retry_transient()
 def execute(sql, params=None):
-    with get_conn() as conn:
+    with _db_section("execute"), get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, params or ())
             conn.commit()
 
+# Postgres type OIDs -> pandas dtypes used by fetch_df
+PG_PANDAS_DTYPES = {
+    16: "boolean",                              # bool
+    20: "Int64", 21: "Int64", 23: "Int64",      # int8, int2, int4
+    700: "float64", 701: "float64", 1700: "float64",  # float4, float8, numeric
+    19: "string", 25: "string", 1043: "string",  # name, text, varchar
+}
+PG_DATETIME_TYPES = {1082, 1114, 1184}          # date, timestamp, timestamptz
+
+@retry_transient(read_only=True)
+def fetch_df(sql, params=None, method="copy"):
+    """
+    Run a SELECT and return a typed DataFrame without building a dict per row.
+
+    method="copy" streams the result with COPY ... TO STDOUT (CSV) and
+    parses it with pandas; column types come from a LIMIT 0 probe of the
+    same query. method="tuples" uses a plain tuple cursor instead.
+    Dates and timestamps come back as datetime64 columns. Note that the
+    CSV path cannot tell NULL from an empty string; both become <NA>.
+    """
+    import io
+    import pandas as pd
+
+    with _db_section("fetch_df"), get_conn() as conn:
+        with conn.cursor() as cur:
+            query = cur.mogrify(sql, params or ()).decode().strip().rstrip(";")
+
+            if method == "tuples":
+                cur.execute(query)
+                columns = cur.description
+                df = pd.DataFrame.from_records(cur.fetchall(), columns=[c.name for c in columns])
+            elif method == "copy":
+                cur.execute(f"SELECT * FROM ({query}) AS q LIMIT 0;")
+                columns = cur.description
+                buf = io.StringIO()
+                cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", buf)
+                buf.seek(0)
+                # Let the C parser type numeric columns directly; everything
+                # else is read as text and converted below.
+                df = pd.read_csv(
+                    buf,
+                    dtype={
+                        c.name: PG_PANDAS_DTYPES[c.type_code]
+                        if PG_PANDAS_DTYPES.get(c.type_code) in ("Int64", "float64") else "string"
+                        for c in columns
+                    },
+                    keep_default_na=False,
+                    na_values=[""]
+                )
+            else:
+                raise ValueError(f"Unknown fetch method: {method}")
+
+    for c in columns:
+        col = df[c.name]
+        if c.type_code in PG_DATETIME_TYPES:
+            df[c.name] = pd.to_datetime(col, format="ISO8601", utc=c.type_code == 1184)
+            continue
+        dtype = PG_PANDAS_DTYPES.get(c.type_code)
+        if dtype is None:
+            continue
+        if dtype == "boolean" and method == "copy":
+            col = col.map({"t": True, "f": False})
+        elif dtype in ("Int64", "float64") and method == "tuples":
+            col = pd.to_numeric(col)
+        df[c.name] = col.astype(dtype)
+    return df
+
 # -------------------------------
 # HEALTH CHECK
 # -------------------------------
 def db_healthcheck():
+    """Connect + SELECT 1; reports latency and breaker state instead of raising."""
+    started = time.perf_counter()
     try:
-        fetch_one("SELECT 1;")
-        return True
-    except:
-        return False
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+        conn.close()
+        ok, error = True, None
+    except (DatabaseUnavailable, psycopg2.Error) as e:
+        ok, error = False, str(e).strip()
+    return {
+        "ok": ok,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        "breaker": BREAKER.state(),
+        "error": error,
+    }
 
 # -------------------------------
 # CUSTOMER FUNCTIONS
 # -------------------------------
 def list_customers():
-    return fetch_all("""
+    return fetch_records(Customer, """
         SELECT customer_id, full_name, phone_number, address, plan_name,
                location, owed, subscription_start, subscription_days
         FROM customers
         ORDER BY customer_id;
     """)
 
+def list_customer_refs():
+    """Id and name of every customer, for pickers."""
+    return fetch_records(CustomerRef, """
+        SELECT customer_id, full_name
+        FROM customers
+        ORDER BY full_name, customer_id;
+    """)
+
+def get_customer(customer_id):
+    rows = fetch_records(Customer, """
+        SELECT customer_id, full_name, phone_number, address, plan_name,
+               location, owed, subscription_start, subscription_days
+        FROM customers
+        WHERE customer_id = %s;
+    """, (customer_id,))
+    return rows[0] if rows else None
+
+def list_expired_customers(today):
+    """Customers whose subscription (plus owed days) ended before `today`."""
+    return fetch_records(Customer, """
+        SELECT customer_id, full_name, phone_number, address, plan_name,
+               location, owed, subscription_start, subscription_days
+        FROM customers
+        WHERE subscription_start + subscription_days + owed < %s
+        ORDER BY full_name, customer_id;
+    """, (today,))
+
+@retry_transient()
 def add_customer(full_name, phone, address, plan_name, location, subscription_start, subscription_days):
-    execute("""
-        INSERT INTO customers (full_name, phone_number, address, plan_name, location,
-                               subscription_start, subscription_days)
-        VALUES (%s, %s, %s, %s, %s, %s, %s);
-    """, (full_name, phone or "", address, plan_name, location, subscription_start, subscription_days))
+    """Insert a customer and put them on today's / planned routes; returns the new id."""
+    from datetime import date
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                INSERT INTO customers (full_name, phone_number, address, plan_name, location,
+                                       subscription_start, subscription_days)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING customer_id;
+            """, (full_name, phone or "", address, plan_name, location, subscription_start, subscription_days))
+            customer_id = cur.fetchone()["customer_id"]
+            _assign_customer(cur, customer_id, date.today())
+        conn.commit()
+    return customer_id
 
+@retry_transient()
 def update_customer(customer_id, full_name, phone, address, plan_name, location, subscription_start, subscription_days):
-    execute("""
-        UPDATE customers
-        SET full_name = %s,
-            phone_number = %s,
-            address = %s,
-            plan_name = %s,
-            location = %s,
-            subscription_start = %s,
-            subscription_days = %s
-        WHERE customer_id = %s;
-    """, (full_name, phone or "", address, plan_name, location, subscription_start, subscription_days, customer_id))
+    from datetime import date
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Self-join to read the pre-update values in the same statement.
+            cur.execute("""
+                UPDATE customers c
+                SET full_name = %s,
+                    phone_number = %s,
+                    address = %s,
+                    plan_name = %s,
+                    location = %s,
+                    subscription_start = %s,
+                    subscription_days = %s
+                FROM customers old
+                WHERE c.customer_id = %s AND old.customer_id = c.customer_id
+                RETURNING old.location_id IS DISTINCT FROM c.location_id AS relocated,
+                          old.subscription_start IS DISTINCT FROM c.subscription_start AS restarted;
+            """, (full_name, phone or "", address, plan_name, location, subscription_start, subscription_days, customer_id))
+            row = cur.fetchone()
+            if row:
+                if row["restarted"]:
+                    _reset_owed(cur, customer_id, "subscription_change")
+                _assign_customer(cur, customer_id, date.today(), relocate=row["relocated"])
+        conn.commit()
 
 # -------------------------------
 # RENEWAL (NETFLIX R1 MODEL)
 # -------------------------------
+@retry_transient()
 def renew_subscription(customer_id, extra_days):
     from datetime import date
     today = date.today()
@@ -87,29 +433,202 @@ def renew_subscription(customer_id, extra_days):
     if row["owed"] > 0:
         raise ValueError("Cannot renew: customer has pending owed deliveries.")
 
-    execute("""
-        UPDATE customers
-        SET subscription_start = %s,
-            subscription_days = %s,
-            owed = 0
-        WHERE customer_id = %s;
-    """, (today, extra_days, customer_id))
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                UPDATE customers c
+                SET subscription_start = %s,
+                    subscription_days = %s
+                FROM customers old
+                WHERE c.customer_id = %s AND old.customer_id = c.customer_id
+                RETURNING old.subscription_start + old.subscription_days + old.owed AS previous_end;
+            """, (today, extra_days, customer_id))
+            previous_end = cur.fetchone()["previous_end"]
+            _reset_owed(cur, customer_id, "renewal", always=True, subscription_end=previous_end)
+            _assign_customer(cur, customer_id, today)
+        conn.commit()
+
+@retry_transient()
+def delete_customer(customer_id, reopen_closed_days=False):
+    """
+    Delete a customer with their assignments and deliveries. Raises
+    ValueError if they appear on closed days, unless reopen_closed_days.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _reopen_days_of(cur, "customer_id", customer_id, reopen_closed_days)
+            cur.execute("DELETE FROM deliveries WHERE assignment_id IN (SELECT assignment_id FROM assignments WHERE customer_id = %s);", (customer_id,))
+            cur.execute("DELETE FROM assignments WHERE customer_id = %s;", (customer_id,))
+            cur.execute("DELETE FROM customers WHERE customer_id = %s;", (customer_id,))
+        conn.commit()
+
+# -------------------------------
+# BULK CUSTOMER IMPORT
+# -------------------------------
+IMPORT_COLUMNS = ["full_name", "phone_number", "address", "plan_name", "location",
+                  "subscription_start", "subscription_days"]
+
+def validate_customer_import(df):
+    """
+    Vectorized validation of an uploaded customer sheet. Same rules as the
+    Add Customer form: 10-digit phone, required name. Missing start date
+    and days default to today / 30; a missing plan stays blank (None) so
+    re-imports keep an existing customer's plan.
+
+    Returns (valid_df, errors_df); errors_df has the 1-based CSV row number
+    (excluding the header) and the reason each row was rejected.
+    """
+    import pandas as pd
+    from datetime import date
+
+    df = df.rename(columns=lambda c: str(c).strip().lower().replace(" ", "_"))
+    if "phone" in df.columns and "phone_number" not in df.columns:
+        df = df.rename(columns={"phone": "phone_number"})
+    for col in IMPORT_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df = df[IMPORT_COLUMNS].copy()
+    df.insert(0, "row_no", range(1, len(df) + 1))
+
+    for col in ["full_name", "phone_number", "address", "plan_name", "location"]:
+        df[col] = df[col].astype("string").str.strip()
+    # Phones read as numbers lose nothing at 10 digits but gain a ".0".
+    df["phone_number"] = df["phone_number"].str.replace(r"\.0$", "", regex=True)
+    df["plan_name"] = df["plan_name"].replace("", pd.NA)
+
+    raw_start = df["subscription_start"]
+    blank_start = raw_start.isna() | (raw_start.astype("string").str.strip() == "")
+    start = pd.to_datetime(raw_start, errors="coerce").mask(blank_start, pd.Timestamp(date.today()))
+    df["subscription_start"] = start.dt.strftime("%Y-%m-%d")
+
+    raw_days = df["subscription_days"]
+    df["subscription_days"] = pd.to_numeric(raw_days, errors="coerce")
+    df.loc[raw_days.isna(), "subscription_days"] = 30
+
+    checks = [
+        (~df["phone_number"].fillna("").str.fullmatch(r"\d{10}"), "Invalid phone number. Must be 10 digits."),
+        (df["full_name"].fillna("") == "", "Name is required."),
+        (df["subscription_start"].isna(), "Invalid subscription_start date."),
+        (df["subscription_days"].isna() | (df["subscription_days"] < 1), "Invalid subscription_days."),
+        (df["subscription_days"].notna() & (df["subscription_days"] % 1 != 0),
+         "subscription_days must be a whole number."),
+    ]
+    errors = pd.concat(
+        [pd.DataFrame({"row_no": df.loc[mask, "row_no"], "error": msg}) for mask, msg in checks],
+        ignore_index=True
+    ).sort_values("row_no", kind="stable")
+
+    valid = df[~df["row_no"].isin(errors["row_no"])].copy()
+    valid["subscription_days"] = valid["subscription_days"].astype(int)
+    return valid, errors.reset_index(drop=True)
+
+@retry_transient()
+def bulk_import_customers(df):
+    """
+    Validate `df` and load the valid rows with COPY into a temp staging
+    table, then merge into customers by phone number in one statement:
+    existing phones get their profile (name, address, plan, location)
+    updated, keeping the stored value where the cell is blank; new phones
+    are inserted, with plan Monthly when none is given. When a phone
+    repeats in the file the last row wins.
+
+    Returns a dict with inserted / updated / rejected counts, the errors
+    DataFrame, elapsed seconds and rows per second.
+    """
+    import io
+    import time
+
+    started = time.perf_counter()
+    valid, errors = validate_customer_import(df)
+    inserted = updated = 0
+
+    if not valid.empty:
+        buf = io.StringIO()
+        valid.to_csv(buf, index=False, header=False)
+        buf.seek(0)
 
-def delete_customer(customer_id):
-    execute("DELETE FROM deliveries WHERE assignment_id IN (SELECT assignment_id FROM assignments WHERE customer_id = %s);", (customer_id,))
-    execute("DELETE FROM assignments WHERE customer_id = %s;", (customer_id,))
-    execute("DELETE FROM customers WHERE customer_id = %s;", (customer_id,))
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    CREATE TEMP TABLE customers_staging (
+                        row_no             INTEGER,
+                        full_name          TEXT,
+                        phone_number       TEXT,
+                        address            TEXT,
+                        plan_name          TEXT,
+                        location           TEXT,
+                        subscription_start DATE,
+                        subscription_days  INTEGER
+                    ) ON COMMIT DROP;
+                """)
+                cur.copy_expert(
+                    "COPY customers_staging (row_no, " + ", ".join(IMPORT_COLUMNS) + ") "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    buf
+                )
+                cur.execute("""
+                    WITH src AS (
+                        SELECT DISTINCT ON (phone_number) *
+                        FROM customers_staging
+                        ORDER BY phone_number, row_no DESC
+                    ),
+                    upd AS (
+                        UPDATE customers c
+                        SET full_name = s.full_name,
+                            address = COALESCE(s.address, c.address),
+                            plan_name = COALESCE(s.plan_name, c.plan_name),
+                            location = COALESCE(s.location, c.location)
+                        FROM src s
+                        WHERE c.phone_number = s.phone_number
+                        RETURNING c.customer_id
+                    ),
+                    ins AS (
+                        INSERT INTO customers (full_name, phone_number, address, plan_name, location,
+                                               subscription_start, subscription_days)
+                        SELECT s.full_name, s.phone_number, s.address, COALESCE(s.plan_name, 'Monthly'), s.location,
+                               s.subscription_start, s.subscription_days
+                        FROM src s
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM customers c WHERE c.phone_number = s.phone_number
+                        )
+                        RETURNING customer_id
+                    )
+                    SELECT (SELECT COUNT(*) FROM ins) AS inserted,
+                           (SELECT COUNT(*) FROM upd) AS updated;
+                """)
+                counts = cur.fetchone()
+            conn.commit()
+        inserted, updated = counts["inserted"], counts["updated"]
+
+    elapsed = time.perf_counter() - started
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "rejected": errors["row_no"].nunique(),
+        "errors": errors,
+        "seconds": elapsed,
+        "rows_per_sec": len(df) / elapsed if elapsed else 0.0,
+    }
 
 # -------------------------------
 # DRIVER FUNCTIONS
 # -------------------------------
 def list_drivers():
-    return fetch_all("""
-        SELECT driver_id, full_name, phone
+    return fetch_records(Driver, """
+        SELECT driver_id, full_name, phone, capacity, shift_minutes
         FROM drivers
         ORDER BY full_name;
     """)
 
+def update_driver_capacities(driver_ids, capacities, shift_minutes):
+    """Bulk-update bowls per run and shift length (None: no limit); arguments are parallel lists."""
+    execute("""
+        UPDATE drivers d
+        SET capacity = u.capacity, shift_minutes = u.shift_minutes
+        FROM unnest(%s::int[], %s::int[], %s::int[]) AS u (driver_id, capacity, shift_minutes)
+        WHERE d.driver_id = u.driver_id;
+    """, (list(driver_ids), list(capacities), list(shift_minutes)))
+
 def add_driver(full_name, phone):
     row = fetch_all("""
         INSERT INTO drivers (full_name, phone)
@@ -118,34 +637,43 @@ def add_driver(full_name, phone):
     """, (full_name, phone))
     return row[0]["driver_id"]
 
-def delete_driver(driver_id):
-    """Fully delete a driver and all linked records including user account."""
+@retry_transient()
+def delete_driver(driver_id, reopen_closed_days=False):
+    """
+    Fully delete a driver and all linked records including user account, in
+    one transaction. Raises ValueError if the driver appears on closed days,
+    unless reopen_closed_days.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _reopen_days_of(cur, "driver_id", driver_id, reopen_closed_days)
 
-    # 1. Delete deliveries for this driver's assignments
-    execute("""
-        DELETE FROM deliveries
-        WHERE assignment_id IN (
-            SELECT assignment_id FROM assignments WHERE driver_id = %s
-        );
-    """, (driver_id,))
+            # 1. Delete deliveries for this driver's assignments
+            cur.execute("""
+                DELETE FROM deliveries
+                WHERE assignment_id IN (
+                    SELECT assignment_id FROM assignments WHERE driver_id = %s
+                );
+            """, (driver_id,))
 
-    # 2. Delete assignments
-    execute("""
-        DELETE FROM assignments
-        WHERE driver_id = %s;
-    """, (driver_id,))
+            # 2. Delete assignments
+            cur.execute("""
+                DELETE FROM assignments
+                WHERE driver_id = %s;
+            """, (driver_id,))
 
-    # 3. Delete linked user
-    execute("""
-        DELETE FROM users
-        WHERE driver_id = %s;
-    """, (driver_id,))
+            # 3. Delete linked user
+            cur.execute("""
+                DELETE FROM users
+                WHERE driver_id = %s;
+            """, (driver_id,))
 
-    # 4. Delete driver
-    execute("""
-        DELETE FROM drivers
-        WHERE driver_id = %s;
-    """, (driver_id,))
+            # 4. Delete driver
+            cur.execute("""
+                DELETE FROM drivers
+                WHERE driver_id = %s;
+            """, (driver_id,))
+        conn.commit()
 
 def create_driver_user(username, password, driver_id):
     execute("""
@@ -165,20 +693,144 @@ def create_assignment(assign_date, customer_id, driver_id, created_by=None):
 def delete_assignment(assignment_id):
     execute("DELETE FROM assignments WHERE assignment_id = %s;", (assignment_id,))
 
-def list_assignments_for_date(assign_date):
-    return fetch_all("""
+def list_assignments_for_date(assign_date, driver_id=None):
+    return fetch_records(Assignment, """
         SELECT a.assignment_id, a.customer_id, c.full_name AS customer_name,
                a.driver_id, d.full_name AS driver_name
         FROM assignments a
         JOIN customers c ON a.customer_id = c.customer_id
         JOIN drivers d ON a.driver_id = d.driver_id
         WHERE a.assign_date = %s
+          AND (%s::int IS NULL OR a.driver_id = %s)
         ORDER BY c.full_name;
-    """, (assign_date,))
+    """, (assign_date, driver_id, driver_id))
+
+def list_driver_customers(driver_id, start_date, end_date):
+    """Distinct customers on a driver's routes between two dates (inclusive)."""
+    return fetch_records(CustomerRef, """
+        SELECT DISTINCT c.customer_id, c.full_name
+        FROM assignments a
+        JOIN customers c ON a.customer_id = c.customer_id
+        WHERE a.driver_id = %s AND a.assign_date BETWEEN %s AND %s
+        ORDER BY c.full_name, c.customer_id;
+    """, (driver_id, start_date, end_date))
+
+def list_driver_stops(assign_date, driver_id):
+    """
+    One driver's stops for a day with location, delivery status and when it
+    was marked, in planned order: the order the stops were assigned, which
+    is also what driver_throughput measures the marking order against.
+    """
+    return fetch_records(Delivery, """
+        SELECT a.assignment_id, a.customer_id, c.full_name AS customer_name,
+               a.driver_id, d.full_name AS driver_name, l.name AS location,
+               del.status, del.marked_at, del.marked_by
+        FROM assignments a
+        JOIN customers c ON a.customer_id = c.customer_id
+        JOIN drivers d ON a.driver_id = d.driver_id
+        LEFT JOIN locations l ON l.location_id = c.location_id
+        LEFT JOIN deliveries del
+               ON del.assignment_id = a.assignment_id
+              AND del.delivery_date = a.assign_date
+        WHERE a.assign_date = %s AND a.driver_id = %s
+        ORDER BY a.assignment_id;
+    """, (assign_date, driver_id))
+
+@retry_transient()
+def reassign_driver_assignments(from_driver_id, to_driver_ids, start_date, end_date=None,
+                                customer_ids=None, balance_by_load=False):
+    """
+    Move one driver's assignments between start_date and end_date
+    (inclusive; a single day if end_date is None) to one or more other
+    drivers, optionally only for `customer_ids`.
+
+    Stops are moved a whole location at a time so routes stay together;
+    customers without a location move on their own. With several target drivers, locations go round-robin; with
+    balance_by_load=True each location goes to the target with the fewest
+    stops that day (existing plus already moved), largest locations first.
+
+    Everything runs in one transaction with a single UPDATE. Returns the
+    number of assignments moved per target driver.
+    """
+    import heapq
+
+    end_date = end_date or start_date
+    to_driver_ids = [d for d in dict.fromkeys(to_driver_ids) if d != from_driver_id]
+    if not to_driver_ids:
+        raise ValueError("Select at least one other driver to move the stops to.")
+    if start_date > end_date:
+        raise ValueError("Start date cannot be after end date.")
+
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT a.assignment_id, a.assign_date, a.customer_id, c.location_id AS location
+                FROM assignments a
+                JOIN customers c ON c.customer_id = a.customer_id
+                WHERE a.driver_id = %s
+                  AND a.assign_date BETWEEN %s AND %s
+                  AND (%s::int[] IS NULL OR a.customer_id = ANY(%s::int[]))
+                ORDER BY a.assign_date, location, a.assignment_id
+                FOR UPDATE OF a;
+            """, (from_driver_id, start_date, end_date, customer_ids, customer_ids))
+            rows = cur.fetchall()
+            if not rows:
+                return {}
+
+            loads = {}
+            if balance_by_load:
+                cur.execute("""
+                    SELECT assign_date, driver_id, COUNT(*) AS stops
+                    FROM assignments
+                    WHERE driver_id = ANY(%s) AND assign_date BETWEEN %s AND %s
+                    GROUP BY assign_date, driver_id;
+                """, (to_driver_ids, start_date, end_date))
+                loads = {(r["assign_date"], r["driver_id"]): r["stops"] for r in cur.fetchall()}
+
+            # (date, location) -> assignment ids, in query order; customers
+            # without a location are a group of their own.
+            groups = {}
+            for r in rows:
+                loc = r["location"] if r["location"] is not None else ("customer", r["customer_id"])
+                groups.setdefault((r["assign_date"], loc), []).append(r["assignment_id"])
+
+            assignment_ids, driver_ids = [], []
+            by_day = {}
+            for (day, loc), ids in groups.items():
+                by_day.setdefault(day, []).append(ids)
+
+            for day, day_groups in by_day.items():
+                if balance_by_load:
+                    heap = [(loads.get((day, d), 0), i, d) for i, d in enumerate(to_driver_ids)]
+                    heapq.heapify(heap)
+                    for ids in sorted(day_groups, key=len, reverse=True):
+                        load, i, target = heapq.heappop(heap)
+                        assignment_ids += ids
+                        driver_ids += [target] * len(ids)
+                        heapq.heappush(heap, (load + len(ids), i, target))
+                else:
+                    for n, ids in enumerate(day_groups):
+                        target = to_driver_ids[n % len(to_driver_ids)]
+                        assignment_ids += ids
+                        driver_ids += [target] * len(ids)
+
+            cur.execute("""
+                UPDATE assignments a
+                SET driver_id = m.driver_id
+                FROM unnest(%s::int[], %s::int[]) AS m(assignment_id, driver_id)
+                WHERE a.assignment_id = m.assignment_id;
+            """, (assignment_ids, driver_ids))
+        conn.commit()
+
+    moved = {}
+    for d in driver_ids:
+        moved[d] = moved.get(d, 0) + 1
+    return moved
 
 # -------------------------------
 # DELIVERY + OWED LOGIC
 # -------------------------------
+@retry_transient()
 def pause_delivery_for_customer(customer_id, pause_date, marked_by=None):
     row = fetch_one("""
         SELECT assignment_id
@@ -192,48 +844,194 @@ def pause_delivery_for_customer(customer_id, pause_date, marked_by=None):
 
     assignment_id = row["assignment_id"]
 
-    execute("""
-        INSERT INTO deliveries (assignment_id, delivery_date, status, marked_by)
-        VALUES (%s, %s, 'paused', %s)
-        ON CONFLICT (assignment_id, delivery_date)
-        DO UPDATE SET status='paused', marked_by = excluded.marked_by;
-    """, (assignment_id, pause_date, marked_by))
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            _record_owed_transition(cur, assignment_id, "paused", pause_date, customer_id)
+            cur.execute("""
+                INSERT INTO deliveries (assignment_id, delivery_date, status, marked_by, marked_at)
+                VALUES (%s, %s, 'paused', %s, now())
+                ON CONFLICT (assignment_id, delivery_date)
+                DO UPDATE SET status='paused', marked_by = excluded.marked_by,
+                              marked_at = excluded.marked_at
+                WHERE deliveries.status IS DISTINCT FROM 'paused';
+            """, (assignment_id, pause_date, marked_by))
+            cur.execute("""
+                INSERT INTO subscription_events (customer_id, event_type, next_event_at)
+                VALUES (%s, 'pause_resume', (%s::date + 1)::timestamptz)
+                ON CONFLICT DO NOTHING;
+            """, (customer_id, pause_date))
+        conn.commit()
 
+@retry_transient()
 def upsert_delivery(assignment_id, delivery_date, status, marked_by=None):
-    execute("""
-        INSERT INTO deliveries (assignment_id, delivery_date, status, marked_by)
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (assignment_id, delivery_date)
-        DO UPDATE SET status = excluded.status, marked_by = excluded.marked_by;
-    """, (assignment_id, delivery_date, status, marked_by))
+    """Set a stop's status; marked_at and marked_by only change along with the status."""
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            _record_owed_transition(cur, assignment_id, status, delivery_date)
+            cur.execute("""
+                INSERT INTO deliveries (assignment_id, delivery_date, status, marked_by, marked_at)
+                VALUES (%s, %s, %s, %s, now())
+                ON CONFLICT (assignment_id, delivery_date)
+                DO UPDATE SET status = excluded.status, marked_by = excluded.marked_by,
+                              marked_at = excluded.marked_at
+                WHERE deliveries.status IS DISTINCT FROM excluded.status;
+            """, (assignment_id, delivery_date, status, marked_by))
+        conn.commit()
 
-def update_owed_deliveries(assignment_id, customer_id, new_status, delivery_date):
-    row = fetch_one("SELECT owed FROM customers WHERE customer_id = %s;", (customer_id,))
-    owed = row["owed"] if row else 0
+def _record_owed_transition(cur, assignment_id, new_status, delivery_date, customer_id=None):
+    """
+    Owed rules, applied inside the caller's transaction before the delivery
+    row is written. A stop counts toward owed while its status is 'missed'
+    and it falls on or after the current subscription_start, so every
+    status change applies owed_delta(old, new) (see SCHEMA_DDL):
 
-    existing = fetch_one("""
+      anything else -> missed        : owed + 1
+      missed        -> anything else : owed - 1
+      any other change               : no change
+
+    and owed never goes below 0. reconcile_owed derives owed with the same
+    rule. Every status change appends one owed_ledger row with the delta
+    actually applied to customers.owed.
+    """
+    if customer_id is None:
+        cur.execute("SELECT customer_id FROM assignments WHERE assignment_id = %s;", (assignment_id,))
+        row = cur.fetchone()
+        if not row:
+            return
+        customer_id = row["customer_id"]
+
+    # Lock the customer before reading the old status: a concurrent mark of
+    # the same stop waits here until the first one commits, then reads the
+    # status it wrote (each statement takes a new snapshot).
+    cur.execute("SELECT owed FROM customers WHERE customer_id = %s FOR UPDATE;", (customer_id,))
+    locked = cur.fetchone()
+    if not locked:
+        return
+
+    cur.execute("""
         SELECT status
         FROM deliveries
         WHERE assignment_id = %s AND delivery_date = %s
         LIMIT 1;
     """, (assignment_id, delivery_date))
-
+    existing = cur.fetchone()
     old_status = existing["status"] if existing else None
 
-    if old_status is None:
-        if new_status == "missed":
-            owed += 1
-    else:
-        if old_status == "missed" and new_status == "delivered":
-            owed = max(0, owed - 1)
-        elif old_status == "delivered" and new_status == "missed":
-            owed += 1
+    if old_status == new_status:
+        return
+
+    cur.execute("""
+        WITH updated AS (
+            UPDATE customers c
+            SET owed = GREATEST(0, c.owed + CASE WHEN %(day)s >= c.subscription_start
+                                                 THEN owed_delta(%(old)s, %(new)s) ELSE 0 END)
+            WHERE c.customer_id = %(customer_id)s
+            RETURNING c.owed - %(owed)s AS delta
+        )
+        INSERT INTO owed_ledger (customer_id, assignment_id, delivery_date,
+                                 old_status, new_status, delta, reason)
+        SELECT %(customer_id)s, %(assignment_id)s, %(day)s, %(old)s, %(new)s, delta, 'status_change'
+        FROM updated;
+    """, {"customer_id": customer_id, "assignment_id": assignment_id, "day": delivery_date,
+          "old": old_status, "new": new_status, "owed": locked["owed"]})
 
-    execute("""
-        UPDATE customers
-        SET owed = %s
-        WHERE customer_id = %s;
-    """, (owed, customer_id))
+# owed as derived from deliveries, per customer: owed_delta(NULL, status)
+# summed over the stops since the current subscription_start, never below 0.
+# Must stay the same rule as _record_owed_transition.
+_DERIVED_OWED_SQL = """
+    SELECT a.customer_id,
+           GREATEST(0, SUM(owed_delta(NULL, del.status)))::int AS derived_owed
+    FROM deliveries del
+    JOIN assignments a ON a.assignment_id = del.assignment_id
+    JOIN customers c ON c.customer_id = a.customer_id
+    WHERE del.delivery_date >= c.subscription_start
+      {where}
+    GROUP BY a.customer_id
+"""
+
+def _reset_owed(cur, customer_id, reason, always=False, subscription_end=None):
+    """
+    Set a customer's owed to the value derived for their current
+    subscription (after subscription_start changed) and ledger the change.
+    With always=True the ledger row is written even when nothing changed,
+    so renewals are always recorded; `subscription_end` is stored on the
+    row (the end of the subscription a renewal replaced).
+    """
+    cur.execute(f"""
+        WITH derived AS (
+            {_DERIVED_OWED_SQL.format(where='AND a.customer_id = %(customer_id)s')}
+        ),
+        old AS (
+            SELECT owed FROM customers WHERE customer_id = %(customer_id)s FOR UPDATE
+        ),
+        updated AS (
+            UPDATE customers c
+            SET owed = COALESCE((SELECT derived_owed FROM derived), 0)
+            FROM old
+            WHERE c.customer_id = %(customer_id)s
+            RETURNING c.owed - old.owed AS delta
+        )
+        INSERT INTO owed_ledger (customer_id, delta, reason, subscription_end)
+        SELECT %(customer_id)s, delta, %(reason)s, %(subscription_end)s
+        FROM updated
+        WHERE delta <> 0 OR %(always)s;
+    """, {"customer_id": customer_id, "reason": reason, "always": always,
+          "subscription_end": subscription_end})
+
+def reconcile_owed(fix=False):
+    """
+    Recompute every customer's owed balance from deliveries in one query,
+    with the rule _record_owed_transition applies (missed stops since the
+    current subscription_start).
+
+    Returns one row per customer whose stored owed or ledger balance
+    disagrees with that. With fix=True, customers.owed is reset to the
+    derived value and a 'reconciliation' ledger entry brings the ledger
+    balance in line, in the same statement.
+    """
+    fix_sql = """
+        , fixed AS (
+            UPDATE customers c
+            SET owed = r.derived_owed
+            FROM report r
+            WHERE c.customer_id = r.customer_id
+              AND c.owed IS DISTINCT FROM r.derived_owed
+            RETURNING c.customer_id
+        )
+        , logged AS (
+            INSERT INTO owed_ledger (customer_id, delta, reason)
+            SELECT customer_id, derived_owed - ledger_owed, 'reconciliation'
+            FROM report
+            WHERE derived_owed <> ledger_owed
+            RETURNING customer_id
+        )
+    """ if fix else ""
+
+    return fetch_all(f"""
+        WITH derived AS (
+            {_DERIVED_OWED_SQL.format(where='')}
+        ),
+        ledger AS (
+            SELECT customer_id, SUM(delta) AS ledger_owed
+            FROM owed_ledger
+            GROUP BY customer_id
+        ),
+        report AS (
+            SELECT c.customer_id,
+                   c.full_name,
+                   c.owed AS stored_owed,
+                   COALESCE(l.ledger_owed, 0)::int AS ledger_owed,
+                   COALESCE(d.derived_owed, 0)::int AS derived_owed
+            FROM customers c
+            LEFT JOIN derived d ON d.customer_id = c.customer_id
+            LEFT JOIN ledger l ON l.customer_id = c.customer_id
+            WHERE c.owed IS DISTINCT FROM COALESCE(d.derived_owed, 0)
+               OR COALESCE(l.ledger_owed, 0) <> COALESCE(d.derived_owed, 0)
+        )
+        {fix_sql}
+        SELECT * FROM report
+        ORDER BY customer_id;
+    """)
 
 # -------------------------------
 # KPIs
@@ -249,6 +1047,339 @@ def delivery_kpis_for_date(delivery_date):
         WHERE delivery_date = %s;
     """, (delivery_date,))
 
+def _load_delivery_report(from_date, to_date):
+    return fetch_df("""
+        SELECT delivery_date, assignment_id, status FROM deliveries
+        WHERE delivery_date BETWEEN %s AND %s
+        ORDER BY delivery_date, assignment_id;
+    """, (from_date, to_date))
+
+def delivery_report(from_date, to_date):
+    """Every delivery (delivery_date, assignment_id, status) in a date range; closed days come from report_cache."""
+    import report_cache
+
+    return report_cache.range_frame("deliveries", _load_delivery_report, from_date, to_date,
+                                    day_column="delivery_date")
+
+# -------------------------------
+# DRIVER LEADERBOARD
+# -------------------------------
+# sort key -> ascending; ties are broken by driver name.
+LEADERBOARD_SORT_COLUMNS = {
+    "missed_rate": False,
+    "missed": False,
+    "delivered": False,
+    "assigned": False,
+    "paused": False,
+    "driver_name": True,
+}
+LEADERBOARD_COUNTS = ["assigned", "delivered", "missed", "paused"]
+
+def _load_driver_days(from_date, to_date):
+    return fetch_df("""
+        SELECT a.assign_date AS day,
+               a.driver_id,
+               COUNT(*) AS assigned,
+               COUNT(*) FILTER (WHERE del.status = 'delivered') AS delivered,
+               COUNT(*) FILTER (WHERE del.status = 'missed') AS missed,
+               COUNT(*) FILTER (WHERE del.status = 'paused') AS paused
+        FROM assignments a
+        LEFT JOIN deliveries del
+               ON del.assignment_id = a.assignment_id
+              AND del.delivery_date = a.assign_date
+              AND del.delivery_date BETWEEN %(from_date)s AND %(to_date)s
+        WHERE a.assign_date BETWEEN %(from_date)s AND %(to_date)s
+        GROUP BY a.assign_date, a.driver_id
+        ORDER BY a.assign_date, a.driver_id;
+    """, {"from_date": from_date, "to_date": to_date})
+
+def driver_leaderboard(from_date, to_date, sort_by="missed_rate"):
+    """
+    Per-driver assigned / delivered / missed / paused counts, missed rate and
+    weekly trend for every driver over a date range, rolled up from per
+    driver-day counts (read from report_cache for closed days).
+    `weekly_trend` is a list of {week, assigned, delivered, missed, paused}.
+    """
+    import pandas as pd
+    import report_cache
+
+    ascending = LEADERBOARD_SORT_COLUMNS.get(sort_by)
+    if ascending is None:
+        raise ValueError(f"Unknown sort column: {sort_by}")
+
+    days = report_cache.range_frame("driver_days", _load_driver_days, from_date, to_date)
+    monday = days["day"] - pd.to_timedelta(days["day"].dt.weekday, unit="D")
+    weekly = (days.assign(week=monday.dt.strftime("%Y-%m-%d"))
+                  .groupby(["driver_id", "week"], as_index=False)[LEADERBOARD_COUNTS].sum())
+    weekly[LEADERBOARD_COUNTS] = weekly[LEADERBOARD_COUNTS].astype(int)
+
+    board = pd.DataFrame(list_drivers(), columns=Driver._fields)[["driver_id", "full_name"]]
+    board = board.rename(columns={"full_name": "driver_name"}).merge(
+        weekly.groupby("driver_id", as_index=False)[LEADERBOARD_COUNTS].sum(),
+        on="driver_id", how="left")
+    board[LEADERBOARD_COUNTS] = board[LEADERBOARD_COUNTS].fillna(0).astype(int)
+    marked = board["delivered"] + board["missed"]
+    board["missed_rate"] = (board["missed"] / marked.where(marked > 0)).round(3)
+
+    keys = [sort_by] if sort_by == "driver_name" else [sort_by, "driver_name"]
+    board = board.sort_values(keys, ascending=[ascending, True][:len(keys)], na_position="last")
+
+    trends = {driver_id: group.drop(columns="driver_id").to_dict("records")
+              for driver_id, group in weekly.groupby("driver_id")}
+    rows = board.astype(object).where(board.notna(), None).to_dict("records")
+    for row in rows:
+        row["weekly_trend"] = trends.get(row["driver_id"], [])
+    return rows
+
+# -------------------------------
+# DRIVER THROUGHPUT
+# -------------------------------
+def _route_days_loader(idle_minutes):
+    """Loader for report_cache: one row per driver and route-day (see driver_throughput)."""
+    def load(from_date, to_date):
+        return fetch_df("""
+            WITH stops AS (
+                -- planned position among the stops that were actually
+                -- marked; assignment order, which is frozen with a closed day
+                SELECT a.driver_id, a.assign_date AS day,
+                       del.marked_at,
+                       ROW_NUMBER() OVER (PARTITION BY a.driver_id, a.assign_date
+                                          ORDER BY a.assignment_id) AS planned_seq
+                FROM assignments a
+                JOIN deliveries del
+                  ON del.assignment_id = a.assignment_id
+                 AND del.delivery_date = a.assign_date
+                WHERE a.assign_date BETWEEN %(from_date)s AND %(to_date)s
+                  AND del.delivery_date BETWEEN %(from_date)s AND %(to_date)s
+                  AND del.status IN ('delivered', 'missed')
+                  AND del.marked_at IS NOT NULL
+            ),
+            sequenced AS (
+                SELECT s.*,
+                       ROW_NUMBER() OVER route AS actual_seq,
+                       EXTRACT(EPOCH FROM marked_at - LAG(marked_at) OVER route) / 60 AS gap_minutes
+                FROM stops s
+                WINDOW route AS (PARTITION BY driver_id, day ORDER BY marked_at)
+            )
+            SELECT driver_id, day,
+                   COUNT(*) AS stops,
+                   MIN(marked_at) AT TIME ZONE 'UTC' AS first_stop,
+                   MAX(marked_at) AT TIME ZONE 'UTC' AS last_stop,
+                   (EXTRACT(EPOCH FROM MAX(marked_at) - MIN(marked_at)) / 60)::float AS route_minutes,
+                   COALESCE(MAX(gap_minutes), 0)::float AS max_gap_minutes,
+                   COALESCE(SUM(gap_minutes) FILTER (WHERE gap_minutes > %(idle)s), 0)::float AS idle_minutes,
+                   COUNT(*) FILTER (WHERE actual_seq = planned_seq) AS in_order,
+                   AVG(ABS(actual_seq - planned_seq))::float AS avg_displacement
+            FROM sequenced
+            GROUP BY driver_id, day
+            ORDER BY day, driver_id;
+        """, {"from_date": from_date, "to_date": to_date, "idle": idle_minutes})
+    return load
+
+def driver_throughput(from_date, to_date, driver_id=None, idle_minutes=15, by_day=False):
+    """
+    Route speed from deliveries.marked_at, per driver (or per driver and
+    day with by_day=True), from one row per route-day computed with window
+    functions (read from report_cache for closed days):
+
+    - stops_per_hour: stops after the first / hours between first and
+      last stop (routes with a single marked stop have no rate);
+    - route_minutes: first to last stop;
+    - max_gap_minutes / idle_minutes: the longest pause between consecutive
+      stops, and the total of pauses longer than `idle_minutes`;
+    - in_order / avg_displacement: how often the n-th stop marked was the
+      n-th stop planned (in the order the stops were assigned, as listed
+      for the driver) and how far off the rest were, in positions.
+
+    Only delivered / missed stops marked by the driver count; paused days
+    and rows from before marked_at existed are ignored. first_stop and
+    last_stop are in the app's local time zone.
+    """
+    import pandas as pd
+    from datetime import datetime
+    import report_cache
+
+    # Cached in UTC, so the files do not depend on the database session's zone.
+    days = report_cache.range_frame(f"route_days_utc_byid_idle{idle_minutes:g}",
+                                    _route_days_loader(idle_minutes), from_date, to_date)
+    if driver_id is not None:
+        days = days[days["driver_id"] == driver_id]
+    local_zone = datetime.now().astimezone().tzinfo
+    for col in ("first_stop", "last_stop"):
+        days[col] = days[col].dt.tz_localize("UTC").dt.tz_convert(local_zone).dt.tz_localize(None)
+    names = {d.driver_id: d.full_name for d in list_drivers()}
+    days = days.assign(
+        driver_name=days["driver_id"].map(names),
+        day=days["day"].dt.date,
+        moving_stops=(days["stops"] - 1).where(days["route_minutes"] > 0),
+        displacement=days["avg_displacement"] * days["stops"],
+    )
+
+    group = ["driver_id", "driver_name", "day"] if by_day else ["driver_id", "driver_name"]
+    spans = ({"first_stop": ("first_stop", "min"), "last_stop": ("last_stop", "max")} if by_day
+             else {"route_days": ("day", "count")})
+    out = days.groupby(group, as_index=False).agg(
+        stops=("stops", "sum"), **spans,
+        route_minutes=("route_minutes", "sum"),
+        moving_stops=("moving_stops", "sum"),
+        max_gap_minutes=("max_gap_minutes", "max"),
+        idle_minutes=("idle_minutes", "sum"),
+        in_order=("in_order", "sum"),
+        displacement=("displacement", "sum"),
+    )
+    out["stops_per_hour"] = (out["moving_stops"] / (out["route_minutes"] / 60).where(out["route_minutes"] > 0)).round(1)
+    out["in_order"] = (out["in_order"] / out["stops"]).round(3)
+    out["avg_displacement"] = (out["displacement"] / out["stops"]).round(2)
+    for col in ("route_minutes", "max_gap_minutes", "idle_minutes"):
+        out[col] = out[col].round(1)
+
+    out = out.sort_values(["stops_per_hour", *group], na_position="last")
+    out = out[[*group, "stops", *spans, "route_minutes", "stops_per_hour", "max_gap_minutes",
+               "idle_minutes", "in_order", "avg_displacement"]]
+    return out.astype(object).where(out.notna(), None).to_dict("records")
+
+# -------------------------------
+# DELIVERY FORECAST
+# -------------------------------
+def renewal_rate(lookback_days=90):
+    """
+    Share of subscriptions ending in the last `lookback_days` that renewed:
+    renewals / (renewals + subscriptions that lapsed and are still expired).
+    A renewal counts towards the window its replaced subscription ended in
+    (owed_ledger.subscription_end), so renewing early never counts twice
+    and the rate stays within 0..1. None when there is no history yet.
+    """
+    row = fetch_one("""
+        SELECT
+            (SELECT COUNT(*) FROM (
+                 SELECT DISTINCT customer_id, subscription_end FROM owed_ledger
+                 WHERE reason = 'renewal'
+                   AND subscription_end BETWEEN CURRENT_DATE - %(days)s AND CURRENT_DATE - 1
+             ) r) AS renewed,
+            (SELECT COUNT(*) FROM customers c
+             WHERE c.subscription_start + c.subscription_days + c.owed
+                   BETWEEN CURRENT_DATE - %(days)s AND CURRENT_DATE - 1) AS lapsed;
+    """, {"days": lookback_days})
+    total = row["renewed"] + row["lapsed"]
+    return row["renewed"] / total if total else None
+
+def forecast_deliveries(days=14, start=None, rate=None):
+    """
+    Expected bowls per location (and its mapped driver) for each of the
+    `days` days from `start` (default today).
+
+    Each subscription is the interval [start, start + days + owed], the
+    same window auto-assignment uses. Intervals are added to a per-location
+    difference array and cumulatively summed, so the cost is linear in the
+    number of customers. A subscription ending inside the horizon renews
+    the next day with probability `rate` (default: renewal_rate()), and
+    again at rate² after that, and so on. Paused deliveries already on file
+    are subtracted.
+
+    Returns a long DataFrame: date, location_id, location, driver_id,
+    driver_name, committed, renewals, expected. Customers without a location
+    are reported under location_id 0, "No location".
+    """
+    from datetime import date, timedelta
+
+    start = start or date.today()
+    end = start + timedelta(days=days - 1)
+    if rate is None:
+        rate = renewal_rate() or 0.0
+
+    subs = fetch_df("""
+        SELECT COALESCE(c.location_id, 0) AS location_id,
+               c.subscription_start,
+               c.subscription_days + c.owed AS length,
+               c.subscription_days
+        FROM customers c
+        WHERE c.subscription_start <= %(end)s
+          AND c.subscription_start + c.subscription_days + c.owed >= %(start)s - 1;
+    """, {"start": start, "end": end})
+    routes = fetch_df("""
+        SELECT l.location_id, l.name AS location, l.driver_id, d.full_name AS driver_name
+        FROM locations l
+        LEFT JOIN drivers d ON d.driver_id = l.driver_id
+        UNION ALL
+        SELECT 0, 'No location', NULL, NULL;
+    """)
+    paused = fetch_df("""
+        SELECT COALESCE(c.location_id, 0) AS location_id, dl.delivery_date, COUNT(*) AS paused
+        FROM deliveries dl
+        JOIN assignments a ON a.assignment_id = dl.assignment_id
+        JOIN customers c ON c.customer_id = a.customer_id
+        WHERE dl.status = 'paused'
+          AND dl.delivery_date BETWEEN %(start)s AND %(end)s
+        GROUP BY 1, 2;
+    """, {"start": start, "end": end})
+    return _forecast(subs, routes, paused, start, days, rate)
+
+def _forecast(subs, routes, paused, start, days, rate):
+    """
+    The arithmetic behind forecast_deliveries(), on already loaded frames:
+    subs (location_id, subscription_start, length, subscription_days),
+    routes (location_id, location, driver_id, driver_name) and paused
+    (location_id, delivery_date, paused).
+    """
+    import numpy as np
+    import pandas as pd
+
+    locations = pd.Index(sorted(set(subs["location_id"]) | set(paused["location_id"])), dtype="int64")
+    n_loc = len(locations)
+    committed = np.zeros((n_loc, days + 1))
+    renewals = np.zeros((n_loc, days + 1))
+
+    def add_intervals(target, codes, first, last, weight):
+        """target[code, first..last] += weight, via a difference array."""
+        first, stop = np.clip(first, 0, days), np.clip(last + 1, 0, days)
+        keep = first < stop
+        weight = np.broadcast_to(weight, keep.shape)[keep]
+        np.add.at(target, (codes[keep], first[keep]), weight)
+        np.add.at(target, (codes[keep], stop[keep]), -weight)
+
+    if n_loc and not subs.empty:
+        epoch = np.datetime64(start, "D")
+        codes = locations.get_indexer(subs["location_id"])
+        first = (subs["subscription_start"].to_numpy("datetime64[D]") - epoch).astype(np.int64)
+        last = first + subs["length"].to_numpy(np.int64)
+        plan = subs["subscription_days"].to_numpy(np.int64)
+        add_intervals(committed, codes, first, last, 1.0)
+
+        # Renewal k starts the day after the previous term ends and lasts
+        # subscription_days (owed is reset to 0 on renewal).
+        weight = np.full(len(subs), rate)
+        while rate > 0:
+            ending = last < days - 1
+            if not ending.any():
+                break
+            first = last + 1
+            last = first + plan
+            add_intervals(renewals, codes[ending], first[ending], last[ending], weight[ending])
+            weight = weight * rate
+            last = np.where(ending, last, days)
+
+    committed = np.cumsum(committed, axis=1)[:, :days]
+    renewals = np.cumsum(renewals, axis=1)[:, :days]
+
+    dates = pd.date_range(start, periods=days)
+    out = pd.DataFrame({
+        "date": np.tile(dates, n_loc),
+        "location_id": np.repeat(locations.to_numpy(), days),
+        "committed": committed.ravel(),
+        "renewals": renewals.ravel(),
+    })
+    if not paused.empty:
+        out = out.merge(paused.rename(columns={"delivery_date": "date"}),
+                        on=["location_id", "date"], how="left")
+        out["committed"] -= out.pop("paused").fillna(0).astype(float)
+    out["committed"] = out["committed"].clip(lower=0).round().astype("Int64")
+    out["renewals"] = out["renewals"].round(2)
+    out["expected"] = (out["committed"] + out["renewals"]).round(1)
+    out = out.merge(routes, on="location_id", how="left")
+    out["driver_name"] = out["driver_name"].fillna("Unassigned")
+    return out[["date", "location_id", "location", "driver_id", "driver_name",
+                "committed", "renewals", "expected"]]
+
 # -------------------------------
 # AUTH
 # -------------------------------
@@ -260,66 +1391,1642 @@ def authenticate_user(username, password):
     """, (username, password))
 
 # -------------------------------
-# AUTO ASSIGNMENT (LOCATION‑WISE ROUND ROBIN)
+# LOCATIONS (DIMENSION) AND ROUTES
+# -------------------------------
+# customers.location stays as typed; a trigger resolves it to
+# customers.location_id through location_aliases, keyed by location_key()
+# (lower case, punctuation and extra spaces dropped), so "Kondapur",
+# "kondapur " and "Kondapur." are one location. A spelling seen for the
+# first time becomes a new location; merge_similar_locations() folds near
+# duplicates ("Kondapur" / "Kondapoor") together.
+#
+# Each location keeps its driver across days (locations.driver_id); a
+# location without one goes to the driver with the fewest locations.
+# Customers without a location are placed one by one.
+LOCATION_MERGE_CUTOFF = 0.8
+
+def list_location_drivers():
+    """Every location with its driver (None if not routed yet), service time and customers."""
+    return fetch_all("""
+        SELECT l.location_id, l.name AS location, l.driver_id,
+               COALESCE(d.full_name, 'Unassigned') AS driver_name,
+               l.service_minutes::float AS service_minutes,
+               COUNT(c.customer_id) AS customers
+        FROM locations l
+        LEFT JOIN drivers d ON d.driver_id = l.driver_id
+        LEFT JOIN customers c ON c.location_id = l.location_id
+        GROUP BY l.location_id, d.full_name
+        ORDER BY l.name;
+    """)
+
+def set_location_driver(location_id, driver_id):
+    """Route a location to `driver_id` from now on (existing assignments are left alone)."""
+    execute("""
+        UPDATE locations SET driver_id = %s, updated_at = now()
+        WHERE location_id = %s;
+    """, (driver_id, location_id))
+
+def set_location_service_minutes(location_ids, minutes):
+    """Bulk-update per-stop service time (None: not timed); both arguments are parallel lists."""
+    execute("""
+        UPDATE locations l
+        SET service_minutes = u.minutes, updated_at = now()
+        FROM unnest(%s::int[], %s::numeric[]) AS u (location_id, minutes)
+        WHERE l.location_id = u.location_id;
+    """, (list(location_ids), list(minutes)))
+
+@retry_transient(read_only=True)
+def suggest_location_merges(cutoff=LOCATION_MERGE_CUTOFF):
+    """
+    Near-duplicate locations, by difflib similarity of their aliases. Each
+    location is compared with the larger ones (more customers) kept so far
+    and folded into the closest one scoring at least `cutoff`. Names whose
+    numbers differ ("Phase 1" / "Phase 2") are never merged.
+
+    Returns a list of dicts: location_id, location, into_id, into, score,
+    customers.
+    """
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            return _suggest_location_merges(cur, cutoff)
+
+def _suggest_location_merges(cur, cutoff):
+    """suggest_location_merges() on the caller's transaction (a RealDictCursor)."""
+    import difflib
+    import re
+
+    cur.execute("""
+        SELECT l.location_id, l.name,
+               (SELECT ARRAY_AGG(a.alias ORDER BY a.alias) FROM location_aliases a
+                WHERE a.location_id = l.location_id) AS aliases,
+               (SELECT COUNT(*) FROM customers c WHERE c.location_id = l.location_id) AS customers
+        FROM locations l
+        ORDER BY customers DESC, l.location_id;
+    """)
+    rows = cur.fetchall()
+
+    kept = {}       # alias -> kept location row
+    merges = []
+    for loc in rows:
+        aliases = loc["aliases"] or []
+        best = None
+        for alias in aliases:
+            numbers = re.findall(r"\d+", alias)
+            for match in difflib.get_close_matches(alias, list(kept), n=3, cutoff=cutoff):
+                if re.findall(r"\d+", match) != numbers:
+                    continue
+                score = difflib.SequenceMatcher(None, alias, match).ratio()
+                if best is None or score > best[0]:
+                    best = (score, kept[match])
+        if best is None:
+            kept.update((alias, loc) for alias in aliases)
+            continue
+        score, into = best
+        merges.append({
+            "location_id": loc["location_id"], "location": loc["name"],
+            "into_id": into["location_id"], "into": into["name"],
+            "score": round(score, 3), "customers": loc["customers"],
+        })
+    return merges
+
+@retry_transient()
+def merge_locations(pairs):
+    """
+    Fold locations into others in one transaction; `pairs` is a list of
+    (location_id, into_id). Aliases and customers move to the target, which
+    keeps its driver and service time. Returns the number merged.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            merged = _merge_locations(cur, pairs)
+        conn.commit()
+    return merged
+
+def _merge_locations(cur, pairs):
+    """merge_locations() on the caller's transaction."""
+    pairs = [(a, b) for a, b in pairs if a != b]
+    if not pairs:
+        return 0
+    from_ids, into_ids = map(list, zip(*pairs))
+    for table in ("location_aliases", "customers", "delivery_summaries"):
+        cur.execute(f"""
+            UPDATE {table} t
+            SET location_id = m.into_id
+            FROM unnest(%s::int[], %s::int[]) AS m (from_id, into_id)
+            WHERE t.location_id = m.from_id;
+        """, (from_ids, into_ids))
+    cur.execute("DELETE FROM locations WHERE location_id = ANY(%s);", (from_ids,))
+    return len(pairs)
+
+def _assign_customer(cur, customer_id, today, relocate=False):
+    """
+    Bring one customer's assignments for today and every upcoming planned
+    day (a future date that already has assignments) in line with their
+    subscription, in a single statement on the caller's transaction:
+
+    - active days without an assignment get one with the location's driver
+      (routing the location first if it has no driver yet);
+    - undelivered assignments on days the customer is no longer active are
+      removed;
+    - with relocate=True (location changed), undelivered assignments move to
+      the new location's driver. Otherwise existing assignments keep their
+      driver, so manual reassignments survive renewals and edits.
+
+    Drivers' capacity and shift length hold here as in solver.solve: a day
+    on which the location's driver is full goes to the driver with the most
+    room, a relocation onto a full driver keeps the old one, and a day with
+    no room anywhere is left unassigned (counted in `unplaced`).
+
+    Returns a dict with added, moved, removed, unplaced and driver_id.
+    """
+    cur.execute("""
+        WITH cust AS (
+            SELECT c.customer_id, c.location_id,
+                   c.subscription_start,
+                   c.subscription_start + (c.subscription_days + c.owed) AS end_date
+            FROM customers c
+            WHERE c.customer_id = %(customer_id)s
+        ),
+        pick AS (
+            SELECT d.driver_id
+            FROM drivers d
+            LEFT JOIN locations l ON l.driver_id = d.driver_id
+            GROUP BY d.driver_id
+            ORDER BY COUNT(l.location_id), d.driver_id
+            LIMIT 1
+        ),
+        new_mapping AS (
+            UPDATE locations l
+            SET driver_id = pick.driver_id, updated_at = now()
+            FROM cust, pick
+            WHERE l.location_id = cust.location_id AND l.driver_id IS NULL
+            RETURNING l.driver_id
+        ),
+        target AS (
+            SELECT driver_id FROM new_mapping
+            UNION ALL
+            SELECT l.driver_id FROM locations l JOIN cust USING (location_id)
+            WHERE l.driver_id IS NOT NULL
+            UNION ALL
+            SELECT pick.driver_id FROM cust, pick WHERE cust.location_id IS NULL
+        ),
+        days AS (
+            SELECT x.day
+            FROM cust,
+                 (SELECT %(today)s::date AS day
+                  UNION
+                  SELECT DISTINCT assign_date FROM assignments WHERE assign_date > %(today)s) x
+            WHERE x.day BETWEEN cust.subscription_start AND cust.end_date
+        ),
+        open_assignments AS (
+            SELECT a.assignment_id, a.assign_date, a.driver_id
+            FROM assignments a
+            WHERE a.customer_id = %(customer_id)s
+              AND a.assign_date >= %(today)s
+              AND NOT EXISTS (SELECT 1 FROM deliveries dl WHERE dl.assignment_id = a.assignment_id)
+        ),
+        -- Every other stop each driver has on those days.
+        load AS (
+            SELECT a.assign_date AS day, a.driver_id, COUNT(*) AS stops,
+                   COALESCE(SUM(l.service_minutes), 0) AS minutes
+            FROM assignments a
+            JOIN customers c ON c.customer_id = a.customer_id
+            LEFT JOIN locations l ON l.location_id = c.location_id
+            WHERE a.assign_date IN (SELECT day FROM days)
+              AND a.customer_id <> %(customer_id)s
+            GROUP BY 1, 2
+        ),
+        -- Drivers that can take this customer's stop on each day, with the
+        -- stops they could still take (NULL: no limit).
+        room AS (
+            SELECT days.day, d.driver_id, COALESCE(load.stops, 0) AS stops,
+                   LEAST(d.capacity - COALESCE(load.stops, 0),
+                         floor((d.shift_minutes - COALESCE(load.minutes, 0)) / NULLIF(svc.minutes, 0))) AS room
+            FROM days
+            CROSS JOIN drivers d
+            CROSS JOIN (SELECT COALESCE(MIN(l.service_minutes), 0) AS minutes
+                        FROM cust LEFT JOIN locations l USING (location_id)) svc
+            LEFT JOIN load ON load.day = days.day AND load.driver_id = d.driver_id
+            WHERE (d.capacity IS NULL OR COALESCE(load.stops, 0) < d.capacity)
+              AND (d.shift_minutes IS NULL OR COALESCE(load.minutes, 0) + svc.minutes <= d.shift_minutes)
+        ),
+        placement AS (
+            SELECT DISTINCT ON (room.day) room.day, room.driver_id
+            FROM room, (SELECT driver_id FROM target LIMIT 1) t
+            ORDER BY room.day, room.driver_id = t.driver_id DESC,
+                     room.room DESC NULLS FIRST, room.stops, room.driver_id
+        ),
+        removed AS (
+            DELETE FROM assignments a
+            USING open_assignments o
+            WHERE a.assignment_id = o.assignment_id
+              AND o.assign_date NOT IN (SELECT day FROM days)
+            RETURNING a.assignment_id
+        ),
+        moved AS (
+            UPDATE assignments a
+            SET driver_id = t.driver_id
+            FROM open_assignments o, (SELECT driver_id FROM target LIMIT 1) t
+            WHERE %(relocate)s
+              AND a.assignment_id = o.assignment_id
+              AND o.assign_date IN (SELECT day FROM days)
+              AND o.driver_id <> t.driver_id
+              AND EXISTS (SELECT 1 FROM room r WHERE r.day = o.assign_date AND r.driver_id = t.driver_id)
+            RETURNING a.assignment_id
+        ),
+        missing AS (
+            SELECT days.day
+            FROM days
+            WHERE NOT EXISTS (
+                SELECT 1 FROM assignments a
+                WHERE a.customer_id = %(customer_id)s AND a.assign_date = days.day
+            )
+        ),
+        added AS (
+            INSERT INTO assignments (assign_date, customer_id, driver_id)
+            SELECT missing.day, %(customer_id)s, p.driver_id
+            FROM missing
+            JOIN placement p USING (day)
+            RETURNING assignment_id
+        )
+        SELECT (SELECT COUNT(*) FROM added)   AS added,
+               (SELECT COUNT(*) FROM moved)   AS moved,
+               (SELECT COUNT(*) FROM removed) AS removed,
+               (SELECT COUNT(*) FROM missing) - (SELECT COUNT(*) FROM added) AS unplaced,
+               (SELECT driver_id FROM target LIMIT 1) AS driver_id;
+    """, {"customer_id": customer_id, "today": today, "relocate": relocate})
+    return dict(cur.fetchone())
+
+@retry_transient()
+def assign_customer_incrementally(customer_id, relocate=False):
+    """Standalone version of the per-customer placement done on add/renew/edit."""
+    from datetime import date
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            result = _assign_customer(cur, customer_id, date.today(), relocate=relocate)
+        conn.commit()
+    return result
+
+# -------------------------------
+# AUTO ASSIGNMENT (CAPACITY-AWARE, SEE solver.py)
 # -------------------------------
+@retry_transient()
 def auto_create_assignments_for_today():
     """
-    Automatically assigns customers to drivers based on LOCATION
-    using a round‑robin approach across available drivers.
-    Does NOT overwrite any existing assignment for today.
+    Automatically assigns today's unassigned active customers to drivers
+    based on LOCATION, keeping each location on its mapped driver where
+    capacity (bowls) and shift length allow; see solver.solve. A driver
+    without a capacity or shift length, or a location without a service
+    time, imposes no limit. Does NOT overwrite any existing assignment for today.
+
+    Returns the solver report: added, drivers (utilization), overflow
+    (customers left unassigned, per location) and split locations.
     """
+    from datetime import date
+    from solver import solve
+    today = date.today()
+
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Grouped on location_id; customers without a location are
+            # groups of one, so the solver can spread them.
+            cur.execute("""
+                SELECT c.location_id,
+                       COALESCE(MIN(l.name), 'No location #' || MIN(c.customer_id)) AS location,
+                       ARRAY_AGG(c.customer_id ORDER BY c.customer_id) AS customer_ids,
+                       COALESCE(MIN(l.service_minutes), 0)::float AS service_minutes,
+                       MIN(l.driver_id) AS preferred_driver_id
+                FROM customers c
+                LEFT JOIN locations l ON l.location_id = c.location_id
+                WHERE c.subscription_start <= %(today)s
+                  AND (c.subscription_start + (c.subscription_days + c.owed) * INTERVAL '1 day') >= %(today)s
+                  AND NOT EXISTS (
+                      SELECT 1 FROM assignments x
+                      WHERE x.customer_id = c.customer_id AND x.assign_date = %(today)s
+                  )
+                GROUP BY c.location_id, CASE WHEN c.location_id IS NULL THEN c.customer_id END;
+            """, {"today": today})
+            locations = cur.fetchall()
+
+            # Stops already on each driver's route today count against them.
+            cur.execute("""
+                SELECT d.driver_id, d.full_name, d.capacity, d.shift_minutes,
+                       COUNT(a.assignment_id) AS stops,
+                       COALESCE(SUM(l.service_minutes), 0)::float AS minutes
+                FROM drivers d
+                LEFT JOIN assignments a ON a.driver_id = d.driver_id AND a.assign_date = %(today)s
+                LEFT JOIN customers c ON c.customer_id = a.customer_id
+                LEFT JOIN locations l ON l.location_id = c.location_id
+                GROUP BY d.driver_id
+                ORDER BY d.full_name;
+            """, {"today": today})
+            drivers = cur.fetchall()
+
+            result = solve(locations, drivers)
+
+            if result["assignments"]:
+                customer_ids, driver_ids = zip(*result["assignments"])
+                cur.execute("""
+                    INSERT INTO assignments (assign_date, customer_id, driver_id)
+                    SELECT %s, u.customer_id, u.driver_id
+                    FROM unnest(%s::int[], %s::int[]) AS u (customer_id, driver_id);
+                """, (today, list(customer_ids), list(driver_ids)))
 
+            # Locations without a driver keep the one they got today.
+            new_routes = [(loc["location_id"], result["mapping"][loc["location"]]) for loc in locations
+                          if loc["location_id"] is not None and loc["preferred_driver_id"] is None
+                          and loc["location"] in result["mapping"]]
+            if new_routes:
+                location_ids, route_drivers = zip(*new_routes)
+                cur.execute("""
+                    UPDATE locations l
+                    SET driver_id = u.driver_id, updated_at = now()
+                    FROM unnest(%s::int[], %s::int[]) AS u (location_id, driver_id)
+                    WHERE l.location_id = u.location_id AND l.driver_id IS NULL;
+                """, (list(location_ids), list(route_drivers)))
+        conn.commit()
+
+    return {
+        "added": len(result["assignments"]),
+        "drivers": result["drivers"],
+        "overflow": result["overflow"],
+        "split": result["split"],
+    }
+
+# -------------------------------
+# SUBSCRIPTION EVENTS (SCHEDULER)
+# -------------------------------
+# subscription_events holds one row per upcoming lifecycle event, due at
+# next_event_at. A trigger on customers keeps the expiry events in step with
+# subscription_start / subscription_days / owed (so a missed delivery that
+# extends the window moves them too); pausing a day queues a pause_resume.
+# Workers (`python jobs.py scheduler --loop`) claim due rows with
+# FOR UPDATE SKIP LOCKED, so any number can run side by side.
+#
+#   expiry_notice  day before the last delivery day: recorded in
+#                  expiry_notices, which the Renew screen lists
+#   expiry         day after the last delivery day: open future stops removed
+#   pause_resume   day after a paused day: checks the customer is still
+#                  placed on today's and the planned routes (pausing only
+#                  marks the one day, so existing stops keep their driver)
+#
+# Processed events are deleted after EVENT_RETENTION_DAYS.
+SCHEDULER_RETRY_DELAY = "15 minutes"
+EVENT_RETENTION_DAYS = 30
+
+def _on_expiry_notice(cur, event, today):
+    cur.execute("""
+        INSERT INTO expiry_notices (customer_id, subscription_end)
+        VALUES (%s, %s)
+        ON CONFLICT (customer_id)
+        DO UPDATE SET subscription_end = excluded.subscription_end, noticed_at = now();
+    """, (event["customer_id"], event["subscription_end"]))
+
+def _on_expiry(cur, event, today):
+    # _assign_customer drops undelivered assignments on inactive days.
+    return _assign_customer(cur, event["customer_id"], today)
+
+def _on_pause_resume(cur, event, today):
+    # Only fills in missing days; manual reassignments are kept.
+    return _assign_customer(cur, event["customer_id"], today)
+
+EVENT_HANDLERS = {
+    "expiry_notice": _on_expiry_notice,
+    "expiry": _on_expiry,
+    "pause_resume": _on_pause_resume,
+}
+
+def run_due_events(batch_size=100, customer_ids=None):
+    """
+    Claim up to `batch_size` due events (optionally only for `customer_ids`),
+    run their handlers and mark them processed, all in one transaction. Each event runs under a savepoint: a
+    failing handler is rolled back, counted in attempts and retried after
+    SCHEDULER_RETRY_DELAY without blocking the rest of the batch.
+
+    Returns {"processed": n, "failed": n}.
+    """
     from datetime import date
     today = date.today()
+    processed = failed = 0
+
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT event_id, customer_id, event_type, next_event_at, subscription_end
+                FROM subscription_events
+                WHERE processed_at IS NULL AND next_event_at <= now()
+                  AND (%s::int[] IS NULL OR customer_id = ANY(%s::int[]))
+                ORDER BY next_event_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED;
+            """, (customer_ids, customer_ids, batch_size))
+            for event in cur.fetchall():
+                cur.execute("SAVEPOINT event;")
+                try:
+                    EVENT_HANDLERS[event["event_type"]](cur, event, today)
+                    cur.execute("""
+                        UPDATE subscription_events
+                        SET processed_at = now(), attempts = attempts + 1, last_error = NULL
+                        WHERE event_id = %s;
+                    """, (event["event_id"],))
+                    cur.execute("RELEASE SAVEPOINT event;")
+                    processed += 1
+                except Exception as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT event;")
+                    cur.execute("""
+                        UPDATE subscription_events
+                        SET attempts = attempts + 1, last_error = %s,
+                            next_event_at = now() + %s::interval
+                        WHERE event_id = %s;
+                    """, (f"{type(e).__name__}: {e}", SCHEDULER_RETRY_DELAY, event["event_id"]))
+                    failed += 1
+        conn.commit()
+    return {"processed": processed, "failed": failed}
+
+def purge_processed_events(retention_days=EVENT_RETENTION_DAYS):
+    """Delete events processed more than `retention_days` ago; returns the number deleted."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM subscription_events
+                WHERE processed_at < now() - make_interval(days => %s);
+            """, (retention_days,))
+            deleted = cur.rowcount
+        conn.commit()
+    return deleted
+
+def run_scheduler(batch_size=100, interval=30, once=False, retention_days=EVENT_RETENTION_DAYS):
+    """
+    Process due events batch after batch; when none are due, sleep
+    `interval` seconds (or return, with once=True). Old processed events are
+    purged whenever the queue runs dry, at most once an hour. Returns the
+    totals.
+    """
+    totals = {"processed": 0, "failed": 0, "purged": 0}
+    purged_at = None
+    while True:
+        result = run_due_events(batch_size)
+        for key in result:
+            totals[key] += result[key]
+        if result["processed"] + result["failed"] < batch_size:
+            if purged_at is None or time.monotonic() - purged_at >= 3600:
+                totals["purged"] += purge_processed_events(retention_days)
+                purged_at = time.monotonic()
+            if once:
+                return totals
+            time.sleep(interval)
+
+def list_expiring_customers():
+    """Customers flagged by an expiry_notice whose subscription still ends as noticed."""
+    return fetch_all("""
+        SELECT c.customer_id, c.full_name, c.phone_number, c.location,
+               n.subscription_end, n.noticed_at AS flagged_at
+        FROM expiry_notices n
+        JOIN customers c ON c.customer_id = n.customer_id
+        WHERE n.subscription_end >= CURRENT_DATE
+          AND n.subscription_end = c.subscription_start + c.subscription_days + c.owed
+        ORDER BY n.subscription_end, c.full_name;
+    """)
+
+def scheduler_backlog():
+    """Pending / overdue / failing event counts per type, for monitoring."""
+    return fetch_all("""
+        SELECT event_type,
+               COUNT(*) AS pending,
+               COUNT(*) FILTER (WHERE next_event_at <= now()) AS due,
+               COUNT(*) FILTER (WHERE last_error IS NOT NULL) AS failing,
+               MIN(next_event_at) AS next_due
+        FROM subscription_events
+        WHERE processed_at IS NULL
+        GROUP BY event_type
+        ORDER BY event_type;
+    """)
+
+# -------------------------------
+# INCREMENTAL EXPORT
+# -------------------------------
+# customers, assignments and deliveries carry change_id: the id of the
+# transaction that last wrote the row (column default on insert, trigger on
+# update). Deleted rows leave their key in export_tombstones. Each consumer
+# keeps a watermark per table in export_watermarks. An export takes the rows
+# with watermark <= change_id < the oldest transaction still running, so a
+# row written by a transaction that commits later is picked up by the next
+# run instead of being skipped.
+EXPORT_TABLES = {
+    "customers": ["customer_id"],
+    "assignments": ["assignment_id"],
+    "deliveries": ["assignment_id", "delivery_date"],
+}
+EXPORT_FORMATS = ("csv", "parquet")
+
+def _write_export(cur, query, path, fmt):
+    """Write a query's rows to path; returns the row count (no file if 0)."""
+    import os
+
+    if fmt == "csv":
+        with open(path, "w", newline="") as f:
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        count = cur.rowcount
+        if not count:
+            os.remove(path)
+        return count
+
+    df = fetch_df(query)
+    if len(df):
+        df.to_parquet(path, index=False)
+    return len(df)
+
+def export_changes(consumer, table, out_dir, fmt="csv"):
+    """
+    Write the rows of `table` inserted or changed since `consumer`'s last
+    export, and the keys of rows deleted since then, to out_dir as
+    <table>_<from>_<to>.<fmt> and <table>_deleted_<from>_<to>.<fmt>, then
+    advance the watermark. The first export of a table has every row and no
+    deletions. Exports for the same consumer and table run one at a time.
+
+    Returns {"table", "from", "to", "rows", "deleted", "files"}.
+    """
+    import os
+    from psycopg2 import sql
+
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    keys = EXPORT_TABLES[table]
+    os.makedirs(out_dir, exist_ok=True)
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO export_watermarks (consumer, table_name)
+                VALUES (%s, %s)
+                ON CONFLICT DO NOTHING;
+            """, (consumer, table))
+            cur.execute("""
+                SELECT watermark FROM export_watermarks
+                WHERE consumer = %s AND table_name = %s
+                FOR UPDATE;
+            """, (consumer, table))
+            low = cur.fetchone()[0]
+            # Every transaction below this id has finished.
+            cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint;")
+            high = cur.fetchone()[0]
+
+            if low is None:
+                where = sql.SQL("change_id < {high} OR change_id IS NULL")
+            else:
+                where = sql.SQL("change_id >= {low} AND change_id < {high}")
+            where = where.format(low=sql.Literal(low), high=sql.Literal(high))
+
+            changed = sql.SQL("SELECT * FROM {table} WHERE {where} ORDER BY {keys}").format(
+                table=sql.Identifier(table), where=where,
+                keys=sql.SQL(", ").join(map(sql.Identifier, keys)),
+            ).as_string(conn)
+            name = f"{table}_{low or 0}_{high}.{fmt}"
+            rows = _write_export(cur, changed, os.path.join(out_dir, name), fmt)
+            files = [name] if rows else []
+
+            deleted = 0
+            if low is not None:
+                removed = sql.SQL("""
+                    SELECT {keys}, t.deleted_at
+                    FROM export_tombstones t
+                    CROSS JOIN LATERAL jsonb_populate_record(NULL::{table}, t.row_key) AS k
+                    WHERE t.table_name = {name}
+                      AND t.change_id >= {low} AND t.change_id < {high}
+                    ORDER BY t.change_id
+                """).format(
+                    keys=sql.SQL(", ").join(sql.SQL("k.") + sql.Identifier(k) for k in keys),
+                    table=sql.Identifier(table), name=sql.Literal(table),
+                    low=sql.Literal(low), high=sql.Literal(high),
+                ).as_string(conn)
+                name = f"{table}_deleted_{low}_{high}.{fmt}"
+                deleted = _write_export(cur, removed, os.path.join(out_dir, name), fmt)
+                if deleted:
+                    files.append(name)
+
+            cur.execute("""
+                UPDATE export_watermarks
+                SET watermark = %s, exported_at = now(), last_rows = %s, last_deleted = %s
+                WHERE consumer = %s AND table_name = %s;
+            """, (high, rows, deleted, consumer, table))
+            # Tombstones every consumer has exported are no longer needed.
+            cur.execute("""
+                DELETE FROM export_tombstones
+                WHERE table_name = %s
+                  AND change_id < (SELECT MIN(watermark) FROM export_watermarks WHERE table_name = %s);
+            """, (table, table))
+        conn.commit()
+
+    return {"table": table, "from": low, "to": high, "rows": rows, "deleted": deleted, "files": files}
+
+def list_export_watermarks():
+    return fetch_all("""
+        SELECT consumer, table_name, watermark, exported_at, last_rows, last_deleted
+        FROM export_watermarks
+        ORDER BY consumer, table_name;
+    """)
+
+# -------------------------------
+# CLOSED DAYS
+# -------------------------------
+# Closing a past day, once every stop on it is marked, freezes its
+# assignments and deliveries: statement triggers reject any write that
+# touches a closed date. closed_days keeps a hash of the day's rows, and
+# reports over closed days are served from report_cache.py's Parquet files
+# keyed by that hash, so only open days are queried.
+#
+# Deleting a customer or driver who appears on closed days is refused unless
+# the admin confirms reopening them (the nightly `python jobs.py close-days`
+# closes them again); archiving a month drops its closed days along with
+# the rows.
+@retry_transient()
+def close_day(day, closed_by=None):
+    """
+    Close one past day. Raises ValueError for today or later, or while any
+    stop on the day is still unmarked. Returns a dict with day, stops and
+    content_hash.
+    """
+    from datetime import date
+
+    if day >= date.today():
+        raise ValueError(f"Only past days can be closed, not {day}.")
+
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Waits for in-flight writes and holds off new ones while the
+            # day is hashed (a few milliseconds).
+            cur.execute("LOCK TABLE assignments, deliveries IN SHARE MODE;")
+            cur.execute("""
+                SELECT COUNT(a.assignment_id)::int AS stops,
+                       COUNT(a.assignment_id) FILTER (WHERE del.status IS NULL)::int AS unmarked,
+                       md5(%(day)s::text || COALESCE(string_agg(
+                           concat_ws('|', a.assignment_id, a.customer_id, a.driver_id,
+                                     del.status, del.marked_at, del.marked_by),
+                           ',' ORDER BY a.assignment_id), '')) AS content_hash
+                FROM assignments a
+                LEFT JOIN deliveries del
+                       ON del.assignment_id = a.assignment_id
+                      AND del.delivery_date = a.assign_date
+                      AND del.delivery_date = %(day)s
+                WHERE a.assign_date = %(day)s;
+            """, {"day": day})
+            row = cur.fetchone()
+            if row["unmarked"]:
+                raise ValueError(f"{day} still has {row['unmarked']} unmarked stops.")
+            cur.execute("""
+                INSERT INTO closed_days (day, stops, content_hash, closed_by)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (day) DO NOTHING;
+            """, (day, row["stops"], row["content_hash"], closed_by))
+        conn.commit()
+    return {"day": day, "stops": row["stops"], "content_hash": row["content_hash"]}
+
+def close_days(through=None, closed_by=None):
+    """
+    Close every open day up to `through` (default yesterday) that has
+    assignments and no unmarked stops. Returns a dict: closed (list of
+    days) and unmarked (list of {day, unmarked} for days left open).
+    """
+    from datetime import date, timedelta
+
+    through = min(through or date.today(), date.today() - timedelta(days=1))
+    days = fetch_all("""
+        SELECT a.assign_date AS day,
+               COUNT(*) FILTER (WHERE del.status IS NULL)::int AS unmarked
+        FROM assignments a
+        LEFT JOIN deliveries del
+               ON del.assignment_id = a.assignment_id
+              AND del.delivery_date = a.assign_date
+        WHERE a.assign_date <= %s
+          AND NOT EXISTS (SELECT 1 FROM closed_days c WHERE c.day = a.assign_date)
+        GROUP BY a.assign_date
+        ORDER BY a.assign_date;
+    """, (through,))
+
+    closed, unmarked = [], []
+    for d in days:
+        if d["unmarked"]:
+            unmarked.append(dict(d))
+            continue
+        try:
+            close_day(d["day"], closed_by=closed_by)
+            closed.append(d["day"])
+        except ValueError:
+            # A stop was added or unmarked since the scan; left for the next run.
+            unmarked.append({"day": d["day"], "unmarked": None})
+    return {"closed": closed, "unmarked": unmarked}
+
+_CLOSED_DAYS_OF_SQL = """
+    SELECT day FROM closed_days
+    WHERE day IN (SELECT assign_date FROM assignments WHERE {column} = %s)
+    ORDER BY day
+"""
+
+def closed_days_of(column, value):
+    """Closed days with assignments for a customer (column "customer_id") or driver ("driver_id")."""
+    if column not in ("customer_id", "driver_id"):
+        raise ValueError(f"Unknown column: {column}")
+    return [r["day"] for r in fetch_all(_CLOSED_DAYS_OF_SQL.format(column=column) + ";", (value,))]
+
+def _reopen_days_of(cur, column, value, reopen):
+    """
+    For a customer or driver about to be deleted, on the caller's
+    transaction: raise ValueError if they appear on closed days, or with
+    reopen=True reopen those days (they stay closed if the delete fails).
+    """
+    cur.execute(_CLOSED_DAYS_OF_SQL.format(column=column) + " FOR UPDATE;", (value,))
+    days = [row[0] for row in cur.fetchall()]
+    if not days:
+        return
+    if not reopen:
+        raise ValueError(f"Appears on {len(days)} closed days ({days[0]} to {days[-1]}); "
+                         "deleting would reopen them and change their reports.")
+    cur.execute("DELETE FROM closed_days WHERE day = ANY(%s);", (days,))
+
+@retry_transient()
+def reopen_day(day):
+    """Reopen a closed day for corrections; returns False if it was not closed."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM closed_days WHERE day = %s;", (day,))
+            reopened = cur.rowcount > 0
+        conn.commit()
+    return reopened
+
+def list_closed_days(limit=60):
+    return fetch_all("""
+        SELECT day, stops, closed_at, closed_by
+        FROM closed_days
+        ORDER BY day DESC
+        LIMIT %s;
+    """, (limit,))
+
+def closed_day_hashes(from_date, to_date):
+    """{day: content_hash} for the closed days in a date range."""
+    rows = fetch_all("""
+        SELECT day, content_hash
+        FROM closed_days
+        WHERE day BETWEEN %s AND %s;
+    """, (from_date, to_date))
+    return {r["day"]: r["content_hash"] for r in rows}
+
+# -------------------------------
+# SCHEMA MAINTENANCE
+# -------------------------------
+# Idempotent DDL applied at app start (see bootstrap_schema) and by
+# `python jobs.py migrate`. Every statement must be safe to re-run.
+SCHEMA_DDL = [
+    """
+    CREATE INDEX IF NOT EXISTS assignments_assign_date_idx
+        ON assignments (assign_date, driver_id);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS owed_ledger (
+        entry_id      BIGSERIAL PRIMARY KEY,
+        customer_id   INTEGER NOT NULL REFERENCES customers (customer_id) ON DELETE CASCADE,
+        assignment_id INTEGER,
+        delivery_date DATE,
+        old_status    TEXT,
+        new_status    TEXT,
+        delta         INTEGER NOT NULL,
+        reason        TEXT NOT NULL,
+        created_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS customers_phone_number_idx
+        ON customers (phone_number);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS owed_ledger_customer_idx
+        ON owed_ledger (customer_id);
+    """,
+    # Renewal rows record the end of the subscription they renewed, so
+    # renewal_rate() can match renewals to the subscriptions that ended.
+    """
+    ALTER TABLE owed_ledger ADD COLUMN IF NOT EXISTS subscription_end DATE;
+    """,
+    # The owed rule: how much a stop's status change moves owed (see
+    # _record_owed_transition). Only 'missed' counts.
+    """
+    CREATE OR REPLACE FUNCTION owed_delta(old_status TEXT, new_status TEXT) RETURNS INTEGER AS $$
+        SELECT (new_status IS NOT DISTINCT FROM 'missed')::int
+             - (old_status IS NOT DISTINCT FROM 'missed')::int;
+    $$ LANGUAGE sql IMMUTABLE;
+    """,
+    # Locations dimension (see the LOCATIONS section).
+    """
+    CREATE TABLE IF NOT EXISTS locations (
+        location_id     SERIAL PRIMARY KEY,
+        name            TEXT NOT NULL UNIQUE,
+        driver_id       INTEGER REFERENCES drivers (driver_id) ON DELETE SET NULL,
+        service_minutes NUMERIC(6, 2),
+        updated_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS location_aliases (
+        alias       TEXT PRIMARY KEY,
+        location_id INTEGER NOT NULL REFERENCES locations (location_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    ALTER TABLE customers
+        ADD COLUMN IF NOT EXISTS location_id INTEGER REFERENCES locations (location_id) ON DELETE SET NULL;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS customers_location_id_idx ON customers (location_id);
+    """,
+    """
+    CREATE OR REPLACE FUNCTION location_key(raw TEXT) RETURNS TEXT AS $$
+        SELECT NULLIF(btrim(regexp_replace(lower(raw), '[^[:alnum:]]+', ' ', 'g')), '');
+    $$ LANGUAGE sql IMMUTABLE;
+    """,
+    # A new spelling becomes a new location, named as typed.
+    """
+    CREATE OR REPLACE FUNCTION resolve_location(raw TEXT) RETURNS INTEGER AS $$
+    DECLARE
+        key TEXT := location_key(raw);
+        found INTEGER;
+    BEGIN
+        IF key IS NULL THEN
+            RETURN NULL;
+        END IF;
+        SELECT location_id INTO found FROM location_aliases WHERE alias = key;
+        IF found IS NULL THEN
+            INSERT INTO locations (name) VALUES (btrim(raw))
+            ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+            RETURNING location_id INTO found;
+            INSERT INTO location_aliases (alias, location_id) VALUES (key, found)
+            ON CONFLICT (alias) DO NOTHING;
+            SELECT location_id INTO found FROM location_aliases WHERE alias = key;
+        END IF;
+        RETURN found;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION set_customer_location_id() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' OR NEW.location IS DISTINCT FROM OLD.location THEN
+            NEW.location_id := resolve_location(NEW.location);
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'customers_location_id') THEN
+            CREATE TRIGGER customers_location_id
+                BEFORE INSERT OR UPDATE OF location ON customers
+                FOR EACH ROW EXECUTE FUNCTION set_customer_location_id();
+        END IF;
+    END $$;
+    """,
+    # Capacity, shift length and service time are NULL (no limit) until the
+    # admin sets them.
+    """
+    ALTER TABLE drivers
+        ADD COLUMN IF NOT EXISTS capacity INTEGER,
+        ADD COLUMN IF NOT EXISTS shift_minutes INTEGER;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS assignments_customer_date_idx
+        ON assignments (customer_id, assign_date);
+    """,
+    # Existing rows keep NULL (time unknown); new rows default to now().
+    """
+    ALTER TABLE deliveries ADD COLUMN IF NOT EXISTS marked_at TIMESTAMPTZ;
+    """,
+    """
+    ALTER TABLE deliveries ALTER COLUMN marked_at SET DEFAULT now();
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS subscription_events (
+        event_id         BIGSERIAL PRIMARY KEY,
+        customer_id      INTEGER NOT NULL REFERENCES customers (customer_id) ON DELETE CASCADE,
+        event_type       TEXT NOT NULL,
+        next_event_at    TIMESTAMPTZ NOT NULL,
+        subscription_end DATE,
+        attempts         INTEGER NOT NULL DEFAULT 0,
+        last_error       TEXT,
+        processed_at     TIMESTAMPTZ,
+        created_at       TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    # Workers only ever scan pending rows in due order.
+    """
+    CREATE INDEX IF NOT EXISTS subscription_events_due_idx
+        ON subscription_events (next_event_at)
+        WHERE processed_at IS NULL;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS subscription_events_processed_idx
+        ON subscription_events (processed_at)
+        WHERE processed_at IS NOT NULL;
+    """,
+    # The latest expiry notice per customer, kept after its event is purged.
+    """
+    CREATE TABLE IF NOT EXISTS expiry_notices (
+        customer_id      INTEGER PRIMARY KEY REFERENCES customers (customer_id) ON DELETE CASCADE,
+        subscription_end DATE NOT NULL,
+        noticed_at       TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS subscription_events_pending_uniq
+        ON subscription_events (customer_id, event_type, next_event_at)
+        WHERE processed_at IS NULL;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION schedule_subscription_events() RETURNS trigger AS $$
+    DECLARE
+        last_day DATE := NEW.subscription_start + NEW.subscription_days + NEW.owed;
+    BEGIN
+        IF TG_OP = 'UPDATE'
+           AND NEW.subscription_start IS NOT DISTINCT FROM OLD.subscription_start
+           AND NEW.subscription_days IS NOT DISTINCT FROM OLD.subscription_days
+           AND NEW.owed IS NOT DISTINCT FROM OLD.owed THEN
+            RETURN NEW;
+        END IF;
 
-    # 1️⃣ Fetch all drivers
-    drivers = list_drivers()
-    if not drivers:
-        return  # No drivers, nothing to do
+        DELETE FROM subscription_events
+        WHERE customer_id = NEW.customer_id
+          AND processed_at IS NULL
+          AND event_type IN ('expiry_notice', 'expiry');
 
-    driver_ids = [d["driver_id"] for d in drivers]
-    driver_count = len(driver_ids)
+        INSERT INTO subscription_events (customer_id, event_type, next_event_at, subscription_end)
+        SELECT NEW.customer_id, t.event_type, t.due::timestamptz, last_day
+        FROM (VALUES ('expiry_notice', last_day - 1), ('expiry', last_day + 1)) AS t (event_type, due)
+        WHERE last_day IS NOT NULL AND t.due >= CURRENT_DATE
+        ON CONFLICT DO NOTHING;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'customers_schedule_events') THEN
+            CREATE TRIGGER customers_schedule_events
+                AFTER INSERT OR UPDATE OF subscription_start, subscription_days, owed ON customers
+                FOR EACH ROW EXECUTE FUNCTION schedule_subscription_events();
+        END IF;
+    END $$;
+    """,
+    # Schedule customers that existed before the trigger, once.
+    """
+    INSERT INTO subscription_events (customer_id, event_type, next_event_at, subscription_end)
+    SELECT c.customer_id, t.event_type, t.due::timestamptz, c.last_day
+    FROM (SELECT customer_id, subscription_start + subscription_days + owed AS last_day
+          FROM customers) c
+    CROSS JOIN LATERAL (VALUES ('expiry_notice', c.last_day - 1),
+                               ('expiry', c.last_day + 1)) AS t (event_type, due)
+    WHERE c.last_day IS NOT NULL AND t.due >= CURRENT_DATE
+      AND NOT EXISTS (SELECT 1 FROM subscription_events)
+    ON CONFLICT DO NOTHING;
+    """,
+    # Change notifications for changes.py: one NOTIFY per committed statement
+    # and (date, driver) group, delivered to every listening process.
+    """
+    CREATE OR REPLACE FUNCTION publish_change(tbl TEXT, op TEXT, body JSONB) RETURNS void AS $$
+    DECLARE
+        msg TEXT := (body || jsonb_build_object('table', tbl, 'op', op))::text;
+    BEGIN
+        -- Payloads must stay under 8000 bytes; without details listeners reload.
+        IF octet_length(msg) > 7900 THEN
+            msg := (body - 'rows' - 'ids' || jsonb_build_object('table', tbl, 'op', op))::text;
+        END IF;
+        PERFORM pg_notify('smart_delivery_changes', msg);
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_route_changes() RETURNS trigger AS $$
+    DECLARE
+        g RECORD;
+    BEGIN
+        IF TG_TABLE_NAME = 'deliveries' AND TG_OP <> 'DELETE' THEN
+            FOR g IN
+                SELECT d.delivery_date AS day, a.driver_id,
+                       jsonb_agg(jsonb_build_object('assignment_id', d.assignment_id,
+                                                    'status', d.status,
+                                                    'marked_at', extract(epoch FROM d.marked_at))) AS rows
+                FROM new_rows d
+                LEFT JOIN assignments a ON a.assignment_id = d.assignment_id
+                GROUP BY 1, 2
+            LOOP
+                PERFORM publish_change(TG_TABLE_NAME, TG_OP, jsonb_build_object(
+                    'date', g.day, 'driver_id', g.driver_id, 'rows', g.rows));
+            END LOOP;
+        ELSIF TG_TABLE_NAME = 'deliveries' THEN
+            FOR g IN
+                SELECT d.delivery_date AS day, a.driver_id
+                FROM old_rows d
+                LEFT JOIN assignments a ON a.assignment_id = d.assignment_id
+                GROUP BY 1, 2
+            LOOP
+                PERFORM publish_change(TG_TABLE_NAME, TG_OP, jsonb_build_object(
+                    'date', g.day, 'driver_id', g.driver_id));
+            END LOOP;
+        ELSE
+            IF TG_OP <> 'DELETE' THEN
+                FOR g IN SELECT assign_date AS day, driver_id FROM new_rows GROUP BY 1, 2 LOOP
+                    PERFORM publish_change(TG_TABLE_NAME, TG_OP, jsonb_build_object(
+                        'date', g.day, 'driver_id', g.driver_id));
+                END LOOP;
+            END IF;
+            IF TG_OP <> 'INSERT' THEN
+                FOR g IN SELECT assign_date AS day, driver_id FROM old_rows GROUP BY 1, 2 LOOP
+                    PERFORM publish_change(TG_TABLE_NAME, TG_OP, jsonb_build_object(
+                        'date', g.day, 'driver_id', g.driver_id));
+                END LOOP;
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    # Arguments: id column, and optionally a column whose changes alone are
+    # flagged "minor" (customers.owed follows every missed delivery).
+    """
+    CREATE OR REPLACE FUNCTION notify_row_changes() RETURNS trigger AS $$
+    DECLARE
+        id_col TEXT := TG_ARGV[0];
+        minor_col TEXT := COALESCE(TG_ARGV[1], '');
+        ids JSONB;
+        minor BOOLEAN := false;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            SELECT jsonb_agg(to_jsonb(n) -> id_col) INTO ids FROM new_rows n;
+        ELSIF TG_OP = 'DELETE' THEN
+            SELECT jsonb_agg(to_jsonb(o) -> id_col) INTO ids FROM old_rows o;
+        ELSE
+            -- change_id is export bookkeeping, not a change of its own.
+            SELECT jsonb_agg(to_jsonb(n) -> id_col),
+                   bool_and(to_jsonb(n) - minor_col - 'change_id' = to_jsonb(o) - minor_col - 'change_id')
+            INTO ids, minor
+            FROM new_rows n
+            JOIN old_rows o ON to_jsonb(o) -> id_col = to_jsonb(n) -> id_col
+            WHERE to_jsonb(n) - 'change_id' <> to_jsonb(o) - 'change_id';
+        END IF;
+        IF ids IS NOT NULL THEN
+            PERFORM publish_change(TG_TABLE_NAME, TG_OP, jsonb_build_object(
+                'ids', ids, 'minor', COALESCE(minor, false)));
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    # Statement triggers with transition tables: bulk writes send a handful of
+    # notifications, not one per row. Re-created after deliveries is
+    # partitioned (the old table takes its triggers with it).
+    """
+    DO $$
+    DECLARE
+        t RECORD;
+        op TEXT;
+    BEGIN
+        FOR t IN SELECT * FROM (VALUES
+            ('customers', 'notify_row_changes(''customer_id'', ''owed'')'),
+            ('drivers', 'notify_row_changes(''driver_id'')'),
+            ('locations', 'notify_row_changes(''location_id'')'),
+            ('assignments', 'notify_route_changes()'),
+            ('deliveries', 'notify_route_changes()')) AS v (tbl, fn)
+        LOOP
+            FOREACH op IN ARRAY ARRAY['insert', 'update', 'delete'] LOOP
+                IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                               WHERE tgrelid = t.tbl::regclass AND tgname = t.tbl || '_notify_' || op) THEN
+                    EXECUTE format(
+                        'CREATE TRIGGER %I AFTER %s ON %I REFERENCING %s FOR EACH STATEMENT EXECUTE FUNCTION %s',
+                        t.tbl || '_notify_' || op, op, t.tbl,
+                        CASE op WHEN 'insert' THEN 'NEW TABLE AS new_rows'
+                                WHEN 'delete' THEN 'OLD TABLE AS old_rows'
+                                ELSE 'NEW TABLE AS new_rows OLD TABLE AS old_rows' END,
+                        t.fn);
+                END IF;
+            END LOOP;
+        END LOOP;
+    END $$;
+    """,
+    # Incremental export (see export_changes).
+    """
+    CREATE TABLE IF NOT EXISTS export_watermarks (
+        consumer     TEXT NOT NULL,
+        table_name   TEXT NOT NULL,
+        watermark    BIGINT,
+        exported_at  TIMESTAMPTZ,
+        last_rows    INTEGER,
+        last_deleted INTEGER,
+        PRIMARY KEY (consumer, table_name)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS export_tombstones (
+        table_name TEXT NOT NULL,
+        row_key    JSONB NOT NULL,
+        change_id  BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint,
+        deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS export_tombstones_change_idx
+        ON export_tombstones (table_name, change_id);
+    """,
+    """
+    CREATE OR REPLACE FUNCTION stamp_change_id() RETURNS trigger AS $$
+    BEGIN
+        IF NEW IS NOT DISTINCT FROM OLD THEN
+            RETURN NEW;
+        END IF;
+        NEW.change_id := pg_current_xact_id()::text::bigint;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    # Arguments: the table's key columns. The archive job sets
+    # smart_delivery.archiving: archived rows are summarized, not deleted.
+    """
+    CREATE OR REPLACE FUNCTION record_tombstones() RETURNS trigger AS $$
+    BEGIN
+        IF current_setting('smart_delivery.archiving', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        INSERT INTO export_tombstones (table_name, row_key)
+        SELECT TG_TABLE_NAME, (SELECT jsonb_object_agg(k, o.r -> k) FROM unnest(TG_ARGV) AS k)
+        FROM (SELECT to_jsonb(d) AS r FROM old_rows d) AS o;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    # Existing rows keep change_id NULL (no table rewrite); the first export
+    # of a table includes them.
+    """
+    DO $$
+    DECLARE
+        t RECORD;
+    BEGIN
+        FOR t IN SELECT * FROM (VALUES
+            ('customers', ARRAY['customer_id']),
+            ('assignments', ARRAY['assignment_id']),
+            ('deliveries', ARRAY['assignment_id', 'delivery_date'])) AS v (tbl, keys)
+        LOOP
+            EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS change_id BIGINT', t.tbl);
+            EXECUTE format('ALTER TABLE %I ALTER COLUMN change_id SET DEFAULT pg_current_xact_id()::text::bigint', t.tbl);
+            EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I (change_id)', t.tbl || '_change_id_idx', t.tbl);
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                           WHERE tgrelid = t.tbl::regclass AND tgname = t.tbl || '_stamp_change') THEN
+                EXECUTE format(
+                    'CREATE TRIGGER %I BEFORE UPDATE ON %I FOR EACH ROW EXECUTE FUNCTION stamp_change_id()',
+                    t.tbl || '_stamp_change', t.tbl);
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                           WHERE tgrelid = t.tbl::regclass AND tgname = t.tbl || '_tombstones') THEN
+                EXECUTE format(
+                    'CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows '
+                    'FOR EACH STATEMENT EXECUTE FUNCTION record_tombstones(%s)',
+                    t.tbl || '_tombstones', t.tbl,
+                    (SELECT string_agg(quote_literal(k), ', ') FROM unnest(t.keys) AS k));
+            END IF;
+        END LOOP;
+    END $$;
+    """,
+    # One-time move to the locations dimension: one location per normalized
+    # spelling (named after its most common form), routes seeded from the
+    # most recent ones. Near duplicates are then folded together by
+    # ensure_schema (the matching is done in Python).
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM locations) THEN
+            RETURN;
+        END IF;
 
-    # 2️⃣ Get all active customers
-    customers = fetch_all("""
-        SELECT customer_id, location
+        INSERT INTO locations (name)
+        SELECT DISTINCT ON (location_key(location)) btrim(location)
         FROM customers
-        WHERE subscription_start <= %s
-          AND (subscription_start + (subscription_days + owed) * INTERVAL '1 day') >= %s;
-    """, (today, today))
+        WHERE location_key(location) IS NOT NULL
+        GROUP BY location_key(location), btrim(location)
+        ORDER BY location_key(location), COUNT(*) DESC, btrim(location);
+
+        INSERT INTO location_aliases (alias, location_id)
+        SELECT DISTINCT location_key(c.location), l.location_id
+        FROM customers c
+        JOIN locations l ON location_key(l.name) = location_key(c.location)
+        ON CONFLICT (alias) DO NOTHING;
+
+        UPDATE customers c
+        SET location_id = a.location_id
+        FROM location_aliases a
+        WHERE a.alias = location_key(c.location);
+
+        UPDATE locations l
+        SET driver_id = recent.driver_id
+        FROM (
+            SELECT DISTINCT ON (c.location_id) c.location_id, a.driver_id
+            FROM assignments a
+            JOIN customers c ON c.customer_id = a.customer_id
+            WHERE a.assign_date >= CURRENT_DATE - 30 AND c.location_id IS NOT NULL
+            GROUP BY c.location_id, a.driver_id, a.assign_date
+            ORDER BY c.location_id, a.assign_date DESC, COUNT(*) DESC, a.driver_id
+        ) recent
+        WHERE l.location_id = recent.location_id;
+    END $$;
+    """,
+    # Archived months (see archive_old_deliveries); location_id is the
+    # customer's location when the month was archived.
+    """
+    CREATE TABLE IF NOT EXISTS delivery_summaries (
+        month       DATE    NOT NULL,
+        customer_id INTEGER NOT NULL,
+        driver_id   INTEGER NOT NULL,
+        location_id INTEGER REFERENCES locations (location_id) ON DELETE SET NULL,
+        assigned    INTEGER NOT NULL DEFAULT 0,
+        delivered   INTEGER NOT NULL DEFAULT 0,
+        missed      INTEGER NOT NULL DEFAULT 0,
+        paused      INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, customer_id, driver_id)
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS delivery_summaries_location_idx
+        ON delivery_summaries (location_id, month);
+    """,
+    # Closed days (see the CLOSED DAYS section).
+    """
+    CREATE TABLE IF NOT EXISTS closed_days (
+        day          DATE PRIMARY KEY,
+        stops        INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        closed_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+        closed_by    INTEGER
+    );
+    """,
+    # Argument: the table's date column. One trigger per operation, since a
+    # trigger with transition tables can only fire on one.
+    """
+    CREATE OR REPLACE FUNCTION guard_closed_days() RETURNS trigger AS $$
+    DECLARE
+        closed DATE;
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM closed_days) THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            EXECUTE format('SELECT MIN(c.day) FROM old_rows r JOIN closed_days c ON c.day = r.%I',
+                           TG_ARGV[0]) INTO closed;
+        END IF;
+        IF closed IS NULL AND TG_OP IN ('INSERT', 'UPDATE') THEN
+            EXECUTE format('SELECT MIN(c.day) FROM new_rows r JOIN closed_days c ON c.day = r.%I',
+                           TG_ARGV[0]) INTO closed;
+        END IF;
+        IF closed IS NOT NULL THEN
+            RAISE EXCEPTION '% is closed; reopen it to change its %.', closed, TG_TABLE_NAME
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DO $$
+    DECLARE
+        t RECORD;
+        op TEXT;
+    BEGIN
+        FOR t IN SELECT * FROM (VALUES
+            ('assignments', 'assign_date'),
+            ('deliveries', 'delivery_date')) AS v (tbl, day_col)
+        LOOP
+            FOREACH op IN ARRAY ARRAY['insert', 'update', 'delete'] LOOP
+                IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                               WHERE tgrelid = t.tbl::regclass AND tgname = t.tbl || '_closed_' || op) THEN
+                    EXECUTE format(
+                        'CREATE TRIGGER %I AFTER %s ON %I REFERENCING %s '
+                        'FOR EACH STATEMENT EXECUTE FUNCTION guard_closed_days(%L)',
+                        t.tbl || '_closed_' || op, upper(op), t.tbl,
+                        CASE op
+                            WHEN 'insert' THEN 'NEW TABLE AS new_rows'
+                            WHEN 'update' THEN 'OLD TABLE AS old_rows NEW TABLE AS new_rows'
+                            ELSE 'OLD TABLE AS old_rows'
+                        END,
+                        t.day_col);
+                END IF;
+            END LOOP;
+        END LOOP;
+    END $$;
+    """,
+    # Opening balance for customers whose owed predates the ledger.
+    """
+    INSERT INTO owed_ledger (customer_id, delta, reason)
+    SELECT c.customer_id, c.owed, 'opening_balance'
+    FROM customers c
+    WHERE c.owed <> 0
+      AND NOT EXISTS (SELECT 1 FROM owed_ledger l WHERE l.customer_id = c.customer_id);
+    """,
+]
+
+PARTITION_MONTHS_AHEAD = 3
+
+
+def _month_start(d):
+    return d.replace(day=1)
+
 
-    if not customers:
+def _partition_name(month):
+    return f"deliveries_y{month.year:04d}m{month.month:02d}"
+
+
+def deliveries_is_partitioned():
+    row = fetch_one("""
+        SELECT 1 AS partitioned
+        FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('deliveries');
+    """)
+    return bool(row)
+
+
+def ensure_schema():
+    """
+    Apply SCHEMA_DDL and make sure upcoming delivery partitions exist. When
+    this run created the locations, near-duplicate spellings are merged in
+    the same transaction.
+    """
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Same test as the one-time locations migration.
+            cur.execute("SELECT to_regclass('locations') IS NOT NULL AS found;")
+            had_locations = cur.fetchone()["found"]
+            if had_locations:
+                cur.execute("SELECT EXISTS (SELECT 1 FROM locations) AS found;")
+                had_locations = cur.fetchone()["found"]
+            for stmt in SCHEMA_DDL:
+                cur.execute(stmt)
+            if not had_locations:
+                merges = _suggest_location_merges(cur, LOCATION_MERGE_CUTOFF)
+                _merge_locations(cur, [(m["location_id"], m["into_id"]) for m in merges])
+        conn.commit()
+    ensure_delivery_partitions()
+
+
+@st.cache_resource(ttl=24 * 60 * 60)
+def bootstrap_schema():
+    """Run ensure_schema() at most once a day per Streamlit process."""
+    ensure_schema()
+    return True
+
+
+def partition_deliveries_table(months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    One-time migration: rebuild `deliveries` as a table range-partitioned
+    by month on delivery_date. Existing rows are copied into monthly
+    partitions; anything outside the created range lands in the default
+    partition. Does nothing if the table is already partitioned.
+    """
+    from datetime import date
+    from dateutil.relativedelta import relativedelta
+    from psycopg2 import sql
+
+    if deliveries_is_partitioned():
+        return False
+
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # The copy below can take longer than the app's statement timeout.
+            cur.execute("SET LOCAL statement_timeout = 0;")
+            cur.execute("LOCK TABLE deliveries IN ACCESS EXCLUSIVE MODE;")
+            cur.execute("SELECT MIN(delivery_date) AS first_day FROM deliveries;")
+            first_day = cur.fetchone()["first_day"] or date.today()
+
+            cur.execute("ALTER TABLE deliveries RENAME TO deliveries_unpartitioned;")
+            cur.execute("""
+                CREATE TABLE deliveries (
+                    LIKE deliveries_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+                ) PARTITION BY RANGE (delivery_date);
+            """)
+            # Primary/unique keys on a partitioned table must include the
+            # partition key; (assignment_id, delivery_date) already does and
+            # is what the upserts conflict on.
+            cur.execute("""
+                CREATE UNIQUE INDEX deliveries_assignment_date_key
+                    ON deliveries (assignment_id, delivery_date);
+            """)
+            cur.execute("CREATE INDEX deliveries_date_status_idx ON deliveries (delivery_date, status);")
+            cur.execute("""
+                ALTER TABLE deliveries
+                    ADD FOREIGN KEY (assignment_id) REFERENCES assignments (assignment_id);
+            """)
+
+            # Keep the delivery_id sequence alive once the old table is dropped.
+            cur.execute("SELECT pg_get_serial_sequence('deliveries_unpartitioned', 'delivery_id') AS seq;")
+            seq = cur.fetchone()["seq"]
+            if seq:
+                cur.execute(
+                    sql.SQL("ALTER SEQUENCE {} OWNED BY deliveries.delivery_id;").format(
+                        sql.SQL(seq)
+                    )
+                )
+
+            month = _month_start(first_day)
+            last = _month_start(date.today()) + relativedelta(months=months_ahead)
+            while month <= last:
+                _create_partition(cur, month)
+                month += relativedelta(months=1)
+            cur.execute("CREATE TABLE deliveries_default PARTITION OF deliveries DEFAULT;")
+
+            cur.execute("INSERT INTO deliveries SELECT * FROM deliveries_unpartitioned;")
+            cur.execute("DROP TABLE deliveries_unpartitioned;")
+        conn.commit()
+    return True
+
+
+def _create_partition(cur, month):
+    """
+    Add the partition for `month` if it is missing. Postgres refuses to
+    create a partition while the default partition holds rows for its
+    range, so those rows are moved into a new table that is then attached.
+    """
+    from dateutil.relativedelta import relativedelta
+    from psycopg2 import sql
+
+    name = _partition_name(month)
+    bounds = (month, month + relativedelta(months=1))
+    # Called with both plain and RealDictCursor cursors.
+    def one():
+        row = cur.fetchone()
+        return list(row.values()) if isinstance(row, dict) else list(row)
+
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL, to_regclass('deliveries_default') IS NOT NULL;",
+                (name,))
+    exists, has_default = one()
+    if exists:
+        return
+
+    stray = False
+    if has_default:
+        # Blocks new writes until the month is attached.
+        cur.execute("LOCK TABLE deliveries IN SHARE ROW EXCLUSIVE MODE;")
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM deliveries_default
+                WHERE delivery_date >= %s AND delivery_date < %s
+            );
+        """, bounds)
+        stray = one()[0]
+
+    if not stray:
+        cur.execute(
+            sql.SQL("CREATE TABLE {} PARTITION OF deliveries FOR VALUES FROM (%s) TO (%s);")
+            .format(sql.Identifier(name)),
+            bounds
+        )
+        return
+
+    cur.execute(
+        sql.SQL("""
+            CREATE TABLE {name} (LIKE deliveries INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+            WITH moved AS (
+                DELETE FROM deliveries_default
+                WHERE delivery_date >= %(start)s AND delivery_date < %(end)s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved;
+            ALTER TABLE deliveries ATTACH PARTITION {name} FOR VALUES FROM (%(start)s) TO (%(end)s);
+        """).format(name=sql.Identifier(name)),
+        {"start": bounds[0], "end": bounds[1]}
+    )
+
+
+def ensure_delivery_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Create monthly partitions from the current month up to `months_ahead`."""
+    from datetime import date
+    from dateutil.relativedelta import relativedelta
+
+    if not deliveries_is_partitioned():
         return
 
-    # 3️⃣ Group customers by location
-    grouped = {}
-    for c in customers:
-        loc = c["location"] or "UNKNOWN"
-        grouped.setdefault(loc, []).append(c["customer_id"])
-
-    # 4️⃣ Assign each location to a driver (round‑robin)
-    location_map = {}
-    index = 0
-    for loc in sorted(grouped.keys()):
-        location_map[loc] = driver_ids[index % driver_count]
-        index += 1
-
-    # 5️⃣ Create assignments only if not already assigned today
-    for loc, cust_list in grouped.items():
-        assigned_driver = location_map[loc]
-
-        for cid in cust_list:
-            exists = fetch_one("""
-                SELECT assignment_id
-                FROM assignments
-                WHERE customer_id = %s AND assign_date = %s
-                LIMIT 1;
-            """, (cid, today))
-
-            if exists:
-                continue  # Skip already assigned customers
-
-            execute("""
-                INSERT INTO assignments (assign_date, customer_id, driver_id)
-                VALUES (%s, %s, %s);
-            """, (today, cid, assigned_driver))
\ No newline at end of file
+    month = _month_start(date.today())
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            for _ in range(months_ahead + 1):
+                _create_partition(cur, month)
+                month += relativedelta(months=1)
+        conn.commit()
+
+
+def archive_old_deliveries(retention_months=12):
+    """
+    Compact every month older than `retention_months` into
+    delivery_summaries (one row per month, customer and driver, with the
+    customer's location_id), then drop
+    that month's delivery partition and its assignments. Stops on or after
+    their customer's current subscription_start are kept (and the partition
+    with them) until the customer renews, since they still count toward
+    owed.
+
+    Returns the list of archived months.
+    """
+    from datetime import date
+    from dateutil.relativedelta import relativedelta
+    from psycopg2 import sql
+
+    cutoff = _month_start(date.today()) - relativedelta(months=retention_months)
+
+    row = fetch_one("""
+        SELECT LEAST(
+            (SELECT MIN(assign_date) FROM assignments),
+            (SELECT MIN(delivery_date) FROM deliveries)
+        ) AS first_day;
+    """)
+    if not row or row["first_day"] is None:
+        return []
+
+    partitioned = deliveries_is_partitioned()
+    archived = []
+    month = _month_start(row["first_day"])
+    while month < cutoff:
+        month_end = month + relativedelta(months=1)
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL statement_timeout = 0;")
+                # Archived rows are summarized, not deleted: no export tombstones.
+                cur.execute("SET LOCAL smart_delivery.archiving = 'on';")
+                cur.execute("""
+                    DELETE FROM closed_days WHERE day >= %s AND day < %s;
+                """, (month, month_end))
+                # Stops inside a customer's current subscription stay:
+                # reconcile_owed counts their misses.
+                cur.execute("""
+                    CREATE TEMP TABLE archiving ON COMMIT DROP AS
+                    SELECT a.assignment_id
+                    FROM assignments a
+                    LEFT JOIN customers c ON c.customer_id = a.customer_id
+                    WHERE a.assign_date >= %s AND a.assign_date < %s
+                      AND (c.subscription_start IS NULL OR a.assign_date < c.subscription_start);
+                """, (month, month_end))
+                cur.execute("""
+                    SELECT COUNT(*) FROM assignments a
+                    WHERE a.assign_date >= %s AND a.assign_date < %s
+                      AND NOT EXISTS (SELECT 1 FROM archiving x WHERE x.assignment_id = a.assignment_id);
+                """, (month, month_end))
+                retained = cur.fetchone()[0]
+
+                cur.execute("""
+                    INSERT INTO delivery_summaries
+                        (month, customer_id, driver_id, location_id, assigned, delivered, missed, paused)
+                    SELECT %s, a.customer_id, a.driver_id, MIN(c.location_id),
+                           COUNT(*),
+                           COUNT(*) FILTER (WHERE del.status = 'delivered'),
+                           COUNT(*) FILTER (WHERE del.status = 'missed'),
+                           COUNT(*) FILTER (WHERE del.status = 'paused')
+                    FROM archiving x
+                    JOIN assignments a ON a.assignment_id = x.assignment_id
+                    LEFT JOIN customers c ON c.customer_id = a.customer_id
+                    LEFT JOIN deliveries del
+                           ON del.assignment_id = a.assignment_id
+                          AND del.delivery_date = a.assign_date
+                          AND del.delivery_date >= %s AND del.delivery_date < %s
+                    GROUP BY a.customer_id, a.driver_id
+                    ON CONFLICT (month, customer_id, driver_id) DO UPDATE
+                    SET location_id = COALESCE(excluded.location_id, delivery_summaries.location_id),
+                        assigned  = delivery_summaries.assigned  + excluded.assigned,
+                        delivered = delivery_summaries.delivered + excluded.delivered,
+                        missed    = delivery_summaries.missed    + excluded.missed,
+                        paused    = delivery_summaries.paused    + excluded.paused;
+                """, (month, month, month_end))
+
+                if retained:
+                    cur.execute("""
+                        DELETE FROM deliveries
+                        WHERE assignment_id IN (SELECT assignment_id FROM archiving);
+                    """)
+                else:
+                    if partitioned:
+                        cur.execute(
+                            sql.SQL("DROP TABLE IF EXISTS {};").format(
+                                sql.Identifier(_partition_name(month))
+                            )
+                        )
+                    # Rows that landed in the default partition (or the whole
+                    # month when the table is not partitioned yet).
+                    cur.execute("""
+                        DELETE FROM deliveries
+                        WHERE delivery_date >= %s AND delivery_date < %s;
+                    """, (month, month_end))
+                    cur.execute("""
+                        DELETE FROM deliveries
+                        WHERE assignment_id IN (SELECT assignment_id FROM archiving);
+                    """)
+                cur.execute("""
+                    DELETE FROM assignments
+                    WHERE assignment_id IN (SELECT assignment_id FROM archiving);
+                """)
+            conn.commit()
+        archived.append(month)
+        month = month_end
+
+    return archived
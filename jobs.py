@@ -0,0 +1,151 @@
+"""
+Command-line maintenance jobs for Smart Delivery.
+
+Uses the same .streamlit/secrets.toml as the app, so run it from the
+project folder, e.g. from cron:
+
+    python jobs.py migrate
+    python jobs.py archive --retention-months 12
+    python jobs.py reconcile-owed --fix
+    python jobs.py scheduler --loop
+    python jobs.py export --consumer accounting --format parquet --out exports/
+    python jobs.py merge-locations --apply
+    python jobs.py close-days
+"""
+import argparse
+from datetime import date
+
+import db
+
+
+def cmd_migrate(args):
+    if db.partition_deliveries_table(months_ahead=args.months_ahead):
+        print("deliveries converted to a monthly partitioned table.")
+    db.ensure_schema()
+    print("Schema is up to date.")
+
+
+def cmd_partitions(args):
+    db.ensure_delivery_partitions(months_ahead=args.months_ahead)
+    print(f"Delivery partitions ensured {args.months_ahead} months ahead.")
+
+
+def cmd_archive(args):
+    months = db.archive_old_deliveries(retention_months=args.retention_months)
+    if not months:
+        print("Nothing to archive.")
+    for m in months:
+        print(f"Archived {m:%Y-%m}")
+
+
+def cmd_reconcile_owed(args):
+    rows = db.reconcile_owed(fix=args.fix)
+    if not rows:
+        print("Owed balances match deliveries for every customer.")
+        return
+    print(f"{'customer_id':>11}  {'stored':>6}  {'ledger':>6}  {'derived':>7}  name")
+    for r in rows:
+        print(f"{r['customer_id']:>11}  {r['stored_owed']:>6}  {r['ledger_owed']:>6}  "
+              f"{r['derived_owed']:>7}  {r['full_name']}")
+    action = "Fixed" if args.fix else "Found"
+    print(f"{action} {len(rows)} discrepancies.")
+
+
+def cmd_scheduler(args):
+    totals = db.run_scheduler(batch_size=args.batch_size, interval=args.interval,
+                              once=not args.loop, retention_days=args.retention_days)
+    print(f"Processed {totals['processed']} subscription events, {totals['failed']} failed, "
+          f"{totals['purged']} old ones purged.")
+    for r in db.scheduler_backlog():
+        print(f"  {r['event_type']:<14} pending {r['pending']:>6}  due {r['due']:>4}  "
+              f"failing {r['failing']:>4}  next {r['next_due']:%Y-%m-%d %H:%M}")
+
+
+def cmd_export(args):
+    for table in args.tables:
+        r = db.export_changes(args.consumer, table, args.out, fmt=args.format)
+        files = ", ".join(r["files"]) or "no changes"
+        print(f"{table}: {r['rows']} changed, {r['deleted']} deleted ({files})")
+
+
+def cmd_merge_locations(args):
+    merges = db.suggest_location_merges(cutoff=args.cutoff)
+    if not merges:
+        print("No near-duplicate locations.")
+        return
+    for m in merges:
+        print(f"{m['location']!r:>30} -> {m['into']!r:<30} score {m['score']:.2f}  "
+              f"{m['customers']} customers")
+    if args.apply:
+        merged = db.merge_locations([(m["location_id"], m["into_id"]) for m in merges])
+        print(f"Merged {merged} locations.")
+    else:
+        print(f"{len(merges)} merges suggested; run with --apply to merge them.")
+
+
+def cmd_close_days(args):
+    result = db.close_days(through=args.through)
+    for d in result["closed"]:
+        print(f"Closed {d}")
+    for r in result["unmarked"]:
+        print(f"Left open {r['day']}: {r['unmarked'] or 'some'} unmarked stops")
+    if not result["closed"]:
+        print("No days to close.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Smart Delivery maintenance jobs")
+    parser.add_argument("--statement-timeout-ms", type=int, default=0,
+                        help="limit per statement for this job (default 0: none; "
+                             "DB_STATEMENT_TIMEOUT_MS only applies to the app)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="apply schema changes (partitions deliveries once)")
+    p.add_argument("--months-ahead", type=int, default=db.PARTITION_MONTHS_AHEAD)
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("partitions", help="create upcoming monthly delivery partitions")
+    p.add_argument("--months-ahead", type=int, default=db.PARTITION_MONTHS_AHEAD)
+    p.set_defaults(func=cmd_partitions)
+
+    p = sub.add_parser("archive", help="compact old delivery history into monthly summaries")
+    p.add_argument("--retention-months", type=int, default=12)
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("reconcile-owed", help="recompute owed balances from deliveries")
+    p.add_argument("--fix", action="store_true", help="write the derived balances back")
+    p.set_defaults(func=cmd_reconcile_owed)
+
+    p = sub.add_parser("scheduler", help="process due subscription events (expiries, pause resumptions)")
+    p.add_argument("--loop", action="store_true", help="keep polling instead of exiting when idle")
+    p.add_argument("--batch-size", type=int, default=100)
+    p.add_argument("--interval", type=int, default=30, help="seconds to sleep when nothing is due")
+    p.add_argument("--retention-days", type=int, default=db.EVENT_RETENTION_DAYS,
+                   help="delete events processed longer ago than this")
+    p.set_defaults(func=cmd_scheduler)
+
+    p = sub.add_parser("export", help="export rows changed since the consumer's last export")
+    p.add_argument("--consumer", required=True, help="name whose watermark is kept, e.g. accounting")
+    p.add_argument("--tables", nargs="+", choices=list(db.EXPORT_TABLES), default=list(db.EXPORT_TABLES))
+    p.add_argument("--format", choices=db.EXPORT_FORMATS, default="csv")
+    p.add_argument("--out", default="exports", help="folder to write the files to")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("merge-locations", help="fold near-duplicate location spellings together")
+    p.add_argument("--cutoff", type=float, default=db.LOCATION_MERGE_CUTOFF,
+                   help="minimum similarity (0-1) to merge")
+    p.add_argument("--apply", action="store_true", help="merge instead of only listing")
+    p.set_defaults(func=cmd_merge_locations)
+
+    p = sub.add_parser("close-days", help="freeze past days whose stops are all marked")
+    p.add_argument("--through", type=date.fromisoformat, default=None,
+                   help="last day to close, YYYY-MM-DD (default yesterday)")
+    p.set_defaults(func=cmd_close_days)
+
+    args = parser.parse_args(argv)
+    db.set_statement_timeout(args.statement_timeout_ms)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
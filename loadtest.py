@@ -0,0 +1,321 @@
+"""
+Concurrent-session load test for the Streamlit app.
+
+Drives N simultaneous admin and driver sessions through app.py with
+Streamlit's AppTest and reports per-interaction latency, DB round trips,
+connections opened and the peak number of server connections as the
+session count grows. AppTest swaps a process-global runtime on every run,
+so each session runs in its own forked process; all sessions wait on a
+barrier and log in at the same moment, like the 7 a.m. rush.
+
+Point .streamlit/secrets.toml at a local Postgres, then e.g.:
+
+    python loadtest.py --seed --sessions 1,5,10,25,50,100
+"""
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import db
+
+SECRET_KEYS = ["DB_HOST", "DB_NAME", "DB_USER", "DB_PASSWORD", "DB_SSLMODE"]
+
+
+# -------------------------------
+# DB INSTRUMENTATION
+# -------------------------------
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.round_trips = 0
+
+    def add(self, connects=0, round_trips=0):
+        with self.lock:
+            self.connects += connects
+            self.round_trips += round_trips
+
+    def reset(self):
+        with self.lock:
+            self.connects = self.round_trips = 0
+
+    def snapshot(self):
+        with self.lock:
+            return self.connects, self.round_trips
+
+
+COUNTERS = Counters()
+_counting_cursors = {}
+
+
+def _counting_cursor(base):
+    cls = _counting_cursors.get(base)
+    if cls is None:
+        class CountingCursor(base):
+            def execute(self, *args, **kwargs):
+                COUNTERS.add(round_trips=1)
+                return super().execute(*args, **kwargs)
+
+            def copy_expert(self, *args, **kwargs):
+                COUNTERS.add(round_trips=1)
+                return super().copy_expert(*args, **kwargs)
+
+        cls = _counting_cursors[base] = CountingCursor
+    return cls
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _counting_cursor(base)
+        return super().cursor(*args, **kwargs)
+
+
+def instrument_db():
+    """Count every connection and statement the app makes through db.py."""
+    real_connect = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        COUNTERS.add(connects=1)
+        kwargs.setdefault("connection_factory", CountingConnection)
+        return real_connect(*args, **kwargs)
+
+    db.psycopg2.connect = connect
+
+
+class ConnectionMonitor(threading.Thread):
+    """Samples pg_stat_activity to find the peak number of open connections."""
+
+    def __init__(self, secrets, interval=0.05):
+        super().__init__(daemon=True)
+        self.secrets = secrets
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        conn = psycopg2.connect(
+            host=self.secrets["DB_HOST"],
+            dbname=self.secrets["DB_NAME"],
+            user=self.secrets["DB_USER"],
+            password=self.secrets["DB_PASSWORD"],
+            sslmode=self.secrets["DB_SSLMODE"],
+        )
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            while not self.stop_event.is_set():
+                cur.execute(
+                    "SELECT COUNT(*) - 1 FROM pg_stat_activity WHERE datname = current_database();"
+                )
+                self.peak = max(self.peak, cur.fetchone()[0])
+                time.sleep(self.interval)
+        conn.close()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+# -------------------------------
+# SESSIONS
+# -------------------------------
+def new_app(secrets, timeout):
+    at = AppTest.from_file("app.py", default_timeout=timeout)
+    for key in SECRET_KEYS:
+        at.secrets[key] = secrets[key]
+    return at
+
+
+def timed(latencies, kind, fn):
+    started = time.perf_counter()
+    fn()
+    latencies.append((kind, time.perf_counter() - started))
+
+
+def login(at, username, password):
+    at.run()
+    at.text_input[0].input(username)
+    at.text_input[1].input(password)
+    at.button[0].click().run()
+    at.run()
+
+
+def driver_session(at, username, password, interactions, latencies, errors):
+    timed(latencies, "login", lambda: login(at, username, password))
+    for _ in range(interactions):
+        save_keys = [b.key for b in at.button if b.key and b.key.startswith("save_")]
+        if not save_keys:
+            timed(latencies, "refresh", at.run)
+            continue
+        key = random.choice(save_keys)
+        radio = at.radio(key=key.replace("save_", "radio_"))
+        radio.set_value(random.choice(["Delivered", "Delivered", "Delivered", "Missed"]))
+        timed(latencies, "mark", lambda: at.button(key=key).click().run())
+        errors.extend(e.value for e in at.exception)
+
+
+def admin_session(at, username, password, interactions, latencies, errors):
+    timed(latencies, "login", lambda: login(at, username, password))
+    steps = [
+        ("open_section", lambda: at.button(key="btn_customer_section").click().run()),
+        ("back", lambda: at.button(key="cust_back").click().run()),
+        ("switch_driver", lambda: at.selectbox(key="admin_driver_select").select_index(
+            random.randrange(len(at.selectbox(key="admin_driver_select").options))).run()),
+        ("refresh", at.run),
+    ]
+    for i in range(interactions):
+        kind, step = steps[i % len(steps)]
+        try:
+            timed(latencies, kind, step)
+        except (KeyError, ValueError) as e:
+            errors.append(f"{kind}: {e}")
+        errors.extend(e.value for e in at.exception)
+
+
+# -------------------------------
+# SCENARIO
+# -------------------------------
+def seed(drivers, customers):
+    from datetime import date
+
+    for i in range(drivers):
+        phone = f"8{i:09d}"
+        if db.fetch_one("SELECT 1 FROM users WHERE username = %s;", (phone,)):
+            continue
+        driver_id = db.add_driver(f"Load Driver {i}", phone)
+        db.create_driver_user(phone, "1234", driver_id)
+
+    import pandas as pd
+    db.bulk_import_customers(pd.DataFrame({
+        "full_name": [f"Load Customer {i}" for i in range(customers)],
+        "phone_number": [f"7{i:09d}" for i in range(customers)],
+        "address": "Load test",
+        "location": [f"Area {i % 25}" for i in range(customers)],
+        "subscription_start": date.today().isoformat(),
+    }))
+    db.auto_create_assignments_for_today()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def _session_process(role, creds, args, secrets, barrier, results):
+    random.seed()
+    COUNTERS.reset()
+    latencies, errors = [], []
+    at = new_app(secrets, args.timeout)
+    target = admin_session if role == "admin" else driver_session
+    barrier.wait()
+    try:
+        target(at, *creds, args.interactions, latencies, errors)
+    except Exception as e:
+        errors.append(f"{role}: {e!r}")
+    results.put((latencies, errors, *COUNTERS.snapshot()))
+
+
+def run_level(n_sessions, args, secrets, driver_users):
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(n_sessions + 1)
+    results = ctx.Queue()
+
+    n_admins = max(1, round(n_sessions * args.admin_share)) if args.admin_share else 0
+    procs = []
+    for i in range(n_sessions):
+        if i < n_admins:
+            role, creds = "admin", (args.admin_user, args.admin_password)
+        else:
+            role, creds = "driver", (driver_users[i % len(driver_users)], args.driver_password)
+        procs.append(ctx.Process(
+            target=_session_process, args=(role, creds, args, secrets, barrier, results)
+        ))
+    for p in procs:
+        p.start()
+
+    monitor = ConnectionMonitor(secrets)
+    monitor.start()
+    barrier.wait()
+    started = time.perf_counter()
+    collected = [results.get() for _ in procs]
+    elapsed = time.perf_counter() - started
+    for p in procs:
+        p.join()
+    monitor.stop()
+
+    latencies = [x for r in collected for x in r[0]]
+    errors = [x for r in collected for x in r[1]]
+    connects = sum(r[2] for r in collected)
+    trips = sum(r[3] for r in collected)
+
+    interactions = [s for kind, s in latencies if kind != "login"]
+    count = len(latencies)
+    return {
+        "sessions": n_sessions,
+        "interactions": count,
+        "throughput": count / elapsed if elapsed else 0.0,
+        "p50": percentile(interactions, 50) * 1000,
+        "p95": percentile(interactions, 95) * 1000,
+        "p99": percentile(interactions, 99) * 1000,
+        "login_p95": percentile([s for kind, s in latencies if kind == "login"], 95) * 1000,
+        "trips": trips / count if count else 0.0,
+        "connects": connects / count if count else 0.0,
+        "peak_conns": monitor.peak,
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for app.py")
+    parser.add_argument("--sessions", default="1,5,10,25,50,100",
+                        help="comma-separated session counts to run, in order")
+    parser.add_argument("--interactions", type=int, default=10, help="interactions per session")
+    parser.add_argument("--admin-share", type=float, default=0.1,
+                        help="fraction of sessions that are admins (at least one if > 0)")
+    parser.add_argument("--admin-user", default="admin")
+    parser.add_argument("--admin-password", default="admin")
+    parser.add_argument("--driver-password", default="1234")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds per script run")
+    parser.add_argument("--seed", action="store_true",
+                        help="create load-test drivers, customers and today's assignments first")
+    parser.add_argument("--seed-drivers", type=int, default=30)
+    parser.add_argument("--seed-customers", type=int, default=1500)
+    args = parser.parse_args(argv)
+
+    secrets = {key: st.secrets[key] for key in SECRET_KEYS}
+    if args.seed:
+        seed(args.seed_drivers, args.seed_customers)
+
+    driver_users = [r["username"] for r in db.fetch_all(
+        "SELECT username FROM users WHERE role = 'driver' ORDER BY username;"
+    )]
+    if not driver_users:
+        parser.error("No driver users found; run with --seed first.")
+
+    instrument_db()
+
+    print(f"{'sessions':>8} {'inter.':>7} {'thr/s':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'login95':>8} {'trips':>6} {'conns':>6} {'peak':>5}")
+    for n in [int(x) for x in args.sessions.split(",") if x.strip()]:
+        r = run_level(n, args, secrets, driver_users)
+        print(f"{r['sessions']:>8} {r['interactions']:>7} {r['throughput']:>7.1f} {r['p50']:>8.0f} "
+              f"{r['p95']:>8.0f} {r['p99']:>8.0f} {r['login_p95']:>8.0f} {r['trips']:>6.1f} "
+              f"{r['connects']:>6.1f} {r['peak_conns']:>5}")
+        for err in r["errors"][:5]:
+            print(f"         ! {err}")
+    print("trips / conns = DB round trips / connections opened per interaction; "
+          "peak = max server connections seen.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Typed row records returned by db.py.
+
+Each record is a NamedTuple: one small tuple per row with attribute access,
+instead of a dict that carries its own copy of every column name. db.fetch_records
+builds them straight from plain cursor tuples, so the SELECT list must match
+the field order below (fetch_records checks it).
+"""
+from datetime import date, datetime, timedelta
+from typing import NamedTuple, Optional
+
+
+class Customer(NamedTuple):
+    customer_id: int
+    full_name: str
+    phone_number: str
+    address: str
+    plan_name: str
+    location: str
+    owed: int
+    subscription_start: date
+    subscription_days: int
+
+    @property
+    def subscription_end(self):
+        return self.subscription_start + timedelta(days=self.subscription_days + self.owed)
+
+
+class CustomerRef(NamedTuple):
+    """Just enough of a customer for pickers and lists."""
+    customer_id: int
+    full_name: str
+
+
+class Driver(NamedTuple):
+    driver_id: int
+    full_name: str
+    phone: str
+    capacity: Optional[int]         # None: no limit
+    shift_minutes: Optional[int]
+
+
+class Assignment(NamedTuple):
+    assignment_id: int
+    customer_id: int
+    customer_name: str
+    driver_id: int
+    driver_name: str
+
+
+class Delivery(NamedTuple):
+    """A stop on a driver's route and, once marked, its delivery status."""
+    assignment_id: int
+    customer_id: int
+    customer_name: str
+    driver_id: int
+    driver_name: str
+    location: str
+    status: Optional[str]
+    marked_at: Optional[datetime]
+    marked_by: Optional[int]
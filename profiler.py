@@ -0,0 +1,133 @@
+"""
+Per-rerun profiling for the Streamlit app.
+
+Enable with the SMART_DELIVERY_PROFILE=1 environment variable or by opening
+the app with ?profile=1. Every rerun then records wall time per section
+(login, tabs, admin modes, DB calls) and shows a flame-style breakdown in
+the sidebar. When disabled, section() is a no-op.
+
+State is thread-local because Streamlit runs each session's script in its
+own thread.
+"""
+import contextlib
+import importlib
+import os
+import sys
+import threading
+import time
+
+_state = threading.local()
+
+# First-import wall time per module, for the whole process (cold start).
+IMPORT_TIMES = {}
+
+
+def is_requested():
+    if os.environ.get("SMART_DELIVERY_PROFILE", "").lower() in ("1", "true", "yes"):
+        return True
+    import streamlit as st
+    return st.query_params.get("profile") in ("1", "true", "yes")
+
+
+def start_run(enabled):
+    """Begin a new rerun; call once at the top of app.py."""
+    _state.enabled = enabled
+    _state.records = []
+    _state.stack = []
+    _state.started = time.perf_counter()
+    _state.placeholder = None
+    if enabled:
+        import streamlit as st
+        st.sidebar.markdown("### ⏱ Rerun Profile")
+        _state.placeholder = st.sidebar.empty()
+
+
+def enabled():
+    return getattr(_state, "enabled", False)
+
+
+@contextlib.contextmanager
+def section(name):
+    """Time a block. Nested sections show up indented under their parent."""
+    if not getattr(_state, "enabled", False):
+        yield
+        return
+    _state.stack.append(name)
+    path = tuple(_state.stack)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _state.records.append((path, (time.perf_counter() - started) * 1000))
+        _state.stack.pop()
+        # st.stop() / st.rerun() end the script from inside a section, so
+        # redraw after every top-level section rather than at the end.
+        if not _state.stack:
+            render()
+
+
+def timed_import(module_name):
+    """Import a module, recording how long its first import took."""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with section(f"import {module_name}"):
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        IMPORT_TIMES[module_name] = (time.perf_counter() - started) * 1000
+    return module
+
+
+class LazyModule:
+    """Module proxy that defers the import until an attribute is first used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = timed_import(self._name)
+        return getattr(self._module, attr)
+
+
+def render():
+    placeholder = getattr(_state, "placeholder", None)
+    if placeholder is None:
+        return
+
+    # Aggregate repeated sections (e.g. one db call per row) by path, in
+    # order of first appearance.
+    totals, counts = {}, {}
+    for path, ms in _state.records:
+        totals[path] = totals.get(path, 0.0) + ms
+        counts[path] = counts.get(path, 0) + 1
+
+    # Records are appended when a section ends, so a parent is placed where
+    # its first child (or itself) finished; siblings keep their run order.
+    first = {}
+    for i, (path, _) in enumerate(_state.records):
+        for depth in range(1, len(path) + 1):
+            first.setdefault(path[:depth], i)
+
+    def order(path):
+        return tuple(first[path[:depth]] for depth in range(1, len(path) + 1))
+
+    run_ms = (time.perf_counter() - _state.started) * 1000
+    lines = [f"{'rerun total':<30} {run_ms:>8.1f} ms"]
+    for path in sorted(totals, key=order):
+        ms = totals[path]
+        label = "  " * len(path) + path[-1]
+        if counts[path] > 1:
+            label += f" ×{counts[path]}"
+        bar = "█" * max(1, round(20 * ms / run_ms)) if run_ms else ""
+        lines.append(f"{label[:30]:<30} {ms:>8.1f} ms {bar}")
+
+    if IMPORT_TIMES:
+        lines.append("")
+        lines.append("first import (cold start)")
+        for name, ms in IMPORT_TIMES.items():
+            lines.append(f"  {name:<28} {ms:>8.1f} ms")
+
+    placeholder.code("\n".join(lines), language=None)
+
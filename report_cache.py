@@ -0,0 +1,138 @@
+"""
+Local Parquet cache for reports over closed days.
+
+A closed day's assignments and deliveries can no longer change (see
+db.close_day), so a per-day report over it only has to be computed once.
+range_frame() splits a date range into closed days that are already cached,
+read from one Parquet file each, and runs of open or not yet cached days,
+each loaded with a single query; the closed days in those runs are written
+back for next time.
+
+Files are named after the report and the day's content hash recorded when it
+was closed, so a day that is reopened and closed again gets a new file and
+the old one ages out. The directory is kept under CACHE_MAX_BYTES by deleting
+the least recently read files first (a read touches the file's mtime). Since
+files never change, each process also keeps the most recently read ones in
+memory, up to MEMORY_MAX_BYTES. Change a report's name when its loader's
+columns change.
+"""
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import db
+
+CACHE_DIR = ".report_cache"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+MEMORY_MAX_BYTES = 64 * 1024 * 1024
+
+_memory = OrderedDict()     # path -> pyarrow.Table, least recently used first
+_memory_lock = threading.Lock()
+
+
+def _path(report, content_hash):
+    return os.path.join(CACHE_DIR, f"{report}-{content_hash}.parquet")
+
+
+def _remember(path, table):
+    with _memory_lock:
+        _memory[path] = table
+        total = sum(t.nbytes for t in _memory.values())
+        while total > MEMORY_MAX_BYTES and len(_memory) > 1:
+            total -= _memory.popitem(last=False)[1].nbytes
+
+
+def _read(path):
+    """The cached table, or None if it is missing (or was just evicted)."""
+    with _memory_lock:
+        table = _memory.get(path)
+        if table is not None:
+            _memory.move_to_end(path)
+    try:
+        if table is None:
+            table = pq.read_table(path)
+            _remember(path, table)
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return table
+
+
+def _write(path, df):
+    # Another process may be writing the same day; the rename is atomic.
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+    _remember(path, table)
+
+
+def evict(max_bytes=CACHE_MAX_BYTES):
+    """Delete least recently read files until the cache fits in max_bytes; returns the number deleted."""
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    files = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".parquet"):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    deleted = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return deleted
+
+
+def range_frame(report, loader, from_date, to_date, day_column="day"):
+    """
+    Rows of `report` for from_date..to_date. `loader(from_date, to_date)`
+    queries the database and must return a DataFrame with the day of each
+    row in `day_column`; it is only called for the parts of the range that
+    are not cached.
+    """
+    closed = db.closed_day_hashes(from_date, to_date)
+
+    cached, runs = [], []
+    day = from_date
+    while day <= to_date:
+        table = _read(_path(report, closed[day])) if day in closed else None
+        if table is not None:
+            cached.append(table)
+        elif runs and runs[-1][1] == day - timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+        day += timedelta(days=1)
+
+    # Converted to pandas once, not per day.
+    parts = [pa.concat_tables(cached).to_pandas()] if cached else []
+    written = False
+    for start, end in runs:
+        df = loader(start, end)
+        parts.append(df)
+        to_cache = [d for d in closed if start <= d <= end]
+        if to_cache:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            days = df[day_column].dt.date
+            for d in to_cache:
+                _write(_path(report, closed[d]), df[days == d])
+            written = True
+    if written:
+        evict()
+
+    out = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    return out.sort_values(day_column, kind="stable", ignore_index=True)
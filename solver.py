@@ -0,0 +1,181 @@
+"""
+Capacity-aware route assignment.
+
+Pure Python, no database access: db.auto_create_assignments_for_today loads
+the inputs, calls solve() and writes the result back.
+
+Every stop is one bowl and takes its location's service time. A driver can
+take at most `capacity` bowls and `shift_minutes` of service per day,
+including stops they already have; either limit may be None (unlimited).
+Locations are kept on one driver whenever possible so routes stay together:
+
+1. Greedy: locations go largest first. Each goes whole to its preferred
+   (mapped) driver if it fits, otherwise whole to the driver with the most
+   room (the fewest stops among drivers without limits).
+2. Repair: a location that fits nowhere whole makes room on its preferred
+   driver by moving that driver's smaller greedy locations to drivers with
+   slack. If it still does not fit, it is split across drivers, preferred
+   driver first and then the roomiest ones.
+3. Stops that fit nowhere are reported as overflow and left unassigned.
+"""
+import math
+
+
+def _room(driver, service_minutes):
+    """How many more stops of this service time the driver can take (math.inf if no limit applies)."""
+    room = math.inf
+    if driver["capacity"] is not None:
+        room = driver["capacity"] - driver["stops"]
+    if driver["shift_minutes"] is not None and service_minutes > 0:
+        room = min(room, int((driver["shift_minutes"] - driver["minutes"]) // service_minutes))
+    return max(0, room)
+
+
+def _place(driver, n, service_minutes):
+    driver["stops"] += n
+    driver["minutes"] += n * service_minutes
+
+
+def _unplace(driver, n, service_minutes):
+    driver["stops"] -= n
+    driver["minutes"] -= n * service_minutes
+
+
+def _roomiest(drivers, service_minutes, need=1, exclude=None):
+    """
+    Driver with the most room left that can take `need` stops, or None.
+    Ties (drivers without limits) go to the one with the fewest stops.
+    """
+    best, best_key = None, None
+    for driver_id, driver in drivers.items():
+        if driver_id == exclude:
+            continue
+        room = _room(driver, service_minutes)
+        key = (room, -driver["stops"])
+        if room >= need and (best_key is None or key > best_key):
+            best, best_key = driver_id, key
+    return best
+
+
+def solve(locations, drivers):
+    """
+    locations: list of dicts with location, customer_ids, service_minutes
+               and preferred_driver_id (None if unmapped).
+    drivers:   list of dicts with driver_id, full_name, capacity and
+               shift_minutes (None for no limit), stops (already assigned
+               today) and minutes (service minutes already assigned).
+
+    Returns a dict:
+      assignments: list of (customer_id, driver_id)
+      mapping:     {location: driver_id} for locations placed whole
+      split:       locations spread over more than one driver
+      overflow:    list of dicts with location and customer_ids left unassigned
+      drivers:     per-driver utilization rows
+    """
+    state = {
+        d["driver_id"]: {key: d[key] for key in ("capacity", "shift_minutes", "stops", "minutes")}
+        for d in drivers
+    }
+    ordered = sorted(locations, key=lambda loc: (-len(loc["customer_ids"]), loc["location"]))
+
+    # 1. Greedy: whole locations, preferred driver first.
+    placed = {}          # location -> driver_id, for whole placements
+    leftovers = []
+    for loc in ordered:
+        n, svc = len(loc["customer_ids"]), loc["service_minutes"]
+        if not n:
+            continue
+        preferred = loc["preferred_driver_id"]
+        if preferred in state and _room(state[preferred], svc) >= n:
+            target = preferred
+        else:
+            target = _roomiest(state, svc, need=n)
+        if target is None:
+            leftovers.append(loc)
+            continue
+        _place(state[target], n, svc)
+        placed[loc["location"]] = target
+
+    by_name = {loc["location"]: loc for loc in locations}
+
+    # 2. Repair: free room on the preferred driver by moving its smaller
+    #    whole locations elsewhere, then split what still does not fit.
+    chunks = {}          # location -> list of (driver_id, count)
+    for loc in leftovers:
+        n, svc = len(loc["customer_ids"]), loc["service_minutes"]
+        preferred = loc["preferred_driver_id"]
+        if preferred in state:
+            movable = sorted(
+                (name for name, d in placed.items()
+                 if d == preferred and name != loc["location"]
+                 and len(by_name[name]["customer_ids"]) < n),
+                key=lambda name: len(by_name[name]["customer_ids"]),
+            )
+            for name in movable:
+                if _room(state[preferred], svc) >= n:
+                    break
+                other = by_name[name]
+                m, other_svc = len(other["customer_ids"]), other["service_minutes"]
+                target = _roomiest(state, other_svc, need=m, exclude=preferred)
+                if target is None:
+                    continue
+                _unplace(state[preferred], m, other_svc)
+                _place(state[target], m, other_svc)
+                placed[name] = target
+            if _room(state[preferred], svc) >= n:
+                _place(state[preferred], n, svc)
+                placed[loc["location"]] = preferred
+                continue
+
+        remaining, parts = n, []
+        candidates = [preferred] if preferred in state else []
+        candidates += sorted(
+            (d for d in state if d != preferred),
+            key=lambda d: -_room(state[d], svc),
+        )
+        for driver_id in candidates:
+            take = min(remaining, _room(state[driver_id], svc))
+            if take:
+                _place(state[driver_id], take, svc)
+                parts.append((driver_id, take))
+                remaining -= take
+            if not remaining:
+                break
+        chunks[loc["location"]] = parts
+
+    # 3. Expand to customer-level assignments; whatever is left overflows.
+    assignments, overflow = [], []
+    for loc in locations:
+        ids = loc["customer_ids"]
+        if loc["location"] in placed:
+            assignments += [(cid, placed[loc["location"]]) for cid in ids]
+            continue
+        start = 0
+        for driver_id, count in chunks.get(loc["location"], []):
+            assignments += [(cid, driver_id) for cid in ids[start:start + count]]
+            start += count
+        if start < len(ids):
+            overflow.append({"location": loc["location"], "customer_ids": ids[start:]})
+
+    report = []
+    for d in drivers:
+        s = state[d["driver_id"]]
+        stops, minutes = s["stops"], s["minutes"]
+        report.append({
+            "driver_id": d["driver_id"],
+            "driver_name": d["full_name"],
+            "stops": stops,
+            "capacity": d["capacity"],
+            "capacity_used": round(stops / d["capacity"], 3) if d["capacity"] else None,
+            "minutes": round(minutes, 1),
+            "shift_minutes": d["shift_minutes"],
+            "shift_used": round(minutes / d["shift_minutes"], 3) if d["shift_minutes"] else None,
+        })
+
+    return {
+        "assignments": assignments,
+        "mapping": placed,
+        "split": sorted(name for name, parts in chunks.items() if len(parts) > 1),
+        "overflow": overflow,
+        "drivers": report,
+    }
@@ -0,0 +1,29 @@
+"""
+Shared fixtures.
+
+Tests that touch Postgres take the `database` fixture: it points db.py at
+SMART_DELIVERY_TEST_DSN (a scratch copy of a Smart Delivery database) and
+applies the schema. They are skipped when the variable is not set:
+
+    SMART_DELIVERY_TEST_DSN="dbname=sd_test" python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database(monkeypatch):
+    dsn = os.environ.get("SMART_DELIVERY_TEST_DSN")
+    if not dsn:
+        pytest.skip("SMART_DELIVERY_TEST_DSN is not set")
+    import psycopg2
+    import db
+
+    monkeypatch.setattr(db, "_setting", lambda key: db.CONNECT_DEFAULTS[key])
+    monkeypatch.setattr(db, "_connect", lambda: psycopg2.connect(dsn))
+    db.ensure_schema()
+    return db
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+
+from changes import _patch_stops
+from models import Delivery
+
+DAY = "2026-10-19"
+
+
+def stops():
+    return [
+        Delivery(41, 12, "Asha", 3, "Ravi", "Kondapur", None, None, None),
+        Delivery(42, 13, "Bala", 3, "Ravi", "Kondapur", "paused", None, None),
+    ]
+
+
+def marked(rows, driver_id=3, day=DAY):
+    return {"table": "deliveries", "op": "UPDATE", "date": day, "driver_id": driver_id, "rows": rows}
+
+
+def test_delivery_marks_are_patched_in():
+    rows = stops()
+    out = _patch_stops(rows, [marked([
+        {"assignment_id": 41, "status": "delivered", "marked_at": 1792401302.5},
+        {"assignment_id": 99, "status": "missed", "marked_at": None},
+    ])], DAY, 3)
+    assert out[0].status == "delivered"
+    assert out[0].marked_at == datetime(2026, 10, 19, 9, 15, 2, 500000, tzinfo=timezone.utc)
+    assert out[1] == rows[1]
+    assert rows[0].status is None          # the cached list is not modified
+
+
+def test_other_routes_and_minor_customer_updates_are_ignored():
+    rows = stops()
+    events = [
+        marked([{"assignment_id": 41, "status": "missed", "marked_at": None}], driver_id=4),
+        marked([{"assignment_id": 41, "status": "missed", "marked_at": None}], day="2026-10-18"),
+        {"table": "customers", "op": "UPDATE", "ids": [12], "minor": True},
+        {"table": "customers", "op": "UPDATE", "ids": [77], "minor": False},
+        {"table": "drivers", "op": "UPDATE", "ids": [4]},
+    ]
+    assert _patch_stops(rows, events, DAY, 3) == rows
+
+
+def test_route_changes_need_a_reload():
+    rows = stops()
+    assert _patch_stops(rows, [{"table": "assignments", "op": "INSERT", "date": DAY, "driver_id": 3}],
+                        DAY, 3) is None
+    assert _patch_stops(rows, [marked(None)], DAY, 3) is None
+    assert _patch_stops(rows, [{"table": "customers", "op": "UPDATE", "ids": [13], "minor": False}],
+                        DAY, 3) is None
+    assert _patch_stops(rows, [{"table": "drivers", "op": "UPDATE", "ids": None}], DAY, 3) is None
+    assert _patch_stops(rows, [{"table": "locations", "op": "UPDATE", "ids": [5], "minor": False}],
+                        DAY, 3) is None
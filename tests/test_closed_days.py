@@ -0,0 +1,45 @@
+from datetime import date
+
+import pytest
+
+DAY = date(2001, 1, 2)      # far before any real route
+
+
+@pytest.fixture
+def closed_stop(database):
+    """A customer with one delivered stop on a closed day."""
+    db = database
+    driver_id = db.add_driver("Closed Day Test Driver", "9999900051")
+    customer_id = db.fetch_one("""
+        INSERT INTO customers (full_name, phone_number, address, plan_name, location,
+                               subscription_start, subscription_days)
+        VALUES ('Closed Day Test', '9999900052', 'addr', 'Monthly', NULL, %s, 1)
+        RETURNING customer_id;
+    """, (DAY,))["customer_id"]
+    assignment_id = db.fetch_one("""
+        INSERT INTO assignments (assign_date, customer_id, driver_id)
+        VALUES (%s, %s, %s) RETURNING assignment_id;
+    """, (DAY, customer_id, driver_id))["assignment_id"]
+    db.upsert_delivery(assignment_id, DAY, "delivered")
+    db.close_day(DAY)
+    yield customer_id, driver_id
+    db.reopen_day(DAY)
+    if db.fetch_one("SELECT 1 AS found FROM customers WHERE customer_id = %s;", (customer_id,)):
+        db.delete_customer(customer_id)
+    db.delete_driver(driver_id)
+
+
+def test_delete_is_refused_until_reopening_is_confirmed(database, closed_stop):
+    db = database
+    customer_id, driver_id = closed_stop
+    assert db.closed_days_of("customer_id", customer_id) == [DAY]
+
+    with pytest.raises(ValueError):
+        db.delete_customer(customer_id)
+    with pytest.raises(ValueError):
+        db.delete_driver(driver_id)
+    assert db.closed_days_of("driver_id", driver_id) == [DAY]
+
+    db.delete_customer(customer_id, reopen_closed_days=True)
+    assert DAY not in db.closed_day_hashes(DAY, DAY)
+    assert db.fetch_one("SELECT 1 AS found FROM customers WHERE customer_id = %s;", (customer_id,)) is None
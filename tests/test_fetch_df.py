@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+
+SQL = """
+    SELECT g AS id, 'name ' || g AS name, (g * 1.5)::numeric AS amount,
+           DATE '2026-01-01' + g AS day, NULLIF(g %% 2, 0) AS odd
+    FROM generate_series(1, %s) AS g;
+"""
+
+
+@pytest.mark.parametrize("method", ["copy", "tuples"])
+def test_matches_dict_rows(database, method):
+    df = database.fetch_df(SQL, (5,), method=method)
+    rows = pd.DataFrame(database.fetch_all(SQL, (5,)))
+
+    assert list(df.columns) == ["id", "name", "amount", "day", "odd"]
+    assert list(df["id"]) == list(rows["id"])
+    assert list(df["name"]) == list(rows["name"])
+    assert list(df["amount"].astype(float)) == [float(a) for a in rows["amount"]]
+    assert pd.api.types.is_datetime64_any_dtype(df["day"])
+    assert list(df["day"].dt.date) == list(rows["day"])
+    assert df["odd"].isna().tolist() == [False, True, False, True, False]
+
+
+def test_empty_result_keeps_columns(database):
+    df = database.fetch_df(SQL, (0,))
+    assert df.empty and list(df.columns) == ["id", "name", "amount", "day", "odd"]
@@ -0,0 +1,52 @@
+from datetime import date
+
+import pandas as pd
+
+import db
+
+START = date(2026, 10, 1)
+
+
+def frames(paused_rows=()):
+    subs = pd.DataFrame({
+        "location_id": [1, 2],
+        # Ends inside the horizon (Oct 3) / runs past it.
+        "subscription_start": pd.to_datetime(["2026-09-28", "2026-10-02"]),
+        "length": [5, 30],
+        "subscription_days": [5, 30],
+    })
+    routes = pd.DataFrame({
+        "location_id": [1, 2, 0],
+        "location": ["Kondapur", "Madhapur", "No location"],
+        "driver_id": [7, None, None],
+        "driver_name": ["Ravi", None, None],
+    })
+    paused = pd.DataFrame(list(paused_rows), columns=["location_id", "delivery_date", "paused"])
+    paused["delivery_date"] = pd.to_datetime(paused["delivery_date"])
+    return subs, routes, paused
+
+
+def by_location(out, location_id, column):
+    return list(out.loc[out["location_id"] == location_id, column])
+
+
+def test_committed_covers_each_subscription_window():
+    out = db._forecast(*frames(), START, 5, rate=0.0)
+    assert list(out.columns) == ["date", "location_id", "location", "driver_id", "driver_name",
+                                 "committed", "renewals", "expected"]
+    assert by_location(out, 1, "committed") == [1, 1, 1, 0, 0]
+    assert by_location(out, 2, "committed") == [0, 1, 1, 1, 1]
+    assert by_location(out, 1, "driver_name")[0] == "Ravi"
+    assert by_location(out, 2, "driver_name")[0] == "Unassigned"
+
+
+def test_renewal_expected_after_term_ends():
+    out = db._forecast(*frames(), START, 5, rate=0.5)
+    assert by_location(out, 1, "renewals") == [0, 0, 0, 0.5, 0.5]
+    assert by_location(out, 1, "expected") == [1, 1, 1, 0.5, 0.5]
+    assert by_location(out, 2, "renewals") == [0] * 5
+
+
+def test_paused_deliveries_are_subtracted():
+    out = db._forecast(*frames([(2, "2026-10-03", 1)]), START, 5, rate=0.0)
+    assert by_location(out, 2, "committed") == [0, 1, 0, 1, 1]
@@ -0,0 +1,55 @@
+import pandas as pd
+
+import db
+
+
+def sheet(**overrides):
+    row = {"full_name": "Asha", "phone_number": "9876543210", "address": "addr",
+           "plan_name": "", "location": "Kondapur", "subscription_start": "2026-10-01",
+           "subscription_days": "30"}
+    row.update(overrides)
+    return row
+
+
+def test_valid_rows_get_defaults():
+    valid, errors = db.validate_customer_import(pd.DataFrame([
+        sheet(),
+        sheet(phone_number="9876543211.0", subscription_start="", subscription_days=None),
+    ]))
+    assert errors.empty
+    assert valid["plan_name"].isna().all()      # blank plans are left to the merge
+    assert list(valid["phone_number"]) == ["9876543210", "9876543211"]
+    assert list(valid["subscription_days"]) == [30, 30]
+
+
+def test_rejects_bad_rows_with_row_numbers():
+    valid, errors = db.validate_customer_import(pd.DataFrame([
+        sheet(),
+        sheet(phone_number="12345"),
+        sheet(full_name=" "),
+        sheet(subscription_start="not a date"),
+        sheet(subscription_days="0"),
+        sheet(subscription_days="29.7"),
+    ]))
+    assert list(valid["row_no"]) == [1]
+    assert list(errors["row_no"]) == [2, 3, 4, 5, 6]
+    assert errors.loc[errors["row_no"] == 6, "error"].item() == "subscription_days must be a whole number."
+
+
+def test_reimport_without_plans_keeps_existing_plans(database):
+    db = database
+    phones = ["5559900001", "5559900002"]
+    db.execute("DELETE FROM customers WHERE phone_number = ANY(%s);", (phones,))
+    try:
+        db.bulk_import_customers(pd.DataFrame([
+            sheet(phone_number=phones[0], plan_name="Weekly", location=""),
+            sheet(phone_number=phones[1], location=""),
+        ]))
+        db.bulk_import_customers(pd.DataFrame([sheet(phone_number=p, location="") for p in phones]))
+        plans = db.fetch_all("""
+            SELECT plan_name FROM customers WHERE phone_number = ANY(%s) ORDER BY phone_number;
+        """, (phones,))
+        assert [r["plan_name"] for r in plans] == ["Weekly", "Monthly"]
+    finally:
+        for row in db.fetch_all("SELECT customer_id FROM customers WHERE phone_number = ANY(%s);", (phones,)):
+            db.delete_customer(row["customer_id"])
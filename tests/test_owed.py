@@ -0,0 +1,150 @@
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def customer(database):
+    db = database
+    start = date.today() - timedelta(days=10)
+    driver_id = db.add_driver("Owed Test Driver", "9999900001")
+    customer_id = db.fetch_one("""
+        INSERT INTO customers (full_name, phone_number, address, plan_name, location,
+                               subscription_start, subscription_days)
+        VALUES ('Owed Test', '9999900002', 'addr', 'Monthly', NULL, %s, 30)
+        RETURNING customer_id;
+    """, (start,))["customer_id"]
+    days = [start + timedelta(days=i) for i in range(3)]
+    assignment_ids = [
+        db.fetch_one("""
+            INSERT INTO assignments (assign_date, customer_id, driver_id)
+            VALUES (%s, %s, %s) RETURNING assignment_id;
+        """, (day, customer_id, driver_id))["assignment_id"]
+        for day in days
+    ]
+    yield customer_id, list(zip(assignment_ids, days))
+    db.delete_customer(customer_id)
+    db.delete_driver(driver_id)
+
+
+def drift(db, customer_id):
+    return [r for r in db.reconcile_owed() if r["customer_id"] == customer_id]
+
+
+def stored_owed(db, customer_id):
+    return db.fetch_one("SELECT owed FROM customers WHERE customer_id = %s;", (customer_id,))["owed"]
+
+
+def test_status_replay_never_drifts(database, customer):
+    db = database
+    customer_id, stops = customer
+    (first, day1), (second, day2), _ = stops
+
+    sequence = [
+        (first, day1, "missed", 1),
+        (first, day1, "paused", 0),      # missed -> paused
+        (first, day1, "missed", 1),      # paused -> missed
+        (second, day2, "missed", 2),
+        (first, day1, "delivered", 1),   # missed -> delivered
+        (second, day2, "missed", 1),     # unchanged
+        (second, day2, "paused", 0),
+        (first, day1, "missed", 1),      # delivered -> missed
+    ]
+    for assignment_id, day, status, expected in sequence:
+        if status == "paused":
+            db.pause_delivery_for_customer(customer_id, day)
+        else:
+            db.upsert_delivery(assignment_id, day, status)
+        assert stored_owed(db, customer_id) == expected, (assignment_id, status)
+        assert drift(db, customer_id) == [], (assignment_id, status)
+
+    ledger = db.fetch_one("SELECT SUM(delta) AS owed FROM owed_ledger WHERE customer_id = %s;",
+                          (customer_id,))
+    assert ledger["owed"] == 1
+
+
+def test_renewal_records_reset(database, customer):
+    db = database
+    customer_id, stops = customer
+    assignment_id, day = stops[0]
+
+    db.upsert_delivery(assignment_id, day, "missed")
+    db.upsert_delivery(assignment_id, day, "delivered")
+    db.renew_subscription(customer_id, 30)
+
+    assert stored_owed(db, customer_id) == 0
+    assert drift(db, customer_id) == []
+    renewal = db.fetch_all("SELECT delta FROM owed_ledger WHERE customer_id = %s AND reason = 'renewal';",
+                           (customer_id,))
+    assert [r["delta"] for r in renewal] == [0]
+
+
+def test_renewal_rate_counts_renewals_by_replaced_end(database, customer):
+    db = database
+    customer_id, _ = customer
+    before = db.renewal_rate()
+
+    # An early renewal: the replaced subscription ends in 20 days, outside
+    # the window, so it leaves the rate alone.
+    db.renew_subscription(customer_id, 30)
+    row = db.fetch_one("""
+        SELECT subscription_end FROM owed_ledger
+        WHERE customer_id = %s AND reason = 'renewal';
+    """, (customer_id,))
+    assert row["subscription_end"] == date.today() + timedelta(days=20)
+    assert db.renewal_rate() == before
+
+    # A lapsed subscription (ended 10 days ago) that is renewed moves from
+    # the lapsed count to the renewed count.
+    db.execute("UPDATE customers SET subscription_start = %s WHERE customer_id = %s;",
+               (date.today() - timedelta(days=40), customer_id))
+    lapsed = db.renewal_rate()
+    db.renew_subscription(customer_id, 30)
+    renewed = db.renewal_rate()
+    assert 0 <= lapsed < renewed <= 1
+
+
+def test_resaving_a_status_keeps_marked_at(database, customer):
+    db = database
+    customer_id, stops = customer
+    assignment_id, day = stops[0]
+
+    def marked():
+        return db.fetch_one("""
+            SELECT status, marked_at FROM deliveries
+            WHERE assignment_id = %s AND delivery_date = %s;
+        """, (assignment_id, day))
+
+    db.upsert_delivery(assignment_id, day, "delivered")
+    first = marked()
+    db.upsert_delivery(assignment_id, day, "delivered")
+    assert marked() == first
+    db.upsert_delivery(assignment_id, day, "missed")
+    changed = marked()
+    assert changed["status"] == "missed" and changed["marked_at"] > first["marked_at"]
+
+
+def test_concurrent_marks_of_one_stop_count_once(database, customer):
+    import threading
+
+    db = database
+    customer_id, stops = customer
+    assignment_id, day = stops[0]
+
+    # The first mark holds its transaction open while a second one runs.
+    with db.get_conn() as conn:
+        with conn.cursor(cursor_factory=db.RealDictCursor) as cur:
+            db._record_owed_transition(cur, assignment_id, "missed", day)
+            cur.execute("""
+                INSERT INTO deliveries (assignment_id, delivery_date, status)
+                VALUES (%s, %s, 'missed');
+            """, (assignment_id, day))
+            second = threading.Thread(target=db.upsert_delivery, args=(assignment_id, day, "missed"))
+            second.start()
+            second.join(timeout=0.5)
+            assert second.is_alive()        # waiting for the customer lock
+        conn.commit()
+    second.join()
+
+    assert stored_owed(db, customer_id) == 1
+    assert drift(db, customer_id) == []
@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def drivers(database):
+    """Two drivers with room for one stop each; every other driver is full."""
+    db = database
+    saved = db.fetch_all("SELECT driver_id, capacity, shift_minutes FROM drivers;")
+    saved_service = db.fetch_all("SELECT location_id, service_minutes FROM locations;")
+    db.execute("UPDATE drivers SET capacity = 0;")
+    a = db.add_driver("Placement Driver A", "9999900011")
+    b = db.add_driver("Placement Driver B", "9999900012")
+    db.update_driver_capacities([a, b], [1, 1], [None, None])
+    customers = []
+    yield a, b, customers
+    for customer_id in customers:
+        db.delete_customer(customer_id)
+    db.execute("DELETE FROM locations WHERE name = 'Placement Test Location';")
+    db.delete_driver(a)
+    db.delete_driver(b)
+    db.update_driver_capacities([r["driver_id"] for r in saved], [r["capacity"] for r in saved],
+                                [r["shift_minutes"] for r in saved])
+    db.set_location_service_minutes([r["location_id"] for r in saved_service],
+                                    [r["service_minutes"] for r in saved_service])
+
+
+def todays_driver(db, customer_id):
+    row = db.fetch_one("SELECT driver_id FROM assignments WHERE customer_id = %s AND assign_date = %s;",
+                       (customer_id, date.today()))
+    return row and row["driver_id"]
+
+
+def test_incremental_placement_respects_capacity(database, drivers):
+    db = database
+    a, b, customers = drivers
+
+    def add(n):
+        customer_id = db.add_customer(f"Placement Test {n}", f"99999000{20 + n}", "addr", "Monthly",
+                                      "Placement Test Location", date.today(), 30)
+        customers.append(customer_id)
+        return customer_id
+
+    first = add(1)
+    location_id = db.fetch_one("SELECT location_id FROM customers WHERE customer_id = %s;",
+                               (first,))["location_id"]
+    db.set_location_driver(location_id, a)
+    assert db.assign_customer_incrementally(first, relocate=True)["driver_id"] == a
+    assert todays_driver(db, first) == a
+
+    # The location's driver is full: the next customer goes to the one with room.
+    second = add(2)
+    assert todays_driver(db, second) == b
+
+    # Nobody has room: the customer is left unassigned today.
+    third = add(3)
+    assert todays_driver(db, third) is None
+    assert db.assign_customer_incrementally(third)["unplaced"] >= 1
+
+
+def test_customers_without_a_location_are_reassigned_one_by_one(database, drivers):
+    db = database
+    a, b, customers = drivers
+    source = db.add_driver("Placement Driver C", "9999900013")
+    day = date.today() + timedelta(days=3)
+    try:
+        for n in (4, 5):
+            customers.append(db.add_customer(f"Placement Test {n}", f"99999000{20 + n}", "addr", "Monthly",
+                                             "", date.today(), 30))
+        db.execute("DELETE FROM assignments WHERE customer_id = ANY(%s) AND assign_date = %s;",
+                   (customers, day))
+        db.execute("""
+            INSERT INTO assignments (customer_id, driver_id, assign_date)
+            SELECT unnest(%s::int[]), %s, %s;
+        """, (customers, source, day))
+
+        assert db.reassign_driver_assignments(source, [a, b], day) == {a: 1, b: 1}
+    finally:
+        db.delete_driver(source)
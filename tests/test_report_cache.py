@@ -0,0 +1,80 @@
+import os
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import report_cache
+
+DAYS = [date(2026, 10, 1) + timedelta(days=i) for i in range(5)]
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(report_cache, "_memory", report_cache.OrderedDict())
+    return tmp_path
+
+
+@pytest.fixture
+def closed(monkeypatch):
+    hashes = {}
+    monkeypatch.setattr(report_cache.db, "closed_day_hashes",
+                        lambda f, t: {d: h for d, h in hashes.items() if f <= d <= t})
+    return hashes
+
+
+class Loader:
+    """Per-day rows from a fixed frame, recording the runs it was asked for."""
+    def __init__(self):
+        self.frame = pd.DataFrame({
+            "day": pd.to_datetime(DAYS).repeat(2).astype("datetime64[us]"),
+            "driver_id": [1, 2] * len(DAYS),
+            "stops": range(2 * len(DAYS)),
+        })
+        self.calls = []
+
+    def __call__(self, from_date, to_date):
+        self.calls.append((from_date, to_date))
+        days = self.frame["day"].dt.date
+        return self.frame[(days >= from_date) & (days <= to_date)].reset_index(drop=True)
+
+
+def test_runs_are_split_around_cached_days_and_written_back(cache, closed):
+    closed.update({DAYS[0]: "a", DAYS[1]: "b", DAYS[3]: "d"})
+    loader = Loader()
+
+    first = report_cache.range_frame("stops", loader, DAYS[0], DAYS[-1])
+    assert loader.calls == [(DAYS[0], DAYS[-1])]
+    assert sorted(os.listdir(cache)) == ["stops-a.parquet", "stops-b.parquet", "stops-d.parquet"]
+    pd.testing.assert_frame_equal(first, loader.frame)
+
+    loader.calls.clear()
+    report_cache._memory.clear()
+    second = report_cache.range_frame("stops", loader, DAYS[0], DAYS[-1])
+    assert loader.calls == [(DAYS[2], DAYS[2]), (DAYS[4], DAYS[4])]
+    pd.testing.assert_frame_equal(second, loader.frame)
+
+
+def test_reclosed_day_gets_a_new_file(cache, closed):
+    closed[DAYS[0]] = "a"
+    loader = Loader()
+    report_cache.range_frame("stops", loader, DAYS[0], DAYS[0])
+    closed[DAYS[0]] = "a2"
+    report_cache.range_frame("stops", loader, DAYS[0], DAYS[0])
+    assert loader.calls == [(DAYS[0], DAYS[0])] * 2
+    assert sorted(os.listdir(cache)) == ["stops-a.parquet", "stops-a2.parquet"]
+
+
+def test_evict_removes_least_recently_read_first(cache):
+    for age, name in enumerate(["new", "mid", "old"]):
+        path = cache / f"r-{name}.parquet"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (1_000_000 - age, 1_000_000 - age))
+    (cache / "ignored.tmp").write_bytes(b"x" * 1000)
+
+    assert report_cache.evict(max_bytes=250) == 1
+    assert sorted(os.listdir(cache)) == ["ignored.tmp", "r-mid.parquet", "r-new.parquet"]
+    assert report_cache.evict(max_bytes=100) == 1
+    assert report_cache.evict(max_bytes=1000) == 0
+    assert sorted(os.listdir(cache)) == ["ignored.tmp", "r-new.parquet"]
@@ -0,0 +1,64 @@
+import psycopg2
+import pytest
+from psycopg2 import errors
+
+import db
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(db, "_setting", lambda key: db.CONNECT_DEFAULTS[key])
+    monkeypatch.setattr(db.time, "sleep", lambda seconds: None)
+
+
+def flaky(*failures):
+    """A function that raises each of `failures` in turn, then returns 'ok'."""
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return "ok"
+    return fn, calls
+
+
+def test_transient_errors_are_retried():
+    fn, calls = flaky(errors.SerializationFailure(), errors.AdminShutdown())
+    assert db.retry_transient()(fn)() == "ok"
+    assert len(calls) == 3
+
+
+def test_gives_up_after_the_configured_retries():
+    fn, calls = flaky(*[errors.DeadlockDetected()] * 10)
+    with pytest.raises(errors.DeadlockDetected):
+        db.retry_transient()(fn)()
+    assert len(calls) == db.CONNECT_DEFAULTS["DB_CONNECT_RETRIES"] + 1
+
+
+def test_dropped_connection_is_only_retried_for_reads():
+    fn, calls = flaky(psycopg2.OperationalError("server closed the connection unexpectedly"))
+    with pytest.raises(psycopg2.OperationalError):
+        db.retry_transient()(fn)()
+    fn, calls = flaky(psycopg2.OperationalError("server closed the connection unexpectedly"))
+    assert db.retry_transient(read_only=True)(fn)() == "ok"
+
+
+def test_other_errors_are_not_retried_and_leave_the_breaker_alone():
+    fn, calls = flaky(errors.UniqueViolation())
+    with pytest.raises(errors.UniqueViolation):
+        db.retry_transient()(fn)()
+    assert len(calls) == 1
+    assert db.BREAKER.failures == 0
+
+
+def test_statement_timeout_override(monkeypatch):
+    seen = {}
+    monkeypatch.setattr(db.psycopg2, "connect", lambda **kwargs: seen.update(kwargs))
+    monkeypatch.setattr(db.st, "secrets", {"DB_HOST": "h", "DB_NAME": "n", "DB_USER": "u",
+                                           "DB_PASSWORD": "p", "DB_SSLMODE": "disable"})
+    db._connect()
+    assert seen["options"] == "-c statement_timeout=30000"
+    monkeypatch.setattr(db, "_statement_timeout_ms", 0)
+    db._connect()
+    assert seen["options"] == ""
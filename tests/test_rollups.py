@@ -0,0 +1,108 @@
+import time
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+import db
+import report_cache
+from models import Driver
+
+
+@pytest.fixture
+def per_day(monkeypatch):
+    """Serve a fixed per-day frame from report_cache for three drivers."""
+    frames = {}
+    monkeypatch.setattr(report_cache, "range_frame",
+                        lambda report, loader, from_date, to_date, day_column="day": frames["days"].copy())
+    monkeypatch.setattr(db, "list_drivers", lambda: [
+        Driver(1, "Asha", "9000000001", None, None),
+        Driver(2, "Bala", "9000000002", None, None),
+        Driver(3, "Chitra", "9000000003", None, None),
+    ])
+    return frames
+
+
+@pytest.fixture
+def kolkata(monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def days(*values):
+    return pd.to_datetime(list(values)).astype("datetime64[us]")
+
+
+def test_leaderboard_rolls_up_driver_days(per_day):
+    per_day["days"] = pd.DataFrame({
+        "day": days("2026-10-05", "2026-10-06", "2026-10-12", "2026-10-05"),
+        "driver_id": [1, 1, 1, 2],
+        "assigned": [4, 2, 3, 2],
+        "delivered": [3, 2, 1, 2],
+        "missed": [1, 0, 1, 0],
+        "paused": [0, 0, 1, 0],
+    })
+
+    board = db.driver_leaderboard(date(2026, 10, 5), date(2026, 10, 18))
+    assert [r["driver_name"] for r in board] == ["Asha", "Bala", "Chitra"]
+    asha, bala, chitra = board
+    assert (asha["assigned"], asha["delivered"], asha["missed"], asha["paused"]) == (9, 6, 2, 1)
+    assert asha["missed_rate"] == 0.25
+    assert asha["weekly_trend"] == [
+        {"week": "2026-10-05", "assigned": 6, "delivered": 5, "missed": 1, "paused": 0},
+        {"week": "2026-10-12", "assigned": 3, "delivered": 1, "missed": 1, "paused": 1},
+    ]
+    assert bala["missed_rate"] == 0.0
+    # No stops at all: no rate, sorted last.
+    assert (chitra["assigned"], chitra["missed_rate"], chitra["weekly_trend"]) == (0, None, [])
+
+    by_name = db.driver_leaderboard(date(2026, 10, 5), date(2026, 10, 18), sort_by="driver_name")
+    assert [r["driver_id"] for r in by_name] == [1, 2, 3]
+    with pytest.raises(ValueError):
+        db.driver_leaderboard(date(2026, 10, 5), date(2026, 10, 18), sort_by="phone")
+
+
+def route_days():
+    return pd.DataFrame({
+        "driver_id": [1, 1, 2],
+        "day": days("2026-10-05", "2026-10-06", "2026-10-05"),
+        "stops": [5, 1, 3],
+        "first_stop": days("2026-10-05 03:00", "2026-10-06 05:00", "2026-10-05 02:00"),
+        "last_stop": days("2026-10-05 04:00", "2026-10-06 05:00", "2026-10-05 03:00"),
+        "route_minutes": [60.0, 0.0, 60.0],
+        "max_gap_minutes": [20.0, 0.0, 15.0],
+        "idle_minutes": [20.0, 0.0, 0.0],
+        "in_order": [3, 1, 3],
+        "avg_displacement": [0.4, 0.0, 0.0],
+    })
+
+
+def test_throughput_per_driver(per_day):
+    per_day["days"] = route_days()
+
+    out = db.driver_throughput(date(2026, 10, 5), date(2026, 10, 6))
+    # Slowest first.
+    assert [r["driver_name"] for r in out] == ["Bala", "Asha"]
+    bala, asha = out
+    assert bala["stops_per_hour"] == 2.0
+    # The single-stop day adds a stop and a route-day but no moving time.
+    assert (asha["stops"], asha["route_days"], asha["route_minutes"]) == (6, 2, 60.0)
+    assert asha["stops_per_hour"] == 4.0
+    assert (asha["max_gap_minutes"], asha["idle_minutes"]) == (20.0, 20.0)
+    assert asha["in_order"] == round(4 / 6, 3)
+    assert asha["avg_displacement"] == round(2 / 6, 2)
+
+
+def test_throughput_by_day_in_local_time(per_day, kolkata):
+    per_day["days"] = route_days()
+
+    out = db.driver_throughput(date(2026, 10, 5), date(2026, 10, 6), driver_id=1, by_day=True)
+    assert [r["day"] for r in out] == [date(2026, 10, 5), date(2026, 10, 6)]
+    first, single = out
+    assert first["first_stop"] == datetime(2026, 10, 5, 8, 30)
+    assert first["last_stop"] == datetime(2026, 10, 5, 9, 30)
+    assert first["stops_per_hour"] == 4.0
+    assert single["stops_per_hour"] is None
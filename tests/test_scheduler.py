@@ -0,0 +1,81 @@
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def route(database):
+    """A driver with two customers on today's and tomorrow's route."""
+    db = database
+    today = date.today()
+    driver_id = db.add_driver("Scheduler Test Driver", "9999900031")
+    customer_ids = []
+    for n in range(2):
+        customer_ids.append(db.fetch_one("""
+            INSERT INTO customers (full_name, phone_number, address, plan_name, location,
+                                   subscription_start, subscription_days)
+            VALUES (%s, %s, 'addr', 'Monthly', NULL, %s, 30)
+            RETURNING customer_id;
+        """, (f"Scheduler Test {n}", f"99999000{40 + n}", today - timedelta(days=5)))["customer_id"])
+        for day in (today, today + timedelta(days=1)):
+            db.execute("INSERT INTO assignments (assign_date, customer_id, driver_id) VALUES (%s, %s, %s);",
+                       (day, customer_ids[-1], driver_id))
+    yield driver_id, customer_ids
+    for customer_id in customer_ids:
+        db.delete_customer(customer_id)
+    db.delete_driver(driver_id)
+
+
+def make_due(db, customer_id, event_type):
+    db.execute("""
+        UPDATE subscription_events SET next_event_at = now() - interval '1 minute'
+        WHERE customer_id = %s AND event_type = %s AND processed_at IS NULL;
+    """, (customer_id, event_type))
+
+
+def test_pause_keeps_planned_stops_and_their_drivers(database, route):
+    db = database
+    driver_id, (paused, other) = route
+    tomorrow = date.today() + timedelta(days=1)
+    standby = db.add_driver("Scheduler Test Standby", "9999900032")
+
+    def driver_on_tomorrow(customer_id):
+        return [r["driver_id"] for r in db.fetch_all(
+            "SELECT driver_id FROM assignments WHERE customer_id = %s AND assign_date = %s;",
+            (customer_id, tomorrow))]
+
+    try:
+        # Tomorrow's stop was moved by hand; neither the pause nor the
+        # resume check sends it back.
+        db.reassign_driver_assignments(driver_id, [standby], tomorrow, customer_ids=[paused])
+        db.pause_delivery_for_customer(paused, date.today())
+        assert driver_on_tomorrow(paused) == [standby]
+        assert driver_on_tomorrow(other) == [driver_id]
+
+        make_due(db, paused, "pause_resume")
+        assert db.run_due_events(customer_ids=[paused])["processed"] >= 1
+        assert driver_on_tomorrow(paused) == [standby]
+    finally:
+        db.delete_driver(standby)
+
+
+def test_expiry_notice_is_kept_after_purge(database, route):
+    db = database
+    driver_id, (customer_id, _) = route
+    # Last delivery day tomorrow: the notice is due today.
+    db.execute("UPDATE customers SET subscription_start = %s WHERE customer_id = %s;",
+               (date.today() - timedelta(days=29), customer_id))
+    db.run_due_events(customer_ids=[customer_id])
+    flagged = [r for r in db.list_expiring_customers() if r["customer_id"] == customer_id]
+    assert [r["subscription_end"] for r in flagged] == [date.today() + timedelta(days=1)]
+
+    db.execute("""
+        UPDATE subscription_events SET processed_at = now() - interval '40 days'
+        WHERE customer_id = %s AND processed_at IS NOT NULL;
+    """, (customer_id,))
+    assert db.purge_processed_events(retention_days=30) >= 1
+    assert db.fetch_one("""
+        SELECT COUNT(*) AS n FROM subscription_events
+        WHERE customer_id = %s AND processed_at IS NOT NULL;
+    """, (customer_id,))["n"] == 0
+    assert any(r["customer_id"] == customer_id for r in db.list_expiring_customers())
@@ -0,0 +1,60 @@
+from solver import solve
+
+
+def location(name, n, preferred=None, service_minutes=3, first_id=0):
+    return {"location": name, "customer_ids": list(range(first_id, first_id + n)),
+            "service_minutes": service_minutes, "preferred_driver_id": preferred}
+
+
+def driver(driver_id, capacity, shift_minutes=480, stops=0, minutes=0):
+    return {"driver_id": driver_id, "full_name": f"Driver {driver_id}", "capacity": capacity,
+            "shift_minutes": shift_minutes, "stops": stops, "minutes": minutes}
+
+
+def test_whole_location_goes_to_preferred_driver():
+    result = solve([location("A", 5, preferred=2)], [driver(1, 10), driver(2, 10)])
+    assert result["mapping"] == {"A": 2}
+    assert {d for _, d in result["assignments"]} == {2}
+    assert not result["split"] and not result["overflow"]
+
+
+def test_unmapped_location_goes_to_roomiest_driver():
+    result = solve([location("A", 3)], [driver(1, 10, stops=8), driver(2, 10, stops=2)])
+    assert result["mapping"] == {"A": 2}
+
+
+def test_full_preferred_driver_sends_location_elsewhere_whole():
+    locations = [location("Big", 8, preferred=1), location("Small", 4, preferred=1, first_id=100)]
+    result = solve(locations, [driver(1, 10), driver(2, 5)])
+    assert result["mapping"] == {"Big": 1, "Small": 2}
+    assert not result["split"] and not result["overflow"]
+
+
+def test_location_too_big_for_anyone_is_split_then_overflows():
+    result = solve([location("A", 12, preferred=1)], [driver(1, 5), driver(2, 4)])
+    assert result["split"] == ["A"]
+    counts = {}
+    for _, d in result["assignments"]:
+        counts[d] = counts.get(d, 0) + 1
+    assert counts == {1: 5, 2: 4}
+    assert result["overflow"] == [{"location": "A", "customer_ids": [9, 10, 11]}]
+
+
+def test_shift_length_limits_stops():
+    result = solve([location("A", 10, service_minutes=30)], [driver(1, 100, shift_minutes=240)])
+    assert len(result["assignments"]) == 8
+    (report,) = result["drivers"]
+    assert report["stops"] == 8 and report["shift_used"] == 1.0 and report["capacity_used"] == 0.08
+
+
+def test_drivers_without_limits_take_everything_and_share_it():
+    locations = [location("A", 40), location("B", 30, first_id=100), location("C", 20, first_id=200)]
+    result = solve(locations, [driver(1, None, shift_minutes=None), driver(2, None, shift_minutes=None)])
+    assert not result["overflow"] and not result["split"]
+    assert result["mapping"] == {"A": 1, "B": 2, "C": 2}
+    assert all(d["capacity_used"] is None and d["shift_used"] is None for d in result["drivers"])
+
+
+def test_untimed_locations_ignore_shift_length():
+    result = solve([location("A", 50, service_minutes=0)], [driver(1, 60, shift_minutes=10)])
+    assert len(result["assignments"]) == 50